@@ -3,34 +3,43 @@
 import scripts
 
 
+@scripts.memoize.memoize
+def get_audio_video_lb_address(as_config_file, vs_config_file):
+    """
+    Look up the Audio and Video server LB addresses. Each pair of config files is
+    looked up only once per run.
+    """
+    # Get Audio Server LB details
+    options = scripts.options.get_options()
+    no_error_check = options.destroy() or options.dry_run()
+    server_config = scripts.arg_parser.parse_config_from(as_config_file)
+    elb_client = scripts.aws_client_elb.ElbClient(server_config)
+    _, as_lb = elb_client.get_lb_details()
+    if as_lb is None:
+        if no_error_check:
+            pass
+        else:
+            raise Exception('AudioServer LB not found')
+    # Get Video Server LB details
+    video_config = scripts.arg_parser.parse_config_from(vs_config_file)
+    elb_client = scripts.aws_client_elb.ElbClient(video_config)
+    _, vs_lb = elb_client.get_lb_details()
+    if vs_lb is None:
+        if no_error_check:
+            pass
+        else:
+            raise Exception('VideoServer LB not found')
+    as_port, _, _ = server_config.get_listener_info()
+    vs_port, _, _ = video_config.get_listener_info()
+    return as_lb, str(as_port), vs_lb, str(vs_port)
+
+
 class AwsCustomFunctions():
     def set_env(self, env):
         self.config = env
 
     def _get_audio_video_lb_address(self, as_config_file, vs_config_file):
-        # Get Audio Server LB details
-        options = scripts.options.get_options()
-        no_error_check = options.destroy() or options.dry_run()
-        server_config = scripts.arg_parser.parse_config_from(as_config_file)
-        elb_client = scripts.aws_client_elb.ElbClient(server_config)
-        _, as_lb = elb_client.get_lb_details()
-        if as_lb is None:
-            if no_error_check:
-                pass
-            else:
-                raise Exception('AudioServer LB not found')
-        # Get Video Server LB details
-        video_config = scripts.arg_parser.parse_config_from(vs_config_file)
-        elb_client = scripts.aws_client_elb.ElbClient(video_config)
-        _, vs_lb = elb_client.get_lb_details()
-        if vs_lb is None:
-            if no_error_check:
-                pass
-            else:
-                raise Exception('VideoServer LB not found')
-        as_port, _, _ = server_config.get_listener_info()
-        vs_port, _, _ = video_config.get_listener_info()
-        return as_lb, str(as_port), vs_lb, str(vs_port)
+        return get_audio_video_lb_address(as_config_file, vs_config_file)
 
     def get_rtc_cmdline_params_port_range(self, as_config_file, vs_config_file):
         """
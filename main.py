@@ -5,7 +5,8 @@ Put all parts of cluster together.
 """
 import scripts
 import aws_custom_functions
-import tempfile
+import sys
+import threading
 
 logger = scripts.logger.getLogger()
 
@@ -18,7 +19,9 @@ def setup_and_parse_args():
     python ./main.py --file=<config-file.yaml> --create 
     python ./main.py --file=<config-file.yaml> --destroy
     python ./main.py --file=<config-file.yaml> --upgrade # Do a rolling upgrade
-    """)
+    python ./main.py --stack <config-file.yaml> <config-file.yaml> ... --create # Deploy several services
+    python ./main.py --file=<config-file.yaml> --regions <overlay.yaml> <overlay.yaml> ... --upgrade # Upgrade in several regions
+    """, file_required=False)
     parser.add_argument(
         '--upgrade',
         default=False,
@@ -50,22 +53,91 @@ def setup_and_parse_args():
         default=True,
         action="store_true",
         help='If false then --upgrade won\'t wait for taargets to become healthy before downscaling')
+    parser.add_argument(
+        '--no_plan',
+        default=False,
+        action="store_true",
+        help='If true then --create makes every create/update call instead of only the ones needed')
+    parser.add_argument(
+        '--force_upgrade',
+        default=False,
+        action="store_true",
+        help='If true then --upgrade rolls the instances and forces a new deployment even if the task definition is unchanged')
+    parser.add_argument(
+        '--resolved_yaml',
+        default=None,
+        help='If set then the fully resolved YAML of --file is written to this file')
+    parser.add_argument(
+        '--api_metrics',
+        default=None,
+        help='If set then the AWS API call statistics are also written to this file as JSON')
+    parser.add_argument(
+        '--trace',
+        default=None,
+        help='If set then the deploy phases and AWS API calls are written to this file as '
+        'Chrome trace-event JSON, open it in chrome://tracing or Perfetto')
+    parser.add_argument(
+        '--events',
+        default=None,
+        help='If set then progress events are written to this file as JSON lines: phases, '
+        'mutating AWS calls, convergence snapshots and outcomes. Use fd:N to write them to '
+        'the open file descriptor N')
+    parser.add_argument(
+        '--state_dir',
+        default=None,
+        help='If set then the ARNs and DNS names of the resources of each config are kept in '
+        'this directory between runs to skip looking them up again')
+    parser.add_argument(
+        '--stack',
+        nargs='+',
+        default=None,
+        help='Config files of several services to deploy together. Services are deployed after '
+        'the services they reference through !AwsCustomFunction, independent ones concurrently')
+    parser.add_argument(
+        '--regions',
+        nargs='+',
+        default=None,
+        help='Overlay files with the region specific values of --file, e.g. region, subnets, vpc '
+        'and ami. The action runs in all the regions concurrently')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=scripts.stack.DEFAULT_MAX_WORKERS,
+        help='Maximum number of services of a --stack deployed at the same time')
     return parser
 
 
+# The custom function map is global to the YAML loader, so configs are loaded one at a time.
+_load_lock = threading.Lock()
+
+
+def load_config(filename, resolved_yaml_file=None, overlay_file=None):
+    """
+    Load |filename| and resolve all its custom functions. The values of |overlay_file| are
+    applied on top if one is given. The fully resolved YAML is written to |resolved_yaml_file|
+    if one is given.
+    """
+    with _load_lock:
+        # Create the custom function instance and pass it to build the config file
+        aws_functions = aws_custom_functions.AwsCustomFunctions()
+        env = scripts.arg_parser.parse_config_from(
+            filename, aws_functions.get_custom_functions_map())
+        if overlay_file is not None:
+            overlay = scripts.service_config.load_overlay(
+                overlay_file, aws_functions.get_custom_functions_map())
+            env = scripts.service_config.apply_overlay(env, overlay)
+        aws_functions.set_env(env)
+        env = scripts.service_config.resolve_config(env)
+    if resolved_yaml_file is not None:
+        with open(resolved_yaml_file, 'w') as out:
+            logger.info('Writing fully resolved YAML file to %s', out.name)
+            env.dump(out)
+    return env
+
+
 def load_env(args):
     scripts.options.create_options(args)
-    # Create the custom function instance and pass it to build the config file
-    aws_functions = aws_custom_functions.AwsCustomFunctions()
-    env = scripts.arg_parser.parse_config_from(
-        args.file, aws_functions.get_custom_functions_map())
-    aws_functions.set_env(env)
-    # Write out a temporary YAML to a file which is fully resolved
-    with tempfile.NamedTemporaryFile(suffix='-out.yaml', delete=False) as out:
-        logger.info('Writing fully resolved YAML file to %s', out.name)
-        env.dump(out)
-    env = scripts.arg_parser.parse_config_from(out.name, None)
-    return env
+    return load_config(args.file, args.resolved_yaml)
 
 def _input(display):
     input_func = None
@@ -76,56 +148,179 @@ def _input(display):
     ret = input_func(display)
     return ret
 
-def __main__():
-    parser = setup_and_parse_args()
-    # parse command line args and set options
-    args = scripts.arg_parser.parse(parser)
-    logger.info(
-        '------------------------------------------------------------------------------------')
-    logger.info('Running AWS Graaaaaaaaaaaaaaaaapes script with args: %s', args)
-    config = load_env(args)
-    verb = ""
+def _get_verb(args):
     if args.destroy:
-        verb = "Destroying "
+        return "Destroying "
     elif args.create:
-        verb = "Creating   "
+        return "Creating   "
     elif args.upgrade:
-        verb = "Upgrading  "
+        return "Upgrading  "
     elif args.dry_run:
-        verb = "Testing    "
-    else:
-        logger.info('Nothing to do')
-        return 1
+        return "Testing    "
+    return None
+
+
+def _confirm(configs, args):
+    """
+    Ask the user to confirm the action on |configs|. Returns True if confirmed.
+    """
+    verb = _get_verb(args)
     print('------------------------------------------------------------------------------------')
     print('AWS Deploy Script')
-    print('{0} {1}, {2}'.format(verb, config.get_raw_service_name(), config.get_service_version()))
-    print('Environment {0}{1}'.format(config.get_prefix_str(), config.get_region()))
+    for config in configs:
+        print('{0} {1}, {2}'.format(verb, config.get_raw_service_name(), config.get_service_version()))
+        print('Environment {0}{1}'.format(config.get_prefix_str(), config.get_region()))
     if args.dry_run:
         print('(Dry run only, no changes will be made)')
     print('------------------------------------------------------------------------------------')
     confirm = _input("Type 'yes' to continue...")
     if confirm != "yes":
         logger.warn('Aborting')
-        return 0 
-    checkprod = config.get_prefix_str()
-    logger.debug(checkprod)
-    if checkprod.startswith("prod"):
-        confirm = _input("This is a PRODUCTION environment, type 'yes' to continue...")
-        if confirm != "yes":
-            logger.warn('Aborting')
-            return 0 
+        return False
+    for config in configs:
+        checkprod = config.get_prefix_str()
+        logger.debug(checkprod)
+        if checkprod.startswith("prod"):
+            confirm = _input("This is a PRODUCTION environment, type 'yes' to continue...")
+            if confirm != "yes":
+                logger.warn('Aborting')
+                return False
+            break
+    return True
 
+
+def _get_action(args):
+    for action in ('destroy', 'create', 'upgrade', 'dry_run'):
+        if getattr(args, action):
+            return action
+    return None
+
+
+def _run_action(args, config):
+    with scripts.events.action(_get_action(args), config):
+        if args.destroy:
+            scripts.cluster.destroy_cluster(config, args.destroy_sqs)
+        elif args.create:
+            scripts.cluster.create_or_update_cluster(config)
+        elif args.upgrade:
+            scripts.cluster.upgrade_cluster(config)
+        elif args.dry_run:
+            logger.info('Dry run only, dumping config:\n%s', config.dump())
+            print(scripts.cluster.plan_cluster(config).to_json())
+        else:
+            logger.info('Nothing to do')
+
+
+def _run_stack(args):
+    """
+    Deploy all the configs passed with --stack in dependency order.
+    """
+    scripts.options.create_options(args)
+    nodes = scripts.stack.load_stack(args.stack)
+    if not _confirm([nodes[f].config for f in scripts.stack.get_deploy_order(nodes)], args):
+        return 0
     if args.destroy:
-        scripts.cluster.destroy_cluster(config, args.destroy_sqs)
-    elif args.create:
-        scripts.cluster.create_or_update_cluster(config)
-    elif args.upgrade:
-        scripts.cluster.upgrade_cluster(config)
-    elif args.dry_run:
-        logger.info('Dry run only, dumping config:\n%s', config.dump())
-    else:
+        # Tear down the services before the services they depend on.
+        nodes = scripts.stack.reverse_dependencies(nodes)
+
+    def deploy(node):
+        # Configs are resolved only now since they may need their dependencies to be deployed.
+        _run_action(args, load_config(node.filename))
+
+    results = scripts.stack.deploy_stack(nodes, deploy, args.max_workers)
+    failed = [f for f, error in results.items() if error is not None]
+    for f in scripts.stack.get_deploy_order(nodes):
+        logger.info('%s: %s', f, 'FAILED ' + str(results[f]) if results[f] is not None else 'OK')
+    return 1 if failed else 0
+
+
+def _run_regions(args):
+    """
+    Run the action on --file in every region of --regions at the same time. A region which
+    fails, even to load its config, does not stop the others.
+    """
+    scripts.options.create_options(args)
+    configs = {}
+    # A region whose config does not load fails on its own too.
+    results = {}
+    for f in args.regions:
+        try:
+            configs[f] = load_config(args.file, overlay_file=f)
+        except Exception as e:
+            logger.error('Could not load %s with the overlay %s. Error: %s', args.file, f, e)
+            results[f] = e
+    loaded = [f for f in args.regions if f in configs]
+    if loaded:
+        if not _confirm([configs[f] for f in loaded], args):
+            return 0
+        # Regions don't depend on each other, and each uses its own clients.
+        nodes = dict((f, scripts.stack.StackNode(f, configs[f], set())) for f in loaded)
+        results.update(scripts.stack.deploy_stack(
+            nodes, lambda node: _run_action(args, node.config), len(nodes)))
+    failed = [f for f, error in results.items() if error is not None]
+    for f in args.regions:
+        logger.info('%s (%s): %s', f, configs[f].get_region() if f in configs else 'not loaded',
+                    'FAILED ' + str(results[f]) if results[f] is not None else 'OK')
+    return 1 if failed else 0
+
+
+def _report_api_metrics(args):
+    """
+    Print the per operation AWS API call statistics of the run.
+    """
+    if len(scripts.api_metrics.get_report()) == 0:
+        return
+    print('------------------------------------------------------------------------------------')
+    print('AWS API calls')
+    print(scripts.api_metrics.format_report())
+    if args.api_metrics is not None:
+        logger.info('Writing AWS API call statistics to %s', args.api_metrics)
+        scripts.api_metrics.write_json(args.api_metrics)
+
+
+def __main__():
+    parser = setup_and_parse_args()
+    # parse command line args and set options
+    args = scripts.arg_parser.parse(parser)
+    # Lookups cached by a previous run in this process may be stale
+    scripts.arg_parser.reset()
+    scripts.memoize.clear()
+    if args.trace is not None:
+        scripts.tracing.enable()
+    if args.events is not None:
+        scripts.events.open_stream(args.events)
+    outcome = 'failed'
+    try:
+        result = _run(parser, args)
+        outcome = 'failed' if result else 'ok'
+        return result
+    finally:
+        scripts.events.emit('run_end', outcome=outcome)
+        scripts.events.close()
+        _report_api_metrics(args)
+        if args.trace is not None:
+            logger.info('Writing trace to %s', args.trace)
+            scripts.tracing.write(args.trace)
+
+
+def _run(parser, args):
+    logger.info(
+        '------------------------------------------------------------------------------------')
+    logger.info('Running AWS Graaaaaaaaaaaaaaaaapes script with args: %s', args)
+    if _get_verb(args) is None:
         logger.info('Nothing to do')
+        return 1
+    if args.stack:
+        return _run_stack(args)
+    if args.file is None:
+        parser.error('one of --file or --stack is required')
+    if args.regions:
+        return _run_regions(args)
+    config = load_env(args)
+    if not _confirm([config], args):
+        return 0
+    _run_action(args, config)
 
 
 if __name__ == "__main__":
-    __main__()
+    sys.exit(__main__())
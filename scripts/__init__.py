@@ -3,4 +3,9 @@ import logger   # Initialize logger
 import arg_parser
 import cluster
 import aws_client
+import api_metrics
+import tracing
+import events
 import options
+import memoize
+import stack
@@ -0,0 +1,152 @@
+#!/bin/python
+
+"""
+Records per service/operation AWS API call statistics through the botocore event
+system: call count, latency percentiles, retries, throttles and errors.
+"""
+import json
+import threading
+import clock
+
+THROTTLING_ERROR_CODES = set([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+])
+
+_lock = threading.Lock()
+_stats = {}
+
+
+class OperationStats():
+    """
+    Statistics of a single service/operation.
+    """
+
+    def __init__(self, service, operation):
+        self.service = service
+        self.operation = operation
+        self.calls = 0
+        self.latencies = []
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+
+    def percentile(self, p):
+        if len(self.latencies) == 0:
+            return 0.0
+        values = sorted(self.latencies)
+        index = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+        return values[index]
+
+    def to_dict(self):
+        return {
+            'service': self.service,
+            'operation': self.operation,
+            'calls': self.calls,
+            'total_seconds': sum(self.latencies),
+            'p50_seconds': self.percentile(50),
+            'p95_seconds': self.percentile(95),
+            'p99_seconds': self.percentile(99),
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'errors': self.errors,
+        }
+
+
+def _get_stats(service, operation):
+    key = (service, operation)
+    stats = _stats.get(key)
+    if stats is None:
+        stats = OperationStats(service, operation)
+        _stats[key] = stats
+    return stats
+
+
+def _error_code(parsed):
+    if parsed is None:
+        return None
+    return parsed.get('Error', {}).get('Code')
+
+
+def _before_call(model, context, **kwargs):
+    context['api_metrics'] = (model.service_model.service_name, model.name, clock.time())
+
+
+def _after_call(parsed, context, **kwargs):
+    service, operation, start = context.get('api_metrics', (None, None, None))
+    if service is None:
+        return
+    metadata = parsed.get('ResponseMetadata', {})
+    with _lock:
+        stats = _get_stats(service, operation)
+        stats.calls += 1
+        stats.latencies.append(clock.time() - start)
+        stats.retries += metadata.get('RetryAttempts', 0)
+        if _error_code(parsed) is not None:
+            stats.errors += 1
+
+
+def _after_call_error(context, **kwargs):
+    service, operation, start = context.get('api_metrics', (None, None, None))
+    if service is None:
+        return
+    with _lock:
+        stats = _get_stats(service, operation)
+        stats.calls += 1
+        stats.latencies.append(clock.time() - start)
+        stats.errors += 1
+
+
+def _needs_retry(response, operation, **kwargs):
+    # Called once per attempt, count the attempts AWS throttled.
+    if response is None:
+        return None
+    if _error_code(response[1]) in THROTTLING_ERROR_CODES:
+        with _lock:
+            _get_stats(operation.service_model.service_name, operation.name).throttles += 1
+    return None
+
+
+def instrument(client):
+    """
+    Record the statistics of every call made through |client|.
+    """
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+    events.register('needs-retry', _needs_retry)
+
+
+def get_report():
+    """
+    Return the statistics of all operations as a list of dicts, slowest total time first.
+    """
+    with _lock:
+        rows = [s.to_dict() for s in _stats.values()]
+    return sorted(rows, key=lambda r: r['total_seconds'], reverse=True)
+
+
+def format_report():
+    lines = ['{0:<42} {1:>6} {2:>9} {3:>8} {4:>8} {5:>8} {6:>7} {7:>9} {8:>6}'.format(
+        'operation', 'calls', 'total(s)', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'retries', 'throttles', 'errors')]
+    for r in get_report():
+        lines.append('{0:<42} {1:>6} {2:>9.2f} {3:>8.0f} {4:>8.0f} {5:>8.0f} {6:>7} {7:>9} {8:>6}'.format(
+            r['service'] + '.' + r['operation'], r['calls'], r['total_seconds'],
+            r['p50_seconds'] * 1000, r['p95_seconds'] * 1000, r['p99_seconds'] * 1000,
+            r['retries'], r['throttles'], r['errors']))
+    return '\n'.join(lines)
+
+
+def write_json(filename):
+    with open(filename, 'w') as f:
+        json.dump(get_report(), f, indent=4, sort_keys=True)
+
+
+def clear():
+    with _lock:
+        _stats.clear()
@@ -5,21 +5,28 @@ Creates the standard argument parser for use by the AWS CLI scripts
 """
 
 import argparse
+import copy
 import sys
 import service_config
-import tempfile
+import yaml_include
+import yaml_with_custom_extn
 import logger
 import string
 import os.path
+import threading
 
 logger = logger.getLogger()
 
+# Configs parsed without a custom function map keyed by (absolute path, include tree hash).
+_config_cache = {}
+_config_cache_lock = threading.Lock()
 
-def create_parser(desc):
+
+def create_parser(desc, file_required=True):
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description=desc)
     parser.add_argument('--file',
-                        required=True, help='The cluster config file')
+                        required=file_required, help='The cluster config file')
     return parser
 
 
@@ -31,38 +38,41 @@ def parse(parser):
     return args
 
 
-def preprocess_yaml_file(filename):
-    # Form a file suffix.
-    outfile_suffix = '-{}'.format(os.path.split(filename)[1])
-    with open(filename, 'r') as input_file:
-        with tempfile.NamedTemporaryFile(mode='w', suffix=outfile_suffix, delete=False) as out_file:
-            for line in input_file:
-                if line.startswith('import_file:'):
-                    # Bring in the imported file.
-                    parts = line.split()
-                    included_file = parts[1]
-                    with open(included_file, 'r') as imported_file:
-                        out_file.write('\n')
-                        out_file.write('#################### Begin file {}'.format(included_file))
-                        out_file.write('\n')
-                        for imported_file_line in imported_file:
-                            out_file.write(imported_file_line)
-                        out_file.write('\n')
-                        out_file.write('#################### End file {}'.format(included_file))
-                        out_file.write('\n')
-                else:
-                    out_file.write(line)
-            logger.info('Generated preprocessed file %s from %s',
-                        out_file.name, filename)
-            return out_file.name
+def preprocess_yaml(filename):
+    """
+    Return the contents of |filename| with the files referenced by 'import_file:' lines spliced in.
+    """
+    return yaml_include.resolve(filename)
 
 
 def parse_config_from(filename, custom_fn_map=None):
     """
     Return the parsed cluster config file.
+    Configs parsed without a custom function map are cached until the file changes, every
+    caller gets its own copy of the cached config.
+    """
+    if custom_fn_map is not None:
+        preprocessed = preprocess_yaml(filename)
+        return service_config.load_config_from_yaml(preprocessed, custom_fn_map)
+    key = (os.path.abspath(filename), yaml_include.get_tree_hash(filename))
+    with _config_cache_lock:
+        config = _config_cache.get(key)
+        if config is None:
+            preprocessed = preprocess_yaml(filename)
+            config = service_config.load_config_from_yaml(preprocessed, None)
+            _config_cache[key] = config
+        else:
+            logger.debug('Using cached config for %s', filename)
+        return copy.deepcopy(config)
+
+
+def reset():
+    """
+    Forget the configs and the custom function results cached by a previous run.
     """
-    preprocessed_file = preprocess_yaml_file(filename)
-    return service_config.load_config_with_extension(preprocessed_file, custom_fn_map)
+    with _config_cache_lock:
+        _config_cache.clear()
+    yaml_with_custom_extn.AwsCustomFunction.clear_results()
 
 
 def parse_config_from_args(parser, custom_fn_map=None):
@@ -70,7 +80,6 @@ def parse_config_from_args(parser, custom_fn_map=None):
     Return the parsed cluster config file and the command line arguments. Also do some basic checks.
     """
     args = parse(parser)
-    preprocessed_file = preprocess_yaml_file(args.file)
-    config = service_config.load_config_with_extension(preprocessed_file, custom_fn_map)
+    config = parse_config_from(args.file, custom_fn_map)
     # Check basic things in the config file
     return config, args
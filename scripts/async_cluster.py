@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+"""
+Asyncio API of the cluster operations, alongside the blocking one in cluster.py, so one
+event loop can deploy many services at once. It only schedules: the phases, the steps and
+the waits are the ones of cluster.py, phases.py and waiter.py. Blocking boto3 calls run on a bounded thread
+pool shared by the process. The phases of a create or destroy are scheduled from the event
+loop and each runs on that pool once its dependencies finished. The waits of a rolling
+upgrade poll from the event loop and only take a thread for each poll, not for the whole wait.
+
+The pool bounds the phases and calls started from the loop, not every thread: a phase
+which waits, like deleting the service or the auto scaling group, holds its pool thread
+for the whole wait, and bulk.run and ConvergenceWatcher.poll fan out on small pools of
+their own.
+
+Every task started on the loop has its own events context.
+
+Python 3 only, so the package does not import it.
+"""
+import asyncio
+import functools
+import threading
+from concurrent import futures
+import aws_client_auto_scaling
+import aws_client_ecs
+import aws_client_elb
+import clock
+import cluster
+import convergence
+import events
+import logger
+import phases
+import waiter
+
+DEFAULT_MAX_WORKERS = 16
+
+logger = logger.getLogger()
+
+_executor_lock = threading.Lock()
+_executor = None
+_max_workers = DEFAULT_MAX_WORKERS
+
+
+def set_max_workers(max_workers):
+    """
+    Bound the number of blocking calls running at the same time to |max_workers|.
+    Takes effect for calls made after the executor in use has finished its work.
+    """
+    global _executor, _max_workers
+    with _executor_lock:
+        _max_workers = max_workers
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=_max_workers)
+        return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the shared executor and return its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), events.bind(functools.partial(fn, *args, **kwargs)))
+
+
+async def sleep(seconds):
+    """
+    Sleep on the clock of the scripts. A virtual clock is advanced at once.
+    """
+    if isinstance(clock.get_clock(), clock.RealClock):
+        await asyncio.sleep(seconds)
+    else:
+        clock.sleep(seconds)
+        await asyncio.sleep(0)
+
+
+async def wait_until(predicate, description, timeout=waiter.DEFAULT_STEP_TIMEOUT, deadline=None):
+    """
+    Like waiter.wait_until, but |predicate| runs on the executor and the event loop is
+    free between polls.
+    """
+    poller = waiter.Poller(description, timeout, deadline)
+    while True:
+        result = await run_blocking(predicate)
+        if poller.done(result):
+            return result
+        await sleep(poller.next_delay())
+
+
+async def run_steps(steps):
+    """
+    Drive |steps|, a generator yielding convergence.Waits like
+    EcsCluster.rolling_upgrade_steps, advancing it on the executor and waiting from the loop.
+    """
+    wait = await run_blocking(next, steps, None)
+    while wait is not None:
+        try:
+            await wait_until(wait.predicate, wait.description,
+                             timeout=wait.timeout, deadline=wait.deadline)
+        except Exception as e:
+            wait = await run_blocking(convergence.throw, steps, e)
+            continue
+        wait = await run_blocking(next, steps, None)
+
+
+class AsyncWrapper():
+    """
+    Async view of a blocking client wrapper like EcsCluster. Calling a method returns a
+    coroutine which runs the method on the executor.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def __getattr__(self, name):
+        attr = getattr(self.wrapped, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await run_blocking(attr, *args, **kwargs)
+        return call
+
+
+async def ecs_cluster(config):
+    return AsyncWrapper(await run_blocking(aws_client_ecs.EcsCluster, config))
+
+
+async def elb_client(config):
+    return AsyncWrapper(await run_blocking(aws_client_elb.ElbClient, config))
+
+
+async def auto_scaling_client(config):
+    return AsyncWrapper(await run_blocking(aws_client_auto_scaling.AutoScalingClient, config))
+
+
+async def run_phases(phase_list):
+    """
+    Like phases.run_phases, but every phase runs on the executor as soon as its dependencies
+    finished. Once a phase fails no other phase is started, and the error of the first
+    failed phase is raised when the running ones are done.
+    """
+    phases.check_phases(phase_list)
+    tasks = {}
+    errors = []
+    skipped = []
+
+    async def run(phase):
+        try:
+            for name in sorted(phase.dependencies):
+                # Raises if the dependency failed or was skipped
+                await tasks[name]
+            if errors:
+                raise phases.PhaseError('Skipped phase ' + phase.name)
+        except Exception:
+            skipped.append(phase.name)
+            raise
+        try:
+            await run_blocking(phases.run_phase, phase)
+        except Exception as e:
+            logger.error('Phase %s failed. Error: %s', phase.name, e)
+            errors.append(e)
+            raise
+    for phase in phase_list:
+        tasks[phase.name] = asyncio.ensure_future(run(phase))
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    if errors:
+        phases.raise_error(errors[0], skipped)
+
+
+async def create_or_update_cluster(config):
+    """
+    Create the cluster, see cluster.create_or_update_cluster.
+    """
+    config.log_component_names()
+    # Skip the calls which would not change anything
+    with cluster.using_plan(config, await run_blocking(cluster.plan_if_enabled, config)):
+        await run_phases(await run_blocking(cluster.get_create_phases, config))
+
+
+async def upgrade_cluster(config):
+    """
+    Do a rolling upgrade of the instances in the cluster, see cluster.upgrade_cluster.
+    """
+    await run_steps(cluster.get_upgrade_steps(config))
+
+
+async def destroy_cluster(config, destroy_sqs):
+    """
+    Delete the cluster and shutdown all instances, see cluster.destroy_cluster.
+    """
+    config.log_component_names()
+    await run_phases(await run_blocking(cluster.get_destroy_phases, config, destroy_sqs))
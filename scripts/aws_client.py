@@ -4,12 +4,157 @@
 Returns the various kinds of AWS boto3 clients
 """
 import boto3
+import botocore.config
 import logger
 import elb
 import time
 import copy
+import threading
+import weakref
 from botocore.exceptions import ClientError
 import options
+import rate_limiter
+import api_metrics
+import tracing
+import events
+
+# Size of the HTTPS connection pool kept by each client. The default of 10 is too
+# small once several wrappers share the same client.
+MAX_POOL_CONNECTIONS = 50
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# Retries use botocore's adaptive mode: exponential backoff with jitter plus a client
+# side rate which slows down as soon as AWS starts throttling.
+RETRY_MODE = 'adaptive'
+MAX_RETRIES = 10
+# Client side (calls per second, burst) per service shared by all threads of the process,
+# so concurrent deploys don't burst past the AWS API limits in the first place.
+DEFAULT_SERVICE_RATE = (20, 40)
+SERVICE_RATES = {
+    'ecs': (20, 50),
+    'elbv2': (10, 20),
+    'autoscaling': (10, 20),
+    'application-autoscaling': (10, 20),
+}
+
+# Process wide registry of boto3 clients keyed by (region, service). Each entry
+# owns its own boto3 session because sessions are not thread safe, clients are.
+_registry_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+# Creates the client from (session, service, client_config). Swapped out to run
+# against fake_aws instead of AWS.
+_client_factory = None
+
+# Plans of mutating calls keyed by the config they were made for. While a plan is set
+# for a config, wrappers skip the mutating calls the plan doesn't need.
+_plans_lock = threading.Lock()
+_plans = weakref.WeakKeyDictionary()
+
+
+def _create_client_config():
+    return botocore.config.Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={
+            'mode': RETRY_MODE,
+            'max_attempts': MAX_RETRIES,
+        },
+    )
+
+
+def _add_rate_limit(client, service, region):
+    """
+    Take a token from the shared bucket of the service before every request attempt.
+    """
+    rate, burst = SERVICE_RATES.get(service, DEFAULT_SERVICE_RATE)
+    bucket = rate_limiter.get_bucket('{0}.{1}'.format(region, service), rate, burst)
+
+    def acquire(**kwargs):
+        bucket.acquire()
+    client.meta.events.register('before-send', acquire)
+
+
+def get_client(service, region):
+    """
+    Return the shared boto3 client for |service| in |region|, creating it on first use.
+    """
+    key = (region, service)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = boto3.session.Session(region_name=region)
+            if _client_factory is not None:
+                client = _client_factory(session, service, _create_client_config())
+            else:
+                client = session.client(service, config=_create_client_config())
+            _add_rate_limit(client, service, region)
+            api_metrics.instrument(client)
+            tracing.instrument(client)
+            events.instrument(client)
+            _sessions[key] = session
+            _clients[key] = client
+            logger.getLogger().debug(
+                'Created boto3 client for service:%s region:%s', service, region)
+        return client
+
+
+def clear_clients():
+    """
+    Drop all cached sessions and clients.
+    """
+    with _registry_lock:
+        _sessions.clear()
+        _clients.clear()
+
+
+def set_client_factory(factory):
+    """
+    Create clients with factory(session, service, client_config) from now on. None restores
+    the default boto3 clients. Drops all cached clients.
+    """
+    global _client_factory
+    with _registry_lock:
+        _client_factory = factory
+        _sessions.clear()
+        _clients.clear()
+
+
+def set_plan(config, plan):
+    """
+    Restrict mutating calls made for |config| to the ones in |plan|. None removes the plan.
+    """
+    with _plans_lock:
+        if plan is None:
+            _plans.pop(config, None)
+        else:
+            _plans[config] = plan
+
+
+def get_plan(config):
+    with _plans_lock:
+        return _plans.get(config)
+
+
+def drop_empty_values(value):
+    """
+    Return |value| without the unset values and the empty lists and maps in it, AWS
+    returns them for keys which were never set.
+    """
+    if isinstance(value, dict):
+        result = {}
+        for k, v in value.items():
+            v = drop_empty_values(v)
+            if v is not None and v != [] and v != {}:
+                result[k] = v
+        return result
+    if isinstance(value, list):
+        return [drop_empty_values(v) for v in value]
+    return value
 
 
 class AwsClient():
@@ -22,3 +167,14 @@ class AwsClient():
         self.client = client
         self.log = logger.getLogger()
 
+    def is_planned(self, service, operation, resource=None):
+        """
+        Return False if a plan is set for the config and the mutating call is not in it.
+        """
+        plan = get_plan(self.config)
+        if plan is None:
+            return True
+        if plan.is_needed(service, operation, resource):
+            return True
+        self.log.info('Skipping %s.%s %s, already up to date', service, operation, resource or '')
+        return False
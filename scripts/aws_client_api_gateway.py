@@ -4,7 +4,6 @@
 AWS boto3 client for API gateway
 """
 import aws_client
-import boto3
 import logger
 import elb
 import time
@@ -18,7 +17,7 @@ class ApiGatewayClient(aws_client.AwsClient):
     log = None
 
     def __init__(self, config):
-        client = boto3.client('apigateway', region_name=config.get_region())
+        client = aws_client.get_client('apigateway', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
 
     def create_get_api(self, name, description):
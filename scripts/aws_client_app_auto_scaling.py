@@ -6,7 +6,6 @@ https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/appli
 """
 import aws_client
 import aws_client_elb 
-import boto3
 import logger
 import elb
 import time
@@ -20,7 +19,7 @@ class AppAutoScalingClient(aws_client.AwsClient):
     """
 
     def __init__(self, config):
-        client = boto3.client('application-autoscaling', region_name=config.get_region())
+        client = aws_client.get_client('application-autoscaling', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
 
     def _build_resource_id(self):
@@ -28,6 +27,8 @@ class AppAutoScalingClient(aws_client.AwsClient):
 
     def _set_ecs_scaling_parameters(self, min, max):
         resourceID = self._build_resource_id()
+        if not self.is_planned('application-autoscaling', 'register_scalable_target'):
+            return
         try:
             self.log.info('Registering %s as a scalable target for application autio scaling, min=%d, max=%d', resourceID, min, max)
             response = self.client.register_scalable_target(
@@ -62,6 +63,8 @@ class AppAutoScalingClient(aws_client.AwsClient):
 
     def _put_ecs_scaling_policy(self):
         resourceID = self._build_resource_id()
+        if not self.is_planned('application-autoscaling', 'put_scaling_policy'):
+            return
         try:
             self.log.info('Applying application auto scaling policy to ECS service %s', resourceID)
             response = self.client.put_scaling_policy(
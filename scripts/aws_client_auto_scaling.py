@@ -4,15 +4,109 @@
 AWS boto3 client for EC2/ELB Auto Scaling
 """
 import aws_client
+import aws_client_ec2
 import aws_client_elb 
 import aws_client_ecs
-import boto3
 import logger
 import elb
 import time
 import copy
+import base64
 from botocore.exceptions import ClientError
 import options
+import waiter
+import bulk
+import rate_limiter
+
+# Client side calls per second and burst size of terminate_instance_in_auto_scaling_group
+TERMINATE_INSTANCE_RATE = 5
+TERMINATE_INSTANCE_BURST = 10
+
+# Lifecycle states of auto scaling instances which are on their way in or in service.
+LIVE_INSTANCE_STATES = ('Pending', 'Pending:Wait', 'Pending:Proceed', 'InService')
+
+
+class InstanceRefreshError(Exception):
+    """
+    Raised when an instance refresh of the auto scaling group fails or is cancelled.
+    """
+    pass
+
+
+def get_user_data(config):
+    """
+    Return the user data of the instances, it makes them join the ECS cluster.
+    """
+    #return "#!/bin/bash \n echo ECS_CLUSTER=" + config.get_ecs_cluster_name() + " >> /etc/ecs/ecs.config"
+    return "Content-Type: multipart/mixed; boundary=\"===============BOUNDARY==\" \n" + \
+        "MIME-Version: 1.0 \n" + \
+        "\n" + \
+        "--===============BOUNDARY== \n" + \
+        "MIME-Version: 1.0 \n" + \
+        "Content-Type: text/x-shellscript; charset=\"us-ascii\" \n" + \
+        "Content-Transfer-Encoding: 7bit \n" + \
+        "Content-Disposition: attachment; filename=\"standard_userdata.txt\" \n" + \
+        "\n" + \
+        "#!/bin/bash \n" + \
+        "echo ECS_CLUSTER=" + config.get_ecs_cluster_name() + " >> /etc/ecs/ecs.config \n" + \
+        "\n" + \
+        "\n" + \
+        "--===============BOUNDARY== \n" + \
+        "MIME-Version: 1.0 \n" + \
+        "Content-Type: text/cloud-boothook; charset=\"us-ascii\" \n" + \
+        "Content-Transfer-Encoding: 7bit \n" + \
+        "Content-Disposition: attachment; filename=\"boothook.txt\" \n" + \
+        "\n" + \
+        "#cloud-boothook \n" + \
+        "echo 'OPTIONS=\"${OPTIONS} --storage-opt dm.basesize=" + config.get_volume_basesize() + "\"' >> /etc/sysconfig/docker \n" + \
+        "\n" + \
+        "--===============BOUNDARY==--"
+
+
+def get_launch_template_data(config):
+    """
+    Return the LaunchTemplateData with the same settings as the launch configuration.
+    """
+    iam_role = config.get_ec2_iam_role()
+    return {
+        'BlockDeviceMappings': [
+            {
+                'DeviceName': config.get_volume_name(),
+                'Ebs': {
+                    'VolumeSize': config.get_volume_size()
+                }
+            }
+        ],
+        'ImageId': config.get_ami(),
+        'KeyName': config.get_ssh_key(),
+        'IamInstanceProfile': {'Arn': iam_role} if iam_role.startswith('arn:') else {'Name': iam_role},
+        'InstanceType': config.get_instance_type(),
+        # The security groups go with the interface when it sets the public IP
+        'NetworkInterfaces': [
+            {
+                'DeviceIndex': 0,
+                'AssociatePublicIpAddress': config.get_launch_ec2_with_public_ip(),
+                'Groups': config.get_security_groups(),
+            }
+        ],
+        'UserData': base64.b64encode(get_user_data(config).encode('utf-8')).decode('ascii'),
+    }
+
+
+def get_outdated_instance_ids(as_group, template_name, version_number):
+    """
+    Return the ids of the live instances of |as_group|, as described by
+    describe_auto_scaling_groups, not launched from |version_number| of |template_name|.
+    """
+    ids = []
+    for i in as_group['Instances']:
+        if i['LifecycleState'] not in LIVE_INSTANCE_STATES:
+            continue
+        template = i.get('LaunchTemplate', {})
+        if template.get('LaunchTemplateName') != template_name or template.get('Version') != str(version_number):
+            ids.append(i['InstanceId'])
+    return ids
+
 
 class AutoScalingClient(aws_client.AwsClient):
     """
@@ -20,12 +114,23 @@ class AutoScalingClient(aws_client.AwsClient):
     """
 
     def __init__(self, config):
-        client = boto3.client('autoscaling', region_name=config.get_region())
+        client = aws_client.get_client('autoscaling', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
         self.as_group_name = self.config.get_as_name()
         self.launch_configuration_name = self.config.get_launch_config_name()
 
+    def _launch_params(self):
+        """
+        Return the parameters which make the group launch from the launch template or configuration.
+        """
+        if self.config.use_launch_template():
+            # $Latest makes every new version take effect without updating the group
+            return {'LaunchTemplate': {'LaunchTemplateName': self.launch_configuration_name, 'Version': '$Latest'}}
+        return {'LaunchConfigurationName': self.launch_configuration_name}
+
     def update_tag(self):
+        if not self.is_planned('autoscaling', 'create_or_update_tags'):
+            return
         # Update tags
         response2 = self.client.create_or_update_tags(
             Tags=[
@@ -48,7 +153,7 @@ class AutoScalingClient(aws_client.AwsClient):
                 ForceDelete=True,
             )
             # Wait for auto scaling group to completely go away
-            while True:
+            def as_group_deleted():
                 response = self.client.describe_auto_scaling_groups(
                     AutoScalingGroupNames=[self.as_group_name]
                 )
@@ -58,9 +163,12 @@ class AutoScalingClient(aws_client.AwsClient):
                 if len(as_group) > 0:
                     self.log.info('Status for AutoScalingGroup: %s "%s"',
                                   self.as_group_name, as_group[0]['Status'])
-                else:
-                    break
-                time.sleep(10)
+                    return False
+                return True
+            waiter.wait_until(as_group_deleted,
+                              'auto scaling group {0} to be deleted'.format(self.as_group_name))
+        except waiter.WaitTimeoutError:
+            raise
         except Exception as ex:
             self.log.warn(
                 "Could not delete auto scaling group %s. Exception: %s", self.as_group_name, ex)
@@ -78,12 +186,12 @@ class AutoScalingClient(aws_client.AwsClient):
             # Update existing auto scaling group configuration
             response = self.update_capacity()
             self.update_tag()
+            self.refresh_outdated_instances()
             return response
         # Create a new auto-scaling group
         min_value, max_value, desired, availability_zones, vpc_zone_identifier, default_cooldown = self.config.get_auto_scale_params()
         response = self.client.create_auto_scaling_group(
             AutoScalingGroupName=self.as_group_name,
-            LaunchConfigurationName=self.launch_configuration_name,
             MinSize=min_value,
             MaxSize=max_value,
             DesiredCapacity=desired,
@@ -92,12 +200,16 @@ class AutoScalingClient(aws_client.AwsClient):
             DefaultCooldown=default_cooldown,
             TargetGroupARNs=[
                 tg['TargetGroupArn']
-            ]
+            ],
+            **self._launch_params()
         )
         self.update_tag()
         return response
 
     def delete_launch_configuration(self):
+        if self.config.use_launch_template():
+            aws_client_ec2.EC2Client(self.config).delete_launch_template(self.launch_configuration_name)
+            return
         try:
             self.client.delete_launch_configuration(
                 LaunchConfigurationName=self.launch_configuration_name
@@ -107,6 +219,8 @@ class AutoScalingClient(aws_client.AwsClient):
                 'Could not delete launch configuration %s. Error: %s', self.launch_configuration_name, ex)
 
     def get_or_create_launch_configuration(self):
+        if self.config.use_launch_template():
+            return self.get_or_create_launch_template()
         response = self.client.describe_launch_configurations(
             LaunchConfigurationNames=[
                 self.launch_configuration_name,
@@ -133,36 +247,97 @@ class AutoScalingClient(aws_client.AwsClient):
             IamInstanceProfile=self.config.get_ec2_iam_role(),
             InstanceType=self.config.get_instance_type(),
             AssociatePublicIpAddress=self.config.get_launch_ec2_with_public_ip(),
-            #UserData="#!/bin/bash \n echo ECS_CLUSTER=" + self.config.get_ecs_cluster_name() + " >> /etc/ecs/ecs.config"
-            UserData="Content-Type: multipart/mixed; boundary=\"===============BOUNDARY==\" \n" +
-                "MIME-Version: 1.0 \n" +
-                "\n" +
-                "--===============BOUNDARY== \n" +
-                "MIME-Version: 1.0 \n" +
-                "Content-Type: text/x-shellscript; charset=\"us-ascii\" \n" +
-                "Content-Transfer-Encoding: 7bit \n" +
-                "Content-Disposition: attachment; filename=\"standard_userdata.txt\" \n" +
-                "\n" +
-                "#!/bin/bash \n" +
-                "echo ECS_CLUSTER=" + self.config.get_ecs_cluster_name() + " >> /etc/ecs/ecs.config \n" +
-                "\n" +
-                "\n" +
-                "--===============BOUNDARY== \n" +
-                "MIME-Version: 1.0 \n" +
-                "Content-Type: text/cloud-boothook; charset=\"us-ascii\" \n" +
-                "Content-Transfer-Encoding: 7bit \n" +
-                "Content-Disposition: attachment; filename=\"boothook.txt\" \n" +
-                "\n" +
-                "#cloud-boothook \n" +
-                "echo 'OPTIONS=\"${OPTIONS} --storage-opt dm.basesize=" + self.config.get_volume_basesize() + "\"' >> /etc/sysconfig/docker \n" +
-                "\n" +
-                "--===============BOUNDARY==--"
+            UserData=get_user_data(self.config),
         )
         self.log.info("Response: %s", response)
         return response
 
+    def get_or_create_launch_template(self):
+        """
+        Create the launch template, or a new version of it when the settings changed.
+        """
+        return aws_client_ec2.EC2Client(self.config).get_or_create_launch_template(
+            self.launch_configuration_name, get_launch_template_data(self.config))
+
+    def refresh_outdated_instances(self):
+        """
+        Replace the instances launched from an older version of the launch template through
+        an instance refresh, if one is configured, and wait for it to finish. AWS replaces
+        them in batches which keep the min healthy percentage of the group in service.
+        """
+        refresh = self.config.get_instance_refresh()
+        if not self.config.use_launch_template() or refresh is None:
+            return None
+        if not self.is_planned('autoscaling', 'start_instance_refresh'):
+            return None
+        latest = aws_client_ec2.EC2Client(self.config).get_latest_launch_template_version(
+            self.launch_configuration_name)
+        outdated = self.get_outdated_instance_ids(latest['VersionNumber'])
+        if len(outdated) == 0:
+            self.log.info('All instances of %s use launch template version %d',
+                          self.as_group_name, latest['VersionNumber'])
+            return None
+        refresh_id = self._get_active_instance_refresh_id()
+        if refresh_id is None:
+            min_healthy_percentage, instance_warmup = refresh
+            self.log.info('Starting instance refresh of %s to replace %d instances, min healthy:%d%% warmup:%ds',
+                          self.as_group_name, len(outdated), min_healthy_percentage, instance_warmup)
+            response = self.client.start_instance_refresh(
+                AutoScalingGroupName=self.as_group_name,
+                Preferences={
+                    'MinHealthyPercentage': min_healthy_percentage,
+                    'InstanceWarmup': instance_warmup,
+                },
+            )
+            refresh_id = response['InstanceRefreshId']
+        else:
+            self.log.info('Waiting for instance refresh %s of %s which is already running',
+                          refresh_id, self.as_group_name)
+
+        def refreshed():
+            response = self.client.describe_instance_refreshes(
+                AutoScalingGroupName=self.as_group_name,
+                InstanceRefreshIds=[refresh_id],
+            )
+            r = response['InstanceRefreshes'][0]
+            self.log.info('Instance refresh %s of %s: %s %s%% complete, %s instances to update',
+                          refresh_id, self.as_group_name, r['Status'],
+                          r.get('PercentageComplete', 0), r.get('InstancesToUpdate', '?'))
+            if r['Status'] in ('Failed', 'Cancelled', 'Cancelling', 'RollbackInProgress', 'RollbackFailed',
+                               'RollbackSuccessful'):
+                raise InstanceRefreshError('Instance refresh {0} of {1} ended with status {2}: {3}'.format(
+                    refresh_id, self.as_group_name, r['Status'], r.get('StatusReason', '')))
+            return r if r['Status'] == 'Successful' else None
+        _, timeout = self.config.get_upgrade_timeouts()
+        return waiter.wait_until(refreshed, 'instance refresh {0} of {1}'.format(refresh_id, self.as_group_name),
+                                 timeout=timeout)
+
+    def get_outdated_instance_ids(self, version_number):
+        """
+        Return the ids of the live instances of the group not launched from |version_number|
+        of the launch template.
+        """
+        response = self.client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.as_group_name],
+        )
+        ids = []
+        for group in response['AutoScalingGroups']:
+            ids.extend(get_outdated_instance_ids(group, self.launch_configuration_name, version_number))
+        return ids
+
+    def _get_active_instance_refresh_id(self):
+        response = self.client.describe_instance_refreshes(
+            AutoScalingGroupName=self.as_group_name,
+        )
+        for r in response['InstanceRefreshes']:
+            if r['Status'] in ('Pending', 'InProgress'):
+                return r['InstanceRefreshId']
+        return None
+
     def update_service_auto_scale_count(self, desired):
         # Update the service
+        if not self.is_planned('ecs', 'update_service', 'desiredCount'):
+            return
         ecs_client = aws_client_ecs.EcsCluster(self.config)
         service_name = self.config.get_ecs_service_name()
         cluster_name = self.config.get_ecs_cluster_name()
@@ -177,6 +352,8 @@ class AutoScalingClient(aws_client.AwsClient):
         """
         Update the auto scale policy to create new instances when CPU hits the target cpu_threshold
         """
+        if not self.is_planned('autoscaling', 'put_scaling_policy'):
+            return
         response = self.client.put_scaling_policy(
             AutoScalingGroupName=self.as_group_name,
             PolicyName=self.as_group_name,
@@ -206,7 +383,8 @@ class AutoScalingClient(aws_client.AwsClient):
             'Associating AutoScalingGroup: %s to LoadBalancer ARN: %s', self.as_group_name, lb_arn)
         self.log.debug('Response: %s', response)
 
-    def update_capacity_and_task_definition(self, min_value, max_value, desired, termination_policy):
+    def update_capacity_and_task_definition(self, min_value, max_value, desired, termination_policy,
+                                            force_new_deployment=True):
         _, _, _, availability_zones, vpc_zone_identifier, _ = self.config.get_auto_scale_params()
         tdname = self.config.get_task_definition_name()
         self.log.info(
@@ -217,7 +395,7 @@ class AutoScalingClient(aws_client.AwsClient):
         cluster_name = self.config.get_ecs_cluster_name()
         ecs_client.client.update_service(
             taskDefinition=tdname,
-            forceNewDeployment=True,
+            forceNewDeployment=force_new_deployment,
             desiredCount=desired,
             cluster=cluster_name,
             service=service_name,
@@ -230,13 +408,13 @@ class AutoScalingClient(aws_client.AwsClient):
             termination_policy = "Default"
         response = self.client.update_auto_scaling_group(
             AutoScalingGroupName=self.as_group_name,
-            LaunchConfigurationName=self.launch_configuration_name,
             MinSize=min_value,
             MaxSize=max_value,
             DesiredCapacity=desired,
             VPCZoneIdentifier=vpc_zone_identifier,
             AvailabilityZones=availability_zones,
             TerminationPolicies=[termination_policy],
+            **self._launch_params()
         )
         self.log.debug("Response: %s", response)
         return response
@@ -244,6 +422,14 @@ class AutoScalingClient(aws_client.AwsClient):
     def update_capacity_to(self, min_value, max_value, desired, termination_policy):
         self.log.info('Updated desired capacity to %s', desired)
         self.update_service_auto_scale_count(desired)
+        return self.update_group_capacity_to(min_value, max_value, desired, termination_policy)
+
+    def update_group_capacity_to(self, min_value, max_value, desired, termination_policy):
+        """
+        Update the capacity of the auto scaling group only, leaving the service alone.
+        """
+        if not self.is_planned('autoscaling', 'update_auto_scaling_group'):
+            return None
         _, _, _, availability_zones, vpc_zone_identifier, cooldown = self.config.get_auto_scale_params()
         if termination_policy == "":
             termination_policy = "Default"
@@ -251,7 +437,6 @@ class AutoScalingClient(aws_client.AwsClient):
                       min_value, max_value, desired, availability_zones, vpc_zone_identifier, termination_policy)
         response = self.client.update_auto_scaling_group(
             AutoScalingGroupName=self.as_group_name,
-            LaunchConfigurationName=self.launch_configuration_name,
             MinSize=min_value,
             MaxSize=max_value,
             DesiredCapacity=desired,
@@ -259,10 +444,39 @@ class AutoScalingClient(aws_client.AwsClient):
             VPCZoneIdentifier=vpc_zone_identifier,
             AvailabilityZones=availability_zones,
             TerminationPolicies=[termination_policy],
+            **self._launch_params()
         )
         self.log.debug("Response: %s", response)
         return response
 
+    def get_instance_ids(self):
+        """
+        Return the ids of the instances of the group which are not being terminated.
+        """
+        response = self.client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.as_group_name],
+        )
+        ids = []
+        for group in response['AutoScalingGroups']:
+            for i in group['Instances']:
+                if i['LifecycleState'] in LIVE_INSTANCE_STATES:
+                    ids.append(i['InstanceId'])
+        return ids
+
+    def terminate_instances(self, instance_ids, decrement_capacity):
+        """
+        Terminate |instance_ids|. The group launches replacements unless |decrement_capacity| is set.
+        """
+        def terminate(instance_id):
+            self.log.info('Terminating instance %s of %s', instance_id, self.as_group_name)
+            self.client.terminate_instance_in_auto_scaling_group(
+                InstanceId=instance_id,
+                ShouldDecrementDesiredCapacity=decrement_capacity,
+            )
+        bucket = rate_limiter.get_bucket('autoscaling.terminate_instance',
+                                         TERMINATE_INSTANCE_RATE, TERMINATE_INSTANCE_BURST)
+        return bulk.run(terminate, instance_ids, bucket, 'terminating instance')
+
     def set_capacity_to_zero(self):
         return self.update_capacity_to(min_value=0,
                                        max_value=0,
@@ -5,7 +5,6 @@ AWS boto3 client for cloud watch
 """
 import aws_client
 import aws_client_elb
-import boto3
 import logger
 import elb
 import time
@@ -15,7 +14,7 @@ import options
 
 class CloudWatchAlarm(aws_client.AwsClient):
     def __init__(self, config):
-        client = boto3.client('cloudwatch', region_name=config.get_region())
+        client = aws_client.get_client('cloudwatch', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
         self.alarm = self.config.get_alarm()
 
@@ -4,7 +4,6 @@
 AWS boto3 client for EC2 Instances
 """
 import aws_client
-import boto3
 import logger
 import elb
 import time
@@ -12,13 +11,44 @@ import copy
 from botocore.exceptions import ClientError
 import options
 
+
+def canonicalize_launch_template_data(data):
+    """
+    Return the LaunchTemplateData |data| with empty values dropped, numbers AWS echoes as
+    numbers converted and the lists AWS does not keep in order sorted, so a stored version
+    and the data resolved from the config compare equal.
+    """
+    result = aws_client.drop_empty_values(copy.deepcopy(data))
+    for key in ('SecurityGroupIds', 'SecurityGroups'):
+        if key in result:
+            result[key] = sorted(result[key])
+    for mapping in result.get('BlockDeviceMappings', []):
+        ebs = mapping.get('Ebs', {})
+        for key in ('VolumeSize', 'Iops', 'Throughput'):
+            if key in ebs:
+                ebs[key] = int(ebs[key])
+    if 'BlockDeviceMappings' in result:
+        result['BlockDeviceMappings'] = sorted(result['BlockDeviceMappings'], key=lambda m: m['DeviceName'])
+    for interface in result.get('NetworkInterfaces', []):
+        interface['DeviceIndex'] = int(interface.get('DeviceIndex', 0))
+        if 'Groups' in interface:
+            interface['Groups'] = sorted(interface['Groups'])
+    if 'NetworkInterfaces' in result:
+        result['NetworkInterfaces'] = sorted(result['NetworkInterfaces'], key=lambda i: i['DeviceIndex'])
+    return result
+
+
+def launch_template_data_equal(a, b):
+    return canonicalize_launch_template_data(a) == canonicalize_launch_template_data(b)
+
+
 class EC2Client(aws_client.AwsClient):
     """
     Functions to create and manipulate EC2 instances.
     """
 
     def __init__(self, config):
-        client = boto3.client('ec2', region_name=config.get_region())
+        client = aws_client.get_client('ec2', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
 
     def create_ec2_instances(self, ami, ec2_name, cluster_name):
@@ -101,3 +131,54 @@ class EC2Client(aws_client.AwsClient):
         self.log.info('Terminating EC2 instances %s', instances)
         self.client.terminate_instances(
             InstanceIds=instances)
+
+    def get_latest_launch_template_version(self, name):
+        """
+        Return the latest version of the launch template |name|, or None if there is no such template.
+        """
+        try:
+            response = self.client.describe_launch_template_versions(
+                LaunchTemplateName=name,
+                Versions=['$Latest'],
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'InvalidLaunchTemplateName.NotFoundException':
+                return None
+            raise
+        return response['LaunchTemplateVersions'][0]
+
+    def get_or_create_launch_template(self, name, data):
+        """
+        Return the latest version of the launch template |name|, creating the template or
+        a new version of it when its LaunchTemplateData differs from |data|.
+        """
+        latest = self.get_latest_launch_template_version(name)
+        if latest is None:
+            if not self.is_planned('ec2', 'create_launch_template'):
+                # Deleted since the plan was made
+                self.log.warn('Launch template %s not found, creating it', name)
+            response = self.client.create_launch_template(
+                LaunchTemplateName=name,
+                LaunchTemplateData=data,
+            )
+            self.log.debug('Response: %s', response)
+            self.log.info('Created launch template %s', name)
+            return self.get_latest_launch_template_version(name)
+        if launch_template_data_equal(latest['LaunchTemplateData'], data) or \
+                not self.is_planned('ec2', 'create_launch_template_version'):
+            self.log.info('Using launch template %s version %d', name, latest['VersionNumber'])
+            return latest
+        response = self.client.create_launch_template_version(
+            LaunchTemplateName=name,
+            LaunchTemplateData=data,
+        )
+        version = response['LaunchTemplateVersion']
+        self.log.info('Created launch template %s version %d', name, version['VersionNumber'])
+        return version
+
+    def delete_launch_template(self, name):
+        try:
+            self.client.delete_launch_template(LaunchTemplateName=name)
+            self.log.info('Deleted launch template %s', name)
+        except Exception as ex:
+            self.log.warn('Could not delete launch template %s. Error: %s', name, ex)
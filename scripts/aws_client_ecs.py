@@ -7,13 +7,98 @@ import aws_client
 import aws_client_elb
 import aws_client_auto_scaling
 import aws_client_app_auto_scaling
-import boto3
 import logger
 import elb
 import time
 import copy
+import hashlib
+import json
+import math
 from botocore.exceptions import ClientError
 import options
+import waiter
+import bulk
+import rate_limiter
+import tracing
+import convergence
+import resource_state
+
+# Maximum number of ARNs describe_tasks accepts per call.
+DESCRIBE_TASKS_BATCH_SIZE = 100
+# Client side calls per second and burst size of the bulk mutations, kept under the ECS
+# API throttling limits. The buckets are shared by every thread of the process.
+STOP_TASK_RATE = 20
+STOP_TASK_BURST = 40
+DEREGISTER_CONTAINER_INSTANCE_RATE = 5
+DEREGISTER_CONTAINER_INSTANCE_BURST = 10
+
+
+def iterate_pages(client, operation, result_key, **kwargs):
+    """
+    Yield the items under |result_key| from every page of |operation|, fetching pages lazily.
+    """
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(**kwargs):
+        for item in page.get(result_key, []):
+            yield item
+
+
+def iterate_tasks(client, **kwargs):
+    return iterate_pages(client, 'list_tasks', 'taskArns', **kwargs)
+
+
+def iterate_task_definitions(client, **kwargs):
+    return iterate_pages(client, 'list_task_definitions', 'taskDefinitionArns', **kwargs)
+
+
+def iterate_container_instances(client, **kwargs):
+    return iterate_pages(client, 'list_container_instances', 'containerInstanceArns', **kwargs)
+
+
+def iterate_chunks(items, size):
+    """
+    Yield lists of up to |size| items from the |items| iterable.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def describe_tasks(client, cluster_name, task_arns):
+    """
+    Yield the descriptions of |task_arns|, describing them in batches of the API limit.
+    """
+    for chunk in iterate_chunks(task_arns, DESCRIBE_TASKS_BATCH_SIZE):
+        response = client.describe_tasks(cluster=cluster_name, tasks=chunk)
+        for task in response.get('tasks') or []:
+            yield task
+
+
+def resolve_wave_sizes(max_surge, max_unavailable, desired):
+    """
+    Return the max surge and max unavailable counts of an upgrade wave. Each is a count or a
+    percentage of |desired| like '25%'; surge rounds up, unavailable rounds down and at least
+    one of them is non zero.
+    """
+    def resolve(value, round_up):
+        value = str(value).strip()
+        if value.endswith('%'):
+            count = float(value[:-1]) * desired / 100
+            return int(math.ceil(count) if round_up else math.floor(count))
+        return int(value)
+    surge = resolve(max_surge, True)
+    unavailable = min(resolve(max_unavailable, False), desired)
+    if surge < 0 or unavailable < 0:
+        raise ValueError('upgrade_max_surge and upgrade_max_unavailable must not be negative')
+    if surge == 0 and unavailable == 0:
+        surge = 1
+    return surge, unavailable
+
 
 def get_first_matching_active_service(ecs_client, cluster_name, service_name):
     response = ecs_client.client.describe_services(
@@ -25,17 +110,103 @@ def get_first_matching_active_service(ecs_client, cluster_name, service_name):
         return services[0]
     return None
 
+def get_desired_container_definition(config):
+    """
+    Return the container definition from the config with its name and image resolved.
+    """
+    container_definition = copy.deepcopy(
+        config.get_container_definition())
+    # Read the task definition from the config and update the name
+    container_definition.update(
+        {
+            'name': config.create_name_with_separator(container_definition['name']),
+            'image': config.create_name(container_definition['image']),
+        }
+    )
+    return container_definition
+
+
+# Values AWS fills in for the container definition keys a task definition leaves out.
+CONTAINER_DEFINITION_DEFAULTS = {
+    'cpu': 0,
+    'essential': True,
+}
+
+
+def canonicalize_container_definition(container_definition, network_mode='bridge'):
+    """
+    Return |container_definition| with the defaults AWS fills in applied and empty values
+    dropped, so a registered revision and the one resolved from the config compare equal.
+    """
+    result = dict(CONTAINER_DEFINITION_DEFAULTS)
+    result.update(copy.deepcopy(container_definition))
+    for mapping in result.get('portMappings', []):
+        mapping.setdefault('protocol', 'tcp')
+        # The host port is the container port with awsvpc and host networking, and
+        # 0 (a dynamic port) with bridge networking when it is left out.
+        if network_mode in ('awsvpc', 'host'):
+            mapping.setdefault('hostPort', mapping.get('containerPort'))
+        else:
+            mapping.setdefault('hostPort', 0)
+    for mount_point in result.get('mountPoints', []):
+        mount_point.setdefault('readOnly', False)
+    for volume in result.get('volumesFrom', []):
+        volume.setdefault('readOnly', False)
+    # AWS does not keep the order of these
+    for key in ('environment', 'secrets'):
+        if key in result:
+            result[key] = sorted(result[key], key=lambda e: e['name'])
+    return aws_client.drop_empty_values(result)
+
+
+def task_definition_hash(family, network_mode, container_definitions):
+    """
+    Return a hash of the parts of a task definition this script sets.
+    """
+    network_mode = network_mode or 'bridge'
+    canonical = {
+        'family': family,
+        'networkMode': network_mode,
+        'containerDefinitions': [canonicalize_container_definition(c, network_mode)
+                                 for c in container_definitions],
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_desired_task_definition_hash(config):
+    return task_definition_hash(config.get_task_definition_name(), config.get_task_def_network_mode(),
+                                [get_desired_container_definition(config)])
+
+
+def get_task_definition_hash(task_definition):
+    """
+    Return the hash of a task definition returned by describe_task_definition.
+    """
+    return task_definition_hash(task_definition['family'], task_definition.get('networkMode'),
+                                task_definition['containerDefinitions'])
+
+
 class EcsCluster(aws_client.AwsClient):
     """
     ECS Cluster client.
     """
 
     def __init__(self, config):
-        client = boto3.client('ecs', region_name=config.get_region())
+        client = aws_client.get_client('ecs', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
+        self.task_def = None
+        # Until create_taskd finds a revision identical to the config
+        self.task_def_changed = True
 
     def create_cluster(self):
         name = self.config.get_ecs_cluster_name()
+        if not self.is_planned('ecs', 'create_cluster'):
+            clusters = self.client.describe_clusters(clusters=[name])['clusters']
+            if clusters:
+                self.cluster = clusters[0]
+                return self.cluster
+            # Deleted since the plan was made
+            self.log.warn("ECS Cluster %s not found, creating it", name)
         response = self.client.create_cluster(clusterName=name)
         self.log.debug("Created ECS Cluster: %s", response)
         # Create the Cluster wrapper from the response
@@ -46,45 +217,44 @@ class EcsCluster(aws_client.AwsClient):
 
     def _stop_tasks(self):
         """
-        Stop the tasks and return immediately.
+        Stop the tasks and return immediately. Raises a bulk.BulkError if a task
+        could not be stopped.
         """
         cluster_name = self.config.get_ecs_cluster_name()
         service_name = self.config.get_ecs_service_name()
         self.log.info(
             'Stopping all tasks in cluster %s for service %s', cluster_name, service_name)
-        # List all tasks and stop the tasks
-        nextToken = ''
-        while nextToken is not None:
-            # Loop through all the tasks and stop them.
-            response = self.client.list_tasks(
+        # List all tasks before stopping them, stopping tasks changes the listing.
+        task_arns = list(iterate_tasks(
+            self.client,
+            cluster=cluster_name,
+            serviceName=service_name,
+            desiredStatus='RUNNING'))
+
+        def stop_task(task_arn):
+            self.log.info(
+                'Stopping task %s in cluster:%s service:%s', task_arn, cluster_name, service_name)
+            self.client.stop_task(
                 cluster=cluster_name,
-                serviceName=service_name,
-                nextToken=nextToken,
-                desiredStatus='RUNNING')
-            for i in response['taskArns']:
-                self.log.info(
-                    'Stopping task %s in cluster:%s service:%s', i, cluster_name, service_name)
-                self.client.stop_task(
-                    cluster=cluster_name,
-                    task=i
-                )
-            if 'nextToken' in response:
-                nextToken = response['nextToken']
-            else:
-                nextToken = None
+                task=task_arn
+            )
+        bucket = rate_limiter.get_bucket('ecs.stop_task', STOP_TASK_RATE, STOP_TASK_BURST)
+        return bulk.run(stop_task, task_arns, bucket, 'stopping task').check('stopping')
 
     def stop_tasks(self):
-        self._stop_tasks()
+        return self._stop_tasks()
 
     def deregister_task_definition(self):
         tdname = self.config.get_task_definition_name()
-        response = self.client.list_task_definitions(
+        # List all revisions before deregistering them, deregistering changes the listing.
+        task_definitions = list(iterate_task_definitions(
+            self.client,
             familyPrefix=tdname,
             status='ACTIVE',
             sort='DESC',
-        )
-        if len(response['taskDefinitionArns']) > 0:
-            for t in response['taskDefinitionArns']:
+        ))
+        if len(task_definitions) > 0:
+            for t in task_definitions:
                 self.log.info('Deregistering task definition %s', t)
                 # TODO: Don't crash if task def is not there.
                 self.client.deregister_task_definition(taskDefinition=t)
@@ -92,24 +262,31 @@ class EcsCluster(aws_client.AwsClient):
             self.log.debug('No task definition found')
 
     def deregister_container_instance(self):
+        """
+        Deregister the container instances of the cluster. Raises a bulk.BulkError if an
+        instance could not be deregistered.
+        """
         name = self.config.get_ecs_cluster_name()
         self.log.info('Deregistering container instances from %s', name)
         # Remove container instances
         try:
-            while True:
-                response = self.client.list_container_instances(
-                    cluster=name,
-                )
-                for inst in response['containerInstanceArns']:
-                    self.client.deregister_container_instance(
-                        cluster=name,
-                        containerInstance=inst
-                    )
-                if not 'nextToken' in response:
-                    break
+            instances = list(iterate_container_instances(self.client, cluster=name))
         except Exception as e:
             self.log.warn(
-                'Error deregistering container instances from cluster %s. Error: %s', name, e)
+                'Error listing container instances of cluster %s. Error: %s', name, e)
+            return None
+
+        def deregister(inst):
+            # The tasks are only stopping and the service still runs, the service
+            # and the instances go in the next phases.
+            self.client.deregister_container_instance(
+                cluster=name,
+                containerInstance=inst,
+                force=True
+            )
+        bucket = rate_limiter.get_bucket('ecs.deregister_container_instance',
+                                         DEREGISTER_CONTAINER_INSTANCE_RATE, DEREGISTER_CONTAINER_INSTANCE_BURST)
+        return bulk.run(deregister, instances, bucket, 'deregistering container instance').check('deregistering')
 
     def delete_cluster(self):
         name = self.config.get_ecs_cluster_name()
@@ -134,17 +311,6 @@ class EcsCluster(aws_client.AwsClient):
         )
         return response
 
-    def _get_task_count(self):
-        response = self.client.describe_services(
-            cluster=self.config.get_ecs_cluster_name(),
-            services=[
-                self.config.get_ecs_service_name()
-            ]
-        )
-        running = response['services'][0]['runningCount']
-        desired = response['services'][0]['desiredCount']
-        return running, desired
-
     def _terminate_instance(self, elb_client, tg_arn, ec2_client, waiter, ec2_instance_id):
         """
         Deregister the instance from the target group and then terminate the instance.
@@ -171,14 +337,11 @@ class EcsCluster(aws_client.AwsClient):
         return instanceIds, instanceIdMap
 
     def _get_inactive_task_definitions(self):
-        response = self.client.list_task_definitions(
+        return set(iterate_task_definitions(
+            self.client,
             familyPrefix=self.config.get_task_definition_name(),
             status='INACTIVE'
-        )
-        try:
-        	return response['taskDefinitionArns']
-        except:
-        	return []
+        ))
 
     def _get_inactive_running_tasks(self):
         task_arns = []
@@ -187,29 +350,61 @@ class EcsCluster(aws_client.AwsClient):
         self.log.info(inactive_task_definitions)
         if len(inactive_task_definitions) == 0:
             return task_arns
-        task_response = self.client.list_tasks(
-            cluster=self.config.get_ecs_cluster_name(),
+        cluster_name = self.config.get_ecs_cluster_name()
+        running_tasks = iterate_tasks(
+            self.client,
+            cluster=cluster_name,
             desiredStatus='RUNNING'
         )
-        if task_response['taskArns'] is None:
-            return task_arns
-        response = self.client.describe_tasks(
-            cluster=self.config.get_ecs_cluster_name(),
-            tasks=task_response['taskArns']
-        )
-        if response['tasks'] is None:
-            return task_arns
-        for task in response['tasks']:
+        for task in describe_tasks(self.client, cluster_name, running_tasks):
             if task['taskDefinitionArn'] in inactive_task_definitions:
                 task_arns.append(task['taskArn'])
         return task_arns
 
+    def _get_watcher(self, elb, tg_arn, as_client):
+        """
+        Return a ConvergenceWatcher of the service, its target group and its auto scaling group.
+        """
+        return convergence.ConvergenceWatcher(
+            self.client, self.config.get_ecs_cluster_name(), self.config.get_ecs_service_name(),
+            elb.client, tg_arn, as_client.client, as_client.as_group_name)
+
+    def _target_count_wait(self, watcher, original_desired, step_timeout, deadline):
+        """
+        Return a Wait for the targets to disappear from the LB until only |original_desired| are left.
+        """
+        def reached(snapshot):
+            if snapshot.target_count() < original_desired:
+                self.log.warn(
+                    'targetCount:%d IS BELOW desiredCount:%d.', snapshot.target_count(), original_desired)
+            return snapshot.target_count() <= original_desired
+        return watcher.wait(reached, 'target count in ' + self.config.get_tg_name(),
+                            timeout=step_timeout, deadline=deadline)
+
     def rolling_upgrade_service(self):
+        convergence.run_steps(self.rolling_upgrade_steps())
+
+    def rolling_upgrade_steps(self):
+        """
+        Generator of the steps of a rolling upgrade. It makes the calls of every step and
+        yields a convergence.Wait wherever the upgrade has to wait, for the caller to run.
+        """
+        if not self.needs_rolling_upgrade():
+            self.log.info('TaskDefinition %s is unchanged and already used by the service, '
+                          'skipping the rolling upgrade. Use --force_upgrade to roll the instances anyway',
+                          self.task_def['taskDefinitionArn'])
+            return
+        # Updating the task definition of the service starts a deployment already, only
+        # force one when the image of an unchanged task definition may have changed.
+        force_new_deployment = self.task_def_changed or options.get_options().force_upgrade()
         # Get instances attached to this target group which will be terminated
         # once rolling upgrade is done.
         elb = aws_client_elb.ElbClient(self.config)
-        _, tg_arn = elb.get_lb_and_tg()
-        instanceIds, _ = self._get_running_targets(elb, tg_arn)
+
+        def get_targets():
+            _, tg_arn = elb.get_lb_and_tg()
+            return tg_arn, self._get_running_targets(elb, tg_arn)[0]
+        tg_arn, instanceIds = resource_state.retry_if_stale(self.config, get_targets)
         self.log.info(
             'Found %s instances in target group to be upgraded.', instanceIds)
         # Use AutoScaling group to increase the number of instances.
@@ -217,113 +412,183 @@ class EcsCluster(aws_client.AwsClient):
         as_client = aws_client_auto_scaling.AutoScalingClient(self.config)
         app_as_client = aws_client_app_auto_scaling.AppAutoScalingClient(self.config)
         original_min, original_max, original_desired, _, _, _ = self.config.get_auto_scale_params()
+        # Every wait below is bounded by its own step timeout and by the overall upgrade deadline.
+        step_timeout, upgrade_timeout = self.config.get_upgrade_timeouts()
+        deadline = waiter.Deadline(upgrade_timeout)
+        # Every wait polls the service, the target health and the instances together.
+        watcher = self._get_watcher(elb, tg_arn, as_client)
+        try:
+            # Step 1. Delete all but the latest task definition
+            with tracing.span('upgrade: delete old task definitions'):
+                self.delete_all_but_latest_taskd()
 
-        # Step 1. Delete all but the latest task definition
-        self.delete_all_but_latest_taskd()
-
-        # Step 2(optional). Ensure the number of tasks is set to the original capacity before starting the rolling upgrade.
-        # This can happen if a rolling upgrade was aborted in between and min,max,desired was not set back to its original value
-        if options.get_options().normalize_tasks():
-            self.log.info(
-                'Ensuring # of tasks are set to the original desired capacity')
-            as_client.update_capacity_to(
-                original_min, original_max, original_desired, "OldestInstance")
-            running, desired = self._get_task_count()
-            while True:
-                if running == desired:
-                    self.log.info(
-                        'Running count:%d reached desired count:%d', running, desired)
-                    break
-                # Wait for running count of number of tasks to catch up to the desired count
-                running, desired = self._get_task_count()
+            # Step 2(optional). Ensure the number of tasks is set to the original capacity before starting the rolling upgrade.
+            # This can happen if a rolling upgrade was aborted in between and min,max,desired was not set back to its original value
+            if options.get_options().normalize_tasks():
                 self.log.info(
-                    'Waiting for runningCount:%d to catch upto desiredCount:%d. TargetGroup:%s', running, desired, self.config.get_tg_name())
-                time.sleep(30)
-        else:
-            self.log.info(
-                'Not normalizing task count before doing rolling upgrade')
-
-        # Step 3. Increase the capacity to 2x the original with the new task definition
-        new_desired = max(original_desired * 2, 3)
-        new_min = new_desired
-        new_max = new_desired
-        self.log.info('Starging rolling upgrade with newmin=%d newmax=%d newdesired=%d',
-                      new_min, new_max, new_desired)
-        app_as_client.update_ecs_autoscaling_parameters(new_min, new_max)
-        as_client.update_capacity_and_task_definition(
-            new_min, new_max, new_desired, "")
-        running, desired = self._get_task_count()
-        while True:
-            if running >= desired:
+                    'Ensuring # of tasks are set to the original desired capacity')
+                with tracing.span('upgrade: normalize task count'):
+                    as_client.update_capacity_to(
+                        original_min, original_max, original_desired, "OldestInstance")
+                    yield watcher.wait(lambda s: s.running_count == s.desired_count,
+                                       'task count normalization', timeout=step_timeout, deadline=deadline)
+            else:
                 self.log.info(
-                    'Running count:%d reached desired count:%d', running, desired)
-                break
-            # Wait for running count of number of tasks to catch up to the desired count
-            running, desired = self._get_task_count()
-            self.log.info(
-                'Waiting for runningCount:%d to catch upto desiredCount:%d. TargetGroup:%s', running, desired, self.config.get_tg_name())
-            time.sleep(30)
-        # Step 4. Wait for the targets to be marked healthy by the LB before decreasing the number of tasks
-        # Remove/Terminate any old instances.
-        if not options.get_options().wait_for_healthy_targets():
-            self.log.info(
-                'Not waiting for targets to become healthy before scaling down')
-        else:
-            while True:
-                healthy_targets = 0
-                _, instanceIdMap = self._get_running_targets(elb, tg_arn)
-                for k, v in instanceIdMap.items():
-                    health = v['TargetHealth']['State']
-                    if health == 'healthy':
-                        healthy_targets += 1
-                if healthy_targets >= new_desired:
-                    self.log.info(
-                        'healthyTargetCount:%d has reached desiredCount:%d.', healthy_targets, new_desired)
-                    break
+                    'Not normalizing task count before doing rolling upgrade')
+
+            strategy, max_surge, max_unavailable = self.config.get_upgrade_strategy()
+            if strategy == 'waves':
+                surge, unavailable = resolve_wave_sizes(max_surge, max_unavailable, original_desired)
+                for wait in self._upgrade_in_waves(watcher, as_client, app_as_client, surge, unavailable,
+                                                   step_timeout, deadline, force_new_deployment):
+                    yield wait
+                return
+            if strategy != 'surge':
+                raise ValueError('Unknown upgrade_strategy: ' + str(strategy))
+
+            # Step 3. Increase the capacity to 2x the original with the new task definition
+            new_desired = max(original_desired * 2, 3)
+            new_min = new_desired
+            new_max = new_desired
+            self.log.info('Starging rolling upgrade with newmin=%d newmax=%d newdesired=%d',
+                          new_min, new_max, new_desired)
+            with tracing.span('upgrade: scale up', desired=new_desired):
+                app_as_client.update_ecs_autoscaling_parameters(new_min, new_max)
+                as_client.update_capacity_and_task_definition(
+                    new_min, new_max, new_desired, "", force_new_deployment)
+            # Step 4. Wait for the upscaled tasks to run and their targets to be marked healthy by the LB
+            # before decreasing the number of tasks. Both are checked on every poll.
+            wait_for_healthy = options.get_options().wait_for_healthy_targets()
+            if not wait_for_healthy:
                 self.log.info(
-                    'Waiting for healthyTargetCount:%d to catch up to upscaled desiredCount:%d.', healthy_targets, new_desired)
-                time.sleep(30)
-
-        inactive_tasks = self._get_inactive_running_tasks()
-        self.log.info('Found %d tasks listed as inactive and running', len(inactive_tasks))
-        for task in inactive_tasks:
-            self.log.info('Task \'%s\' is listed as inactive', task)
-
-        as_client.update_capacity_to(
-            original_min, original_max, original_desired, "OldestInstance")
+                    'Not waiting for targets to become healthy before scaling down')
+
+            def upscaled(snapshot):
+                if snapshot.running_count < snapshot.desired_count:
+                    return False
+                return not wait_for_healthy or snapshot.healthy_target_count() >= new_desired
+            with tracing.span('upgrade: wait for upscaled tasks and healthy targets'):
+                yield watcher.wait(upscaled, 'upscaled tasks and healthy targets in ' + self.config.get_tg_name(),
+                                   timeout=step_timeout, deadline=deadline)
+
+            inactive_tasks = self._get_inactive_running_tasks()
+            self.log.info('Found %d tasks listed as inactive and running', len(inactive_tasks))
+            for task in inactive_tasks:
+                self.log.info('Task \'%s\' is listed as inactive', task)
+
+            # Step 5: Wait for the targets to disappear from the LB before decreasing the number of tasks
+            with tracing.span('upgrade: scale down', desired=original_desired):
+                as_client.update_capacity_to(
+                    original_min, original_max, original_desired, "OldestInstance")
+                yield self._target_count_wait(
+                    watcher, original_desired, step_timeout, deadline)
+
+            # Step 6: Drop the number of tasks, restore termination policy to default
+            with tracing.span('upgrade: restore auto scaling'):
+                app_as_client.update_ecs_autoscaling_parameters(original_min, original_max)
+                as_client.update_capacity_to(original_min, original_max, original_desired, "")
+        finally:
+            watcher.close()
+
+    def needs_rolling_upgrade(self):
+        """
+        Return true unless the task definition from create_taskd is unchanged and the
+        service already runs it, then a rolling upgrade would only replace identical tasks.
+        An image pushed again under the same tag, like latest, is not noticed: the task
+        definition is the same, so only --force_upgrade deploys it.
+        """
+        if options.get_options().force_upgrade() or self.task_def_changed:
+            return True
+        service = get_first_matching_active_service(
+            self, self.config.get_ecs_cluster_name(), self.config.get_ecs_service_name())
+        return service is None or service['taskDefinition'] != self.task_def['taskDefinitionArn']
 
-        # Step 5: Wait for the targets to disappear from the LB before decreasing the number of tasks
+    def _upgrade_in_waves(self, watcher, as_client, app_as_client, surge, unavailable,
+                          step_timeout, deadline, force_new_deployment):
+        """
+        Generator of the steps replacing the instances of the service a wave at a time. A wave launches up to |surge|
+        instances above the desired count and terminates up to |unavailable| old instances
+        right away. Once the new instances have healthy targets, the surge instances are
+        scaled in again, which removes the oldest, i.e. old, instances.
+        """
+        original_min, original_max, original_desired, _, _, _ = self.config.get_auto_scale_params()
+        old_instance_ids = set(as_client.get_instance_ids())
+        self.log.info('Starting rolling upgrade of %d instances in waves of surge=%d unavailable=%d',
+                      len(old_instance_ids), surge, unavailable)
+        upgraded = 0
+        wave = 0
         while True:
-            _, instanceIdMap = self._get_running_targets(elb, tg_arn)
-            num_targets = len(instanceIdMap)
-            if num_targets == original_desired:
-                self.log.info(
-                    'targetCount:%d has reached desiredCount:%d.', num_targets, original_desired)
-                break
-            if num_targets < original_desired:
-                self.log.warn(
-                    'targetCount:%d IS BELOW desiredCount:%d.', num_targets, original_desired)
+            remaining = sorted(old_instance_ids.intersection(as_client.get_instance_ids()))
+            if len(remaining) == 0:
                 break
-            self.log.info(
-                'Waiting for targetCount:%d to catch up to original desiredCount:%d.', num_targets, original_desired)
-            time.sleep(30)
-
-        # Step 6: Drop the number of tasks, restore termination policy to default
-        app_as_client.update_ecs_autoscaling_parameters(original_min, original_max)
-        as_client.update_capacity_to(original_min, original_max, original_desired, "")
+            wave += 1
+            wave_surge = min(surge, len(remaining))
+            wave_unavailable = min(unavailable, len(remaining) - wave_surge)
+            capacity = original_desired + wave_surge
+            self.log.info('Wave %d: %d old instances left, surge=%d unavailable=%d',
+                          wave, len(remaining), wave_surge, wave_unavailable)
+            with tracing.span('upgrade: wave', wave=wave, surge=wave_surge, unavailable=wave_unavailable):
+                # Step 3. Launch the surge instances, the first wave also rolls out the new task definition
+                app_as_client.update_ecs_autoscaling_parameters(capacity, capacity)
+                if wave == 1:
+                    as_client.update_capacity_and_task_definition(capacity, capacity, capacity, "",
+                                                                  force_new_deployment)
+                else:
+                    as_client.update_capacity_to(capacity, capacity, capacity, "")
+                # Old instances terminated without decrementing the capacity are replaced by new ones.
+                # Instances which failed to terminate are still old and are left to the next wave.
+                terminated = as_client.terminate_instances(remaining[:wave_unavailable], False)
+                if wave_surge == 0 and len(terminated.succeeded) == 0:
+                    # Nothing would be replaced in this wave
+                    terminated.check('terminating')
+                upgraded += wave_surge + len(terminated.succeeded)
+
+                # Step 4. Gate the wave on the new instances serving healthy targets
+                wait_for_healthy = options.get_options().wait_for_healthy_targets()
+                new_count = min(upgraded, original_desired)
+
+                def wave_done(snapshot):
+                    if snapshot.running_count < snapshot.desired_count:
+                        return False
+                    return not wait_for_healthy or snapshot.healthy_target_count(old_instance_ids) >= new_count
+                yield watcher.wait(wave_done, 'wave {0} of {1}'.format(wave, self.config.get_tg_name()),
+                                   timeout=step_timeout, deadline=deadline)
+
+                # Step 5. Scale in the group first so the oldest instances go along with their
+                # tasks, then the service so ECS does not stop tasks elsewhere.
+                if wave_surge > 0:
+                    as_client.update_group_capacity_to(
+                        original_desired, original_desired, original_desired, "OldestInstance")
+                    as_client.update_service_auto_scale_count(original_desired)
+
+        # Step 6: Restore auto scaling and wait for the old targets to drain
+        with tracing.span('upgrade: restore auto scaling'):
+            app_as_client.update_ecs_autoscaling_parameters(original_min, original_max)
+            as_client.update_capacity_to(original_min, original_max, original_desired, "")
+            yield self._target_count_wait(
+                watcher, original_desired, step_timeout, deadline)
 
     def create_taskd(self):
         """ ECS Create Task Definition """
-        container_definition = copy.deepcopy(
-            self.config.get_container_definition())
+        container_definition = get_desired_container_definition(self.config)
         tdname = self.config.get_task_definition_name()
-        # Read the task definition from the config and update the name
-        container_definition.update(
-            {
-                'name': self.config.create_name_with_separator(container_definition['name']),
-                'image': self.config.create_name(container_definition['image']),
-            }
-        )
+        if not self.is_planned('ecs', 'register_task_definition'):
+            # Reuse the latest revision
+            response = self.client.describe_task_definition(taskDefinition=tdname)
+            self.task_def = response['taskDefinition']
+            self.task_def_changed = False
+            return self.task_def
+        latest = self.get_latest_taskd()
+        if latest is not None and get_task_definition_hash(latest) == get_desired_task_definition_hash(self.config):
+            self.log.info("TaskDefinition is unchanged, reusing TaskDefinitionArn:%s",
+                          latest['taskDefinitionArn'])
+            image = container_definition['image']
+            if ':' not in image.rsplit('/', 1)[-1] or image.endswith(':latest'):
+                self.log.warn("Image %s has a mutable tag, a new image pushed under it is "
+                              "only deployed with --force_upgrade", image)
+            self.task_def = latest
+            self.task_def_changed = False
+            return self.task_def
         response = self.client.register_task_definition(
             family=tdname,
             networkMode=self.config.get_task_def_network_mode(),
@@ -335,21 +600,39 @@ class EcsCluster(aws_client.AwsClient):
         self.log.debug("Created TaskDefinition: %s",
                        self.config.pretty_print_json(response))
         self.task_def = response['taskDefinition']
+        self.task_def_changed = True
         self.log.info("Created/Updated TaskDefinition: TaskDefinitionArn:%s",
                       self.task_def['taskDefinitionArn'])
         return self.task_def
 
+    def get_latest_taskd(self):
+        """
+        Return the latest ACTIVE revision of the task definition, or None when there is none.
+        """
+        try:
+            response = self.client.describe_task_definition(
+                taskDefinition=self.config.get_task_definition_name())
+        except ClientError as e:
+            # Raised when the family has no ACTIVE revision
+            if e.response['Error']['Code'] == 'ClientException':
+                return None
+            raise
+        task_definition = response['taskDefinition']
+        if task_definition.get('status') != 'ACTIVE':
+            return None
+        return task_definition
+
     def delete_all_but_latest_taskd(self):
         """ ECS Create Task Definition """
         tdname = self.config.get_task_definition_name()
-        response = self.client.list_task_definitions(
+        task_definitions = list(iterate_task_definitions(
+            self.client,
             familyPrefix=tdname,
             status='ACTIVE',
             sort='DESC',
-        )
-        if len(response['taskDefinitionArns']) > 0:
-            task_definitions = response['taskDefinitionArns'][1:]
-            for t in task_definitions:
+        ))
+        if len(task_definitions) > 0:
+            for t in task_definitions[1:]:
                 self.log.info('Deregistering task definition %s', t)
                 # TODO: Don't crash if task def is not there.
                 self.client.deregister_task_definition(taskDefinition=t)
@@ -362,13 +645,11 @@ class EcsCluster(aws_client.AwsClient):
             'Load balancer name is: %s', lb_name)
         elb_client = aws_client_elb.ElbClient(self.config)
         elb_client.create_lb_and_friends()
-        grape_lb_arn, _dns_name = elb_client.get_lb_details()
-        grape_tg = elb_client.get_first_matching_target_group(
-            grape_lb_arn)
+        _grape_lb_arn, grape_tg_arn = elb_client.get_lb_and_tg()
         container_definition = self.task_def['containerDefinitions'][0]
         # Create LB to be passed to create_service
         lb_info = {
-            'targetGroupArn': grape_tg['TargetGroupArn'],
+            'targetGroupArn': grape_tg_arn,
             # 'loadBalancerName': 'grapes-upload',
             'containerName': container_definition['name'],
             'containerPort': container_definition['portMappings'][0]['containerPort'],
@@ -412,10 +693,16 @@ class EcsCluster(aws_client.AwsClient):
                 service=service_name,
             )
             if blocking:
-                while self.is_service_inactive() == False:
+                def service_inactive():
+                    if self.is_service_inactive():
+                        return True
                     self.log.info(
                         'Waiting for service %s to become INACTIVE', service_name)
-                    time.sleep(10)
+                    return False
+                waiter.wait_until(service_inactive,
+                                  'service {0} to become INACTIVE'.format(service_name))
+        except waiter.WaitTimeoutError:
+            raise
         except Exception as ex:
             self.log.info('Error deleting service %s. Error: %s',
                           service_name, ex)
@@ -457,6 +744,11 @@ class EcsCluster(aws_client.AwsClient):
             service = response['service']
             self.log.info("Created ECS Service: Name:%s ServiceArn:%s",
                           service['serviceName'], service['serviceArn'])
+        elif not self.is_planned('ecs', 'update_service', 'taskDefinition'):
+            pass
+        elif service['taskDefinition'] == self.task_def['taskDefinitionArn']:
+            self.log.info("ECS Service %s already uses TaskDefinitionArn:%s",
+                          service_name, service['taskDefinition'])
         else:
             # log some information
             response = self.client.update_service(
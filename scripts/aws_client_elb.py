@@ -4,16 +4,20 @@
 AWS boto3 client for ELB
 """
 import aws_client
-import boto3
+import resource_state
+import waiter
 from botocore.exceptions import ClientError
 
+# Number of targets sent in a single deregister_targets call.
+DEREGISTER_TARGETS_BATCH_SIZE = 100
+
 class ElbClient(aws_client.AwsClient):
     """
     Client for Elastic Load Balancer.
     """
 
     def __init__(self, config):
-        client = boto3.client('elbv2', region_name=config.get_region())
+        client = aws_client.get_client('elbv2', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
         self.lb = None
         self.tg = None
@@ -22,6 +26,15 @@ class ElbClient(aws_client.AwsClient):
         self.listener_arn = None
 
     def get_lb_details(self):
+        """
+        Return the ARN and the DNS name of the LB, from the state file if it is there.
+        """
+        lb = resource_state.lookup(self.config, 'load_balancer', self._describe_lb)
+        if lb is None:
+            return None, None
+        return lb['arn'], lb['dns_name']
+
+    def _describe_lb(self):
         lb_name = self.config.get_lb_name()
         lb_arn = None
         dns_name = None
@@ -37,7 +50,9 @@ class ElbClient(aws_client.AwsClient):
                 break
         except Exception as ex:
             self.log.debug("Could not find LB: %s", ex)
-        return lb_arn, dns_name
+        if lb_arn is None:
+            return None
+        return {'arn': lb_arn, 'dns_name': dns_name}
 
     def get_first_matching_target_group(self, lb_arn):
         response = self.client.describe_target_groups(
@@ -49,9 +64,10 @@ class ElbClient(aws_client.AwsClient):
             return target_groups[0]
         return None
 
-    def update_load_balancer_settings(self):
-        # Modify the LB timeout attributes if one was provided
-        lb_arn, _dns_name = self.get_lb_details()
+    def get_desired_lb_attributes(self):
+        """
+        LB attributes set from the configuration
+        """
         lb_idle_timeout = self.config.get_lb_timeouts()
         attributes = []
         if lb_idle_timeout != None:
@@ -59,7 +75,13 @@ class ElbClient(aws_client.AwsClient):
                 'Key': 'idle_timeout.timeout_seconds',
                 'Value': str(lb_idle_timeout),
             })
-        if len(attributes):
+        return attributes
+
+    def update_load_balancer_settings(self):
+        # Modify the LB timeout attributes if one was provided
+        lb_arn, _dns_name = self.get_lb_details()
+        attributes = self.get_desired_lb_attributes()
+        if len(attributes) and self.is_planned('elbv2', 'modify_load_balancer_attributes'):
             self.log.info('Setting LB attributes:%s LBName:%s',
                           attributes, self.config.get_lb_name())
             self.client.modify_load_balancer_attributes(
@@ -93,11 +115,18 @@ class ElbClient(aws_client.AwsClient):
             self.lb_arn = lb['LoadBalancerArn']
             self.log.info("Created/Updated LoadBalancer: LBName:%s LBArn:%s ",
                           lb['LoadBalancerName'], self.lb_arn)
+            resource_state.put(self.config, 'load_balancer',
+                               {'arn': self.lb_arn, 'dns_name': lb['DNSName']})
             the_lb = lb  # There should only be one entry in the returned response array
             break
         return the_lb
 
     def delete_lb_and_friends(self):
+        resource_state.retry_if_stale(self.config, self._delete_lb_and_friends)
+        resource_state.forget(self.config, 'load_balancer')
+        resource_state.forget(self.config, 'target_group')
+
+    def _delete_lb_and_friends(self):
         lb_name = self.config.get_lb_name()
         # Get LB details and then delete it.
         lbarn, _dns_name = self.get_lb_details()
@@ -149,31 +178,20 @@ class ElbClient(aws_client.AwsClient):
         tg = self.create_or_update_target_group()
         self.create_load_balancer_listeners(lb_arn, tg)
 
-    def create_load_balancer_listeners(self,
-                                       lb_arn,
-                                       target_group,
-                                       ):
-        # TODO :Create TargetGroup before creating listener.
-        self.lb_arn = lb_arn
-        self.tg_arn = target_group['TargetGroupArn']
+    def get_desired_listeners(self):
+        """
+        Listeners from the configuration as create_listener arguments without the LB and TG
+        """
         port, protocol = self.config.get_main_listener_info()
-        response = self.client.create_listener(
-            LoadBalancerArn=self.lb_arn,
-            Protocol=protocol,
-            Port=port,
-            DefaultActions=[
-                {
-                    'Type': 'forward',
-                    'TargetGroupArn': self.tg_arn,
-                }
-            ]
-        )
-
+        listeners = [
+            {
+                'Protocol': protocol,
+                'Port': port,
+            }
+        ]
         alt_listeners = self.config.get_alt_listener_infos()
-        self.log.info(alt_listeners)
         if alt_listeners is not None:
             for listener in alt_listeners:
-                self.log.info(listener)
                 certs = []
                 if listener['cert_arn'] is not None:
                     certs = [
@@ -181,29 +199,96 @@ class ElbClient(aws_client.AwsClient):
                         'CertificateArn': listener['cert_arn']
                     }
                 ]
-                response = self.client.create_listener(
-                    LoadBalancerArn=self.lb_arn,
-                    Protocol=listener['protocol'],
-                    Port=listener['port'],
-                    Certificates=certs,
-                    DefaultActions=[
-                        {
-                            'Type': 'forward',
-                            'TargetGroupArn': self.tg_arn,
-                        }
-                    ]
-                )
+                listeners.append({
+                    'Protocol': listener['protocol'],
+                    'Port': listener['port'],
+                    'Certificates': certs,
+                })
+        return listeners
 
-        # log some information
-        self.log.debug("LBListeners: %s", response)
-        for listener in response['Listeners']:
-            for action in listener['DefaultActions']:
-                self.listener_arn = listener['LoadBalancerArn']
-                self.log.info("Created/Updated LBListener: LBArn:%s TargetGroupArn:%s",
-                              self.listener_arn, action['TargetGroupArn'])
+    def create_load_balancer_listeners(self,
+                                       lb_arn,
+                                       target_group,
+                                       ):
+        # TODO :Create TargetGroup before creating listener.
+        self.lb_arn = lb_arn
+        self.tg_arn = target_group['TargetGroupArn']
+        self.log.info(self.config.get_alt_listener_infos())
+        response = None
+        for listener in self.get_desired_listeners():
+            if not self.is_planned('elbv2', 'create_listener', listener['Port']):
+                continue
+            self.log.info(listener)
+            response = self.client.create_listener(
+                LoadBalancerArn=self.lb_arn,
+                DefaultActions=[
+                    {
+                        'Type': 'forward',
+                        'TargetGroupArn': self.tg_arn,
+                    }
+                ],
+                **listener
+            )
+            # log some information
+            self.log.debug("LBListeners: %s", response)
+            for l in response['Listeners']:
+                for action in l['DefaultActions']:
+                    self.listener_arn = l['LoadBalancerArn']
+                    self.log.info("Created/Updated LBListener: LBArn:%s TargetGroupArn:%s",
+                                  self.listener_arn, action['TargetGroupArn'])
 
         return response
 
+    def get_desired_health_check(self):
+        """
+        Health check settings of the target group which can be modified in place
+        """
+        tg_protocol = self.config.get_tg_protocol()
+        port, path, healthy_threshold, healthy_check_interval = self.config.get_tg_health_check_info()
+        if tg_protocol == 'TCP':
+            return {
+                'HealthCheckIntervalSeconds': healthy_check_interval,
+                'HealthyThresholdCount': healthy_threshold,
+                'UnhealthyThresholdCount': healthy_threshold,
+            }
+        return {
+            'HealthCheckPath': path,
+            'HealthCheckIntervalSeconds': healthy_check_interval,
+            'HealthyThresholdCount': healthy_threshold,
+        }
+
+    def get_desired_target_group_attributes(self):
+        """
+        Target group attributes set from the configuration
+        """
+        stickiness, drain_timeout = self.config.get_tg_attributes()
+        attributes = []
+        if stickiness is not None:
+            stickiness = str(stickiness).lower()
+            duration = str(120)
+            attributes.append({
+                'Key': 'stickiness.enabled',
+                'Value': stickiness,
+            })
+
+            attributes.append(
+                {
+                    'Key': 'stickiness.type',
+                    'Value': 'lb_cookie',
+                })
+            attributes.append(
+                {
+                    'Key': 'stickiness.lb_cookie.duration_seconds',
+                    'Value': duration,
+                })
+        if drain_timeout != None:
+            attributes.append(
+                {
+                    'Key': 'deregistration_delay.timeout_seconds',
+                    'Value': str(drain_timeout),
+                })
+        return attributes
+
     def create_or_update_target_group(self):
         tg_name = self.config.get_tg_name()
         tg_protocol = self.config.get_tg_protocol()
@@ -219,21 +304,9 @@ class ElbClient(aws_client.AwsClient):
             # Modify the existing one. Only some parameters can be modified without
             # taking down the entire TG/LB/Listeners.
             tg_arn = response['TargetGroups'][0]['TargetGroupArn']
-            if tg_protocol == 'TCP':
-                kwargs = {
-                    'TargetGroupArn': tg_arn,
-                    'HealthCheckIntervalSeconds': healthy_check_interval,
-                    'HealthyThresholdCount': healthy_threshold,
-                    'UnhealthyThresholdCount': healthy_threshold,
-                }
-            else:
-                kwargs = {
-                    'TargetGroupArn': tg_arn,
-                    'HealthCheckPath': path,
-                    'HealthCheckIntervalSeconds': healthy_check_interval,
-                    'HealthyThresholdCount': healthy_threshold,
-                }
-            response = self.client.modify_target_group(**kwargs)
+            if self.is_planned('elbv2', 'modify_target_group'):
+                response = self.client.modify_target_group(
+                    TargetGroupArn=tg_arn, **self.get_desired_health_check())
         except:
             # No Target group found
             if tg_protocol == 'TCP':
@@ -262,35 +335,10 @@ class ElbClient(aws_client.AwsClient):
                 }
             response = self.client.create_target_group(**kwargs)
             tg_arn = response['TargetGroups'][0]['TargetGroupArn']
+        resource_state.put(self.config, 'target_group', tg_arn)
         # Modify the target group attribute if any
-        stickiness, drain_timeout = self.config.get_tg_attributes()
-        attributes = []
-        if stickiness is not None:
-            stickiness = str(stickiness).lower()
-            duration = str(120)
-            attributes.append({
-                'Key': 'stickiness.enabled',
-                'Value': stickiness,
-            })
-
-            attributes.append(
-                {
-                    'Key': 'stickiness.type',
-                    'Value': 'lb_cookie',
-                })
-            attributes.append(
-                {
-                    'Key': 'stickiness.lb_cookie.duration_seconds',
-                    'Value': duration,
-                })
-        if drain_timeout != None:
-            attributes.append(
-                {
-                    'Key': 'deregistration_delay.timeout_seconds',
-                    'Value': str(drain_timeout),
-                })
-
-        if len(attributes) > 0:
+        attributes = self.get_desired_target_group_attributes()
+        if len(attributes) > 0 and self.is_planned('elbv2', 'modify_target_group_attributes'):
             self.client.modify_target_group_attributes(
                 TargetGroupArn=tg_arn,
                 Attributes=attributes)
@@ -310,45 +358,72 @@ class ElbClient(aws_client.AwsClient):
         return self.tg_arn
 
     def get_lb_and_tg(self):
+        """
+        Return the ARNs of the LB and its target group, from the state file if they are there.
+        Either is None when it does not exist.
+        """
         lb_arn, _dns_name = self.get_lb_details()
-        tg = self.get_first_matching_target_group(lb_arn)
-        tg_arn = tg['TargetGroupArn']
+
+        def describe_tg():
+            if lb_arn is None:
+                return None
+            tg = self.get_first_matching_target_group(lb_arn)
+            if tg is None:
+                return None
+            return tg['TargetGroupArn']
+        tg_arn = resource_state.lookup(self.config, 'target_group', describe_tg)
         return lb_arn, tg_arn
 
-    def _remove_instances(self, instances, blocking):
-        _, tg = self.get_lb_and_tg()
-        for i in instances:
+    def _deregister_targets(self, tg, instances):
+        """
+        Deregister |instances| from the target group in as few calls as possible.
+        """
+        for start in range(0, len(instances), DEREGISTER_TARGETS_BATCH_SIZE):
+            batch = instances[start:start + DEREGISTER_TARGETS_BATCH_SIZE]
             response = self.client.deregister_targets(
                 TargetGroupArn=tg,
-                Targets=[
-                    {
-                        'Id': i,
-                    },
-                ]
+                Targets=[{'Id': i} for i in batch]
             )
-            self.log.info('Deregistering target %s. Response %s', i, response)
+            self.log.info('Deregistering targets %s. Response %s', batch, response)
+
+    def _get_draining_targets(self, tg, instances):
+        """
+        Return the subset of |instances| that the target group still reports as draining.
+        """
+        response = self.client.describe_target_health(
+            TargetGroupArn=tg,
+        )
+        draining = []
+        for t in response['TargetHealthDescriptions']:
+            if t['Target']['Id'] in instances and t['TargetHealth']['State'] == 'draining':
+                draining.append(t['Target']['Id'])
+        return draining
+
+    def _remove_instances(self, instances, blocking):
+        instances = list(instances)
+        if len(instances) == 0:
+            return
+
+        def deregister():
+            _, tg = self.get_lb_and_tg()
             self.log.info('Tg %s', tg)
-            if blocking:
-                while True:
-                    response = self.client.describe_target_health(
-                        TargetGroupArn=tg,
-                        Targets=[
-                            {
-                                'Id': i,
-                            }
-                        ]
-                    )
-                    if len(response['TargetHealthDescriptions']) == 0:
-                        break
-                    state = response['TargetHealthDescriptions'][0]['TargetHealth']['State']
-                    if state == 'draining':
-                        self.log.info(
-                            'Instance %s is still draining. State %s', i, state)
-                        time.sleep(30)
-                    else:
-                        self.log.info(
-                            'Finished draining instance %s State %s', i, state)
-                        break
+            self._deregister_targets(tg, instances)
+            return tg
+        tg = resource_state.retry_if_stale(self.config, deregister)
+        if blocking:
+            # All the targets drain at the same time, so watch them together.
+            instance_set = set(instances)
+
+            def targets_drained():
+                draining = self._get_draining_targets(tg, instance_set)
+                if len(draining) > 0:
+                    self.log.info(
+                        '%d of %d instances are still draining: %s', len(draining), len(instance_set), draining)
+                    return False
+                self.log.info('Finished draining instances %s', instances)
+                return True
+            waiter.wait_until(targets_drained,
+                              '{0} targets to drain'.format(len(instances)))
 
     def remove_instances(self, instances):
         """
@@ -4,7 +4,6 @@
 AWS boto3 client for SQS
 """
 import aws_client
-import boto3
 import logger
 import elb
 import time
@@ -18,7 +17,7 @@ class SqsClient(aws_client.AwsClient):
     """
 
     def __init__(self, config):
-        client = boto3.client('sqs', region_name=config.get_region())
+        client = aws_client.get_client('sqs', config.get_region())
         aws_client.AwsClient.__init__(self, config, client)
 
     def maybe_create_sqs(self):
@@ -30,6 +29,8 @@ class SqsClient(aws_client.AwsClient):
 
     def create_sqs(self):
         qname = self.config.create_name_with_separator(self.config.get_sqs())
+        if not self.is_planned('sqs', 'create_queue'):
+            return
         self.log.info('Prefix:%s Creating SQS:%s', self.config.get_prefix(), qname)
         q = self.client.create_queue(
             QueueName=qname
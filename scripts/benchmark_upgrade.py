@@ -0,0 +1,242 @@
+#!/usr/bin/python
+"""
+Benchmarks the rolling upgrade of an ECS service end to end against the simulated
+control plane of fake_aws, at several fleet sizes.
+
+"""
+
+import argparse
+import json
+import logging
+import time
+import yaml
+import aws_client_ecs
+import aws_client_elb
+import cluster
+import fake_aws
+import options
+import service_config
+import waiter
+
+DEFAULT_SIZES = [3, 30, 300, 1000]
+
+
+def setup_and_parse_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description="""
+    Benchmark the rolling upgrade against a simulated control plane. Times are virtual
+    seconds of the simulation, which runs much faster than real time.
+
+    Delays are given as seconds or as a distribution the simulation samples from for every
+    instance, task and target: uniform:LOW:HIGH, normal:MEAN:STDDEV or exp:MEAN.
+
+    Example usage:
+    python ./benchmark_upgrade.py                                       # 3, 30, 300 and 1000 targets
+    python ./benchmark_upgrade.py --sizes 30 --health_check_delay exp:90 --json=out.json
+    python ./benchmark_upgrade.py --upgrade_strategy waves --max_surge 10% --max_unavailable 0
+    """)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Number of targets of the benchmarked fleets')
+    parser.add_argument('--task_start_delay', default='uniform:5:30',
+                        help='Seconds a task takes to reach RUNNING once placed')
+    parser.add_argument('--health_check_delay', default='normal:60:15',
+                        help='Seconds a target takes to turn healthy once its task is running')
+    parser.add_argument('--instance_start_delay', default='uniform:45:90',
+                        help='Seconds an instance takes to join the cluster once launched')
+    parser.add_argument('--deregistration_delay', type=int, default=60,
+                        help='Seconds a target drains for once deregistered')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds every API call takes')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='Chance of an API call attempt being throttled')
+    parser.add_argument('--task_failure_rate', type=float, default=0.0,
+                        help='Chance of a task failing to start')
+    parser.add_argument('--upgrade_strategy', default='surge', choices=['surge', 'waves'],
+                        help='Rolling upgrade strategy of the benchmarked service')
+    parser.add_argument('--max_surge', default='25%',
+                        help='Instances a wave launches above the desired count, a count or a percentage')
+    parser.add_argument('--max_unavailable', default='0',
+                        help='Old instances a wave terminates up front, a count or a percentage')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the simulation')
+    parser.add_argument('--json', default=None,
+                        help='If set then the results are also written to this file as JSON')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Log the upgrade instead of only printing the results')
+    return parser.parse_args()
+
+
+def parse_distribution(spec):
+    """
+    Return seconds or a function sampling seconds from a random.Random for |spec|.
+    """
+    parts = spec.split(':')
+    if len(parts) == 1:
+        return float(parts[0])
+    kind = parts[0]
+    params = [float(p) for p in parts[1:]]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda r: r.uniform(params[0], params[1])
+    if kind == 'normal' and len(params) == 2:
+        return lambda r: r.gauss(params[0], params[1])
+    if kind == 'exp' and len(params) == 1:
+        return lambda r: r.expovariate(1.0 / params[0])
+    raise ValueError('Unknown delay distribution: ' + spec)
+
+
+def generate_config(size, image_tag, args):
+    """
+    Return the YAML of a service config with a fleet of |size| targets.
+    """
+    config = {
+        'prefix': 'bench',
+        'region': 'us-east-1',
+        'service_type': 'bench',
+        'service_name': 'bench',
+        'docker_image_tag': image_tag,
+        'cmdline_env_flag': '-env=bench',
+        'ecs_cluster_name': ['bench', 'cluster'],
+        'ecs_service_name': ['bench', 'service'],
+        'lb_name': ['bench', 'lb'],
+        'tg_name': ['bench', 'tg'],
+        'ec2_name': ['bench', 'ec2'],
+        'lb_type': 'application',
+        'lb_scheme': 'internet-facing',
+        'lb_port': 80,
+        'tg_protocol': 'HTTP',
+        'tg_health_check_port': 8080,
+        'tg_health_check_path': '/health',
+        'tg_connection_drain_timeout': args.deregistration_delay,
+        'upgrade_strategy': args.upgrade_strategy,
+        'upgrade_max_surge': args.max_surge,
+        'upgrade_max_unavailable': args.max_unavailable,
+        'vpc': 'vpc-bench',
+        'subnets': ['subnet-a', 'subnet-b'],
+        'security_groups': ['sg-bench'],
+        'ami': 'ami-bench',
+        'sshkey': 'bench',
+        'ec2_iam_role': 'ecsInstanceRole',
+        'ecs_role': 'ecsServiceRole',
+        'volume_name': '/dev/xvdcz',
+        'volume_size': 22,
+        'volume_basesize': '20G',
+        'instance_type': 'c5.large',
+        'alarm': {
+            'name': ['bench', 'alarm'],
+            'alarm_action': ['arn:aws:sns:us-east-1:123456789012:bench'],
+            'description': 'Unhealthy hosts',
+            'enabled': False,
+        },
+        'container_definition': {
+            'name': ['bench', 'container'],
+            'image': ['bench/image:', image_tag],
+            'memory': 512,
+            'portMappings': [{'containerPort': 8080, 'hostPort': 8080}],
+        },
+        'auto_scale_group': {
+            'name': ['bench', 'asg'],
+            'launch_config_name': ['bench', 'lc'],
+            'min': size,
+            'max': size * 2,
+            'desired': size,
+            'availability_zones': ['us-east-1a', 'us-east-1b'],
+            'vpc_zone_identifier': 'subnet-a,subnet-b',
+            'default_cooldown': 300,
+            'cpu_threshold': 70,
+        },
+    }
+    return yaml.safe_dump(config)
+
+
+def _wait_for_healthy_fleet(config, size):
+    elb = aws_client_elb.ElbClient(config)
+    _, tg_arn = elb.get_lb_and_tg()
+
+    def healthy():
+        response = elb.client.describe_target_health(TargetGroupArn=tg_arn)
+        instances = set(t['Target']['Id'] for t in response['TargetHealthDescriptions']
+                        if t['TargetHealth']['State'] == 'healthy')
+        return len(instances) >= size
+    waiter.wait_until(healthy, 'fleet of {0} healthy targets'.format(size))
+
+
+def _count_upgraded_tasks(config):
+    ecs = aws_client_ecs.EcsCluster(config)
+    cluster_name = config.get_ecs_cluster_name()
+    latest = ecs.client.describe_task_definition(
+        taskDefinition=config.get_task_definition_name())['taskDefinition']['taskDefinitionArn']
+    task_arns = aws_client_ecs.iterate_tasks(
+        ecs.client, cluster=cluster_name, serviceName=config.get_ecs_service_name())
+    return len([t for t in aws_client_ecs.describe_tasks(ecs.client, cluster_name, task_arns)
+                if t['lastStatus'] == 'RUNNING' and t['taskDefinitionArn'] == latest])
+
+
+def run(size, args):
+    """
+    Create a fleet of |size| targets, upgrade it and return the measurements of the upgrade.
+    """
+    fake = fake_aws.FakeAws(
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        task_failure_rate=args.task_failure_rate,
+        instance_start_delay=parse_distribution(args.instance_start_delay),
+        task_start_delay=parse_distribution(args.task_start_delay),
+        health_check_delay=parse_distribution(args.health_check_delay),
+        seed=args.seed,
+    )
+    fake_aws.install(fake)
+    try:
+        current = service_config.load_config_from_yaml(
+            generate_config(size, '1.0', args), None)
+        upgraded = service_config.load_config_from_yaml(
+            generate_config(size, '2.0', args), None)
+        cluster.create_or_update_cluster(current)
+        _wait_for_healthy_fleet(current, size)
+
+        fake.reset_stats()
+        start = fake.clock.time()
+        wall_start = time.time()
+        cluster.upgrade_cluster(upgraded)
+        upgrade_seconds = fake.clock.time() - start
+        wall_seconds = time.time() - wall_start
+        calls = dict(fake.calls)
+
+        region = fake.get_region(upgraded.get_region())
+        service = region.services[(upgraded.get_ecs_cluster_name(), upgraded.get_ecs_service_name())]
+        group = region.as_groups[upgraded.get_as_name()]
+        return {
+            'size': size,
+            'upgrade_seconds': upgrade_seconds,
+            'api_calls': sum(calls.values()),
+            'throttles': sum(fake.throttles.values()),
+            'peak_tasks': service.peak_task_count,
+            'peak_instances': group.peak_instance_count,
+            'surge': float(service.peak_task_count) / size,
+            'upgraded_tasks': _count_upgraded_tasks(upgraded),
+            'wall_seconds': wall_seconds,
+            'calls': calls,
+        }
+    finally:
+        fake_aws.uninstall()
+
+
+def __main__():
+    args = setup_and_parse_args()
+    options.create_options(args)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    print('{0:>6} {1:>12} {2:>9} {3:>9} {4:>10} {5:>7} {6:>14} {7:>9} {8:>8}'.format(
+        'size', 'upgrade (s)', 'api calls', 'throttles', 'peak tasks', 'surge', 'peak instances', 'upgraded', 'wall (s)'))
+    for size in args.sizes:
+        r = run(size, args)
+        results.append(r)
+        print('{0:>6} {1:>12.0f} {2:>9} {3:>9} {4:>10} {5:>6.2f}x {6:>14} {7:>9} {8:>8.1f}'.format(
+            r['size'], r['upgrade_seconds'], r['api_calls'], r['throttles'], r['peak_tasks'],
+            r['surge'], r['peak_instances'], r['upgraded_tasks'], r['wall_seconds']))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    __main__()
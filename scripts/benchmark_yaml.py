@@ -0,0 +1,98 @@
+#!/usr/bin/python
+"""
+Compares the pure python and the libyaml based YAML loading and dumping of large
+resolved configs.
+
+"""
+
+import argparse
+import time
+import yaml
+import yaml_with_custom_extn
+
+
+def setup_and_parse_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description="""
+    Benchmark YAML loading and dumping with and without libyaml.
+
+    Example usage:
+    python ./benchmark_yaml.py                                  # Use a generated config
+    python ./benchmark_yaml.py --file=<resolved-config.yaml>    # Use a fully resolved config
+    """)
+    parser.add_argument('--file', default=None,
+                        help='Fully resolved config file to benchmark. A large config is generated if not given')
+    parser.add_argument('--env_size', type=int, default=2000,
+                        help='Number of environment variables in the generated container definition')
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='Number of times each operation is repeated')
+    return parser.parse_args()
+
+
+def generate_config(env_size):
+    """
+    Return the YAML of a config with a container definition containing |env_size| environment variables.
+    """
+    environment = []
+    for i in range(env_size):
+        environment.append({
+            'name': 'ENV_VARIABLE_{0}'.format(i),
+            'value': 'some-fairly-long-value-{0}-for-the-container-command-line'.format(i),
+        })
+    config = {
+        'prefix': 'bench',
+        'region': 'us-east-1',
+        'ecs_cluster_name': ['bench', 'cluster'],
+        'container_definition': {
+            'name': ['bench', 'container'],
+            'image': ['bench/image:', '1.0.0'],
+            'memory': 512,
+            'portMappings': [{'containerPort': 8080, 'hostPort': 0}],
+            'environment': environment,
+        },
+    }
+    return yaml.safe_dump(config)
+
+
+def _time(fn, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        fn()
+    return (time.time() - start) / iterations
+
+
+def run(text, iterations):
+    """
+    Return a list of (name, pure python seconds, libyaml seconds) per operation.
+    """
+    data = yaml_with_custom_extn.safe_load(text, loader=yaml.SafeLoader)
+    results = []
+    results.append((
+        'load',
+        _time(lambda: yaml_with_custom_extn.safe_load(text, loader=yaml.SafeLoader), iterations),
+        _time(lambda: yaml_with_custom_extn.safe_load(text, loader=yaml_with_custom_extn.FastSafeLoader), iterations),
+    ))
+    results.append((
+        'dump',
+        _time(lambda: yaml_with_custom_extn.safe_dump(data, dumper=yaml.SafeDumper), iterations),
+        _time(lambda: yaml_with_custom_extn.safe_dump(data, dumper=yaml_with_custom_extn.FastSafeDumper), iterations),
+    ))
+    return results
+
+
+def __main__():
+    args = setup_and_parse_args()
+    if args.file is not None:
+        with open(args.file, 'r') as f:
+            text = f.read()
+    else:
+        text = generate_config(args.env_size)
+    if not yaml_with_custom_extn.HAS_LIBYAML:
+        print('libyaml is not available, both columns use the pure python implementation')
+    print('YAML size: {0} bytes, {1} iterations'.format(len(text), args.iterations))
+    print('{0:<6} {1:>12} {2:>12} {3:>8}'.format('op', 'python (ms)', 'libyaml (ms)', 'speedup'))
+    for name, pure, fast in run(text, args.iterations):
+        print('{0:<6} {1:>12.2f} {2:>12.2f} {3:>7.1f}x'.format(name, pure * 1000, fast * 1000, pure / fast))
+
+
+if __name__ == "__main__":
+    __main__()
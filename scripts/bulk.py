@@ -0,0 +1,79 @@
+#!/bin/python
+
+"""
+Runs the same mutating call for many items on a bounded thread pool, rate limited by a
+shared token bucket. Errors are collected per item instead of aborting the whole run.
+"""
+from concurrent import futures
+import events
+import logger
+
+DEFAULT_MAX_WORKERS = 10
+
+log = logger.getLogger()
+
+
+class BulkError(Exception):
+    """
+    Raised by BulkResult.check when some of the calls failed.
+    """
+
+    def __init__(self, description, result):
+        Exception.__init__(self, 'Error {0} {1} of {2} items, e.g. {3}: {4}'.format(
+            description, len(result.failed), len(result.failed) + len(result.succeeded),
+            *next(iter(result.failed.items()))))
+        self.result = result
+
+
+class BulkResult():
+    """
+    Items which succeeded and the exception of every item which failed.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+
+    def ok(self):
+        return len(self.failed) == 0
+
+    def check(self, description):
+        """
+        Raise a BulkError if any item failed, return the result otherwise.
+        """
+        if not self.ok():
+            raise BulkError(description, self)
+        return self
+
+
+def run(fn, items, bucket, description, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Call fn(item) for every item taking a token from |bucket| before each call.
+    Returns a BulkResult.
+    """
+    def call(item):
+        bucket.acquire()
+        return fn(item)
+    # The calls emit events with the context of the caller
+    call = events.bind(call)
+
+    result = BulkResult()
+    items = list(items)
+    if len(items) == 0:
+        return result
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        fs = dict((executor.submit(call, item), item) for item in items)
+        for f in futures.as_completed(fs):
+            item = fs[f]
+            error = f.exception()
+            if error is None:
+                result.succeeded.append(item)
+            else:
+                log.warn('Error %s %s. Error: %s', description, item, error)
+                result.failed[item] = error
+    finally:
+        executor.shutdown(wait=True)
+    log.info('Finished %s: %d succeeded, %d failed',
+             description, len(result.succeeded), len(result.failed))
+    return result
@@ -0,0 +1,70 @@
+#!/bin/python
+
+"""
+Time source of the scripts. Waits, rate limits and metrics read the time and sleep
+through this module so tests and benchmarks can swap in a VirtualClock and get
+through hours of polling instantly.
+"""
+import threading
+import time as _time
+
+
+class RealClock():
+    """
+    Wall clock time.
+    """
+
+    def time(self):
+        return _time.time()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+
+class VirtualClock():
+    """
+    Clock which only moves when slept on. sleep() advances the time and returns at once,
+    so sleeps of concurrent threads add up instead of overlapping.
+    """
+
+    def __init__(self, start=None):
+        if start is None:
+            start = _time.time()
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(seconds, 0)
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+
+_clock = RealClock()
+
+
+def set_clock(clock):
+    """
+    Use |clock| as the time source of the process. None restores the wall clock.
+    """
+    global _clock
+    if clock is None:
+        clock = RealClock()
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def time():
+    return _clock.time()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
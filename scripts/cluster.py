@@ -5,44 +5,131 @@ Creates the ECS Cluster
 """
 
 import argparse
+import contextlib
 import aws_client_ec2
 import aws_client_ecs
+import convergence
 import string
 import ec2
-import auto_scale
 import sqs
 import logger
+import options
+import planner
+import aws_client
+import tracing
+import resource_state
+import phases
+import aws_client_auto_scaling
+import aws_client_app_auto_scaling
 
 logger = logger.getLogger()
 
 
+def plan_cluster(config):
+    """
+    Return the plan of mutating calls create_or_update_cluster would make.
+    """
+    return planner.create_plan(config)
+
+
+def plan_if_enabled(config):
+    """
+    Return the plan of create_or_update_cluster if planning is on, None otherwise.
+    """
+    if not options.get_options().plan():
+        return None
+    with tracing.span('create: plan'):
+        plan = plan_cluster(config)
+    logger.info('Planned calls: %s', plan.to_json())
+    return plan
+
+
+@contextlib.contextmanager
+def using_plan(config, plan):
+    """
+    Skip the mutating calls for |config| which are not in |plan|, if any, in the with block.
+    """
+    aws_client.set_plan(config, plan)
+    try:
+        yield
+    finally:
+        aws_client.set_plan(config, None)
+
+
 def create_or_update_cluster(config):
     """
     Create the cluster.
     """
     config.log_component_names()
-    # Create the SQS queue
-    sqs.maybe_create_sqs(config)
-    # Create the ECS Cluster, task definition and the service.
+    # Skip the calls which would not change anything
+    with using_plan(config, plan_if_enabled(config)):
+        phases.run_phases(get_create_phases(config))
+
+def get_create_phases(config):
+    """
+    Return the phases of create_or_update_cluster. The SQS queue, the ECS cluster, the task
+    definition and the launch configuration don't depend on each other. The resource
+    state is saved once all of them finished.
+    """
     ecs_cluster = aws_client_ecs.EcsCluster(config)
-    ecs_cluster.create_cluster()
-    ecs_cluster.create_taskd()
-    ecs_cluster.create_service()
-    # Create the auto scaling group
-    auto_scale.create_auto_scaling_and_launch_configuration(config)
+    as_client = aws_client_auto_scaling.AutoScalingClient(config)
+    app_as_client = aws_client_app_auto_scaling.AppAutoScalingClient(config)
+
+    def create_auto_scaling_group():
+        # Also creates the target group if the service phase did not
+        as_client.get_or_create_auto_scaling_group()
+        as_client.update_auto_scale_policy()
+    result = [
+        phases.Phase('create: sqs', lambda: sqs.maybe_create_sqs(config)),
+        phases.Phase('create: ecs cluster', ecs_cluster.create_cluster),
+        phases.Phase('create: task definition', ecs_cluster.create_taskd),
+        phases.Phase('create: launch configuration', as_client.get_or_create_launch_configuration),
+        phases.Phase('create: service and load balancer',
+                     lambda: resource_state.retry_if_stale(config, ecs_cluster.create_service),
+                     ['create: ecs cluster', 'create: task definition']),
+        phases.Phase('create: auto scaling group', create_auto_scaling_group,
+                     ['create: launch configuration', 'create: service and load balancer']),
+        phases.Phase('create: application auto scaling', app_as_client.create_ecs_autoscaling,
+                     ['create: service and load balancer']),
+    ]
+    result.append(phases.Phase('create: resource state', lambda: resource_state.save(config),
+                               [p.name for p in result]))
+    return result
+
 
 def upgrade_cluster(config):
     """
     Do a rolling upgrade of the instances in the cluster.
     """
+    convergence.run_steps(get_upgrade_steps(config))
+
+
+def get_upgrade_steps(config):
+    """
+    Generator of the steps of upgrade_cluster, it yields the waits of the rolling upgrade
+    for the caller to run like EcsCluster.rolling_upgrade_steps.
+    """
     config.log_component_names()
     logger.info('Doing a rolling upgrade')
     ecs_cluster = aws_client_ecs.EcsCluster(config)
     # Create the new task definition before doing the upgrade
-    ecs_cluster.create_taskd()
+    with tracing.span('upgrade: task definition'):
+        ecs_cluster.create_taskd()
     # Use the new task definition in the service
-    ecs_cluster.create_service()
-    ecs_cluster.rolling_upgrade_service()
+    with tracing.span('upgrade: service'):
+        resource_state.retry_if_stale(config, ecs_cluster.create_service)
+    with tracing.span('upgrade: rolling upgrade'):
+        # Pass the errors of the waits on to the rolling upgrade steps
+        steps = ecs_cluster.rolling_upgrade_steps()
+        wait = next(steps, None)
+        while wait is not None:
+            try:
+                yield wait
+            except Exception as e:
+                wait = convergence.throw(steps, e)
+                continue
+            wait = next(steps, None)
+    resource_state.save(config)
     logger.info('Finished doing rolling upgrade')
 
 
@@ -51,16 +138,37 @@ def destroy_cluster(config, destroy_sqs):
     Delete the cluster and shutdown all instances
     """
     config.log_component_names()
+    phases.run_phases(get_destroy_phases(config, destroy_sqs))
+
+
+def get_destroy_phases(config, destroy_sqs):
+    """
+    Return the phases of destroy_cluster. The application auto scaling, the task definitions
+    and the SQS queue go while the service drains; the auto scaling group only once the
+    service is gone since deleting the service scales the group down first. The resource
+    state is deleted once all of them finished.
+    """
     ecs_cluster = aws_client_ecs.EcsCluster(config)
-    # Delete service, task definition and then the cluster
-    ecs_cluster.stop_tasks()
-    ecs_cluster.deregister_container_instance()
-    ecs_cluster.delete_service()
-    ecs_cluster.deregister_task_definition()
-    ecs_cluster.delete_cluster()
-    # Delete Auto scaling group and launch configuration
-    auto_scale.delete_auto_scaling_and_launch_configuration(config)
+    as_client = aws_client_auto_scaling.AutoScalingClient(config)
+    app_as_client = aws_client_app_auto_scaling.AppAutoScalingClient(config)
+    result = [
+        phases.Phase('destroy: stop tasks', ecs_cluster.stop_tasks),
+        phases.Phase('destroy: deregister container instances', ecs_cluster.deregister_container_instance,
+                     ['destroy: stop tasks']),
+        phases.Phase('destroy: application auto scaling', app_as_client.destroy_ecs_autoscaling),
+        phases.Phase('destroy: service', ecs_cluster.delete_service,
+                     ['destroy: deregister container instances']),
+        phases.Phase('destroy: task definitions', ecs_cluster.deregister_task_definition),
+        phases.Phase('destroy: ecs cluster', ecs_cluster.delete_cluster, ['destroy: service']),
+        phases.Phase('destroy: auto scaling group', as_client.delete_auto_scaling_group,
+                     ['destroy: service']),
+        phases.Phase('destroy: launch configuration', as_client.delete_launch_configuration,
+                     ['destroy: auto scaling group']),
+    ]
     if destroy_sqs:
-        sqs.delete_sqs(config)
+        result.append(phases.Phase('destroy: sqs', lambda: sqs.delete_sqs(config)))
     else:
         logger.info('Not deleting SQS use --delete_sqs to force this')
+    result.append(phases.Phase('destroy: resource state', lambda: resource_state.delete(config),
+                               [p.name for p in result]))
+    return result
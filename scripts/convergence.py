@@ -0,0 +1,231 @@
+#!/bin/python
+
+"""
+Watches an ECS service converge. Every tick polls the service and its deployments, the
+target health of its target group and the instances of its auto scaling group at the
+same time, and hands a single Snapshot of all of them to the predicate of a wait.
+"""
+from concurrent import futures
+import threading
+import aws_client_auto_scaling
+import events
+import logger
+import waiter
+
+log = logger.getLogger()
+
+
+class Snapshot():
+    """
+    State of a service, its targets and its instances at one tick of a ConvergenceWatcher.
+    """
+
+    def __init__(self, service, targets, instances):
+        self.service = service
+        self.targets = targets
+        self.instances = instances
+        self.desired_count = service.get('desiredCount', 0) if service is not None else 0
+        self.running_count = service.get('runningCount', 0) if service is not None else 0
+        self.pending_count = service.get('pendingCount', 0) if service is not None else 0
+        self.deployments = service.get('deployments', []) if service is not None else []
+
+    def primary_deployment(self):
+        for d in self.deployments:
+            if d['status'] == 'PRIMARY':
+                return d
+        return None
+
+    def _target_states(self):
+        # An instance can be registered on several ports, the last description wins.
+        states = {}
+        for t in self.targets:
+            states[t['Target']['Id']] = t['TargetHealth']['State']
+        return states
+
+    def target_count(self):
+        return len(self._target_states())
+
+    def healthy_target_count(self, exclude=()):
+        """
+        Return the number of instances with a healthy target which are not in |exclude|.
+        """
+        return len([k for k, v in self._target_states().items() if v == 'healthy' and k not in exclude])
+
+    def live_instance_ids(self):
+        return [i['InstanceId'] for i in self.instances if i['LifecycleState'] in aws_client_auto_scaling.LIVE_INSTANCE_STATES]
+
+    def counts(self):
+        """
+        Return the counts of the snapshot as a dict, for the events stream.
+        """
+        primary = self.primary_deployment()
+        return {
+            'running': self.running_count,
+            'desired': self.desired_count,
+            'pending': self.pending_count,
+            'deployments': len(self.deployments),
+            'primary_running': primary['runningCount'] if primary is not None else 0,
+            'targets': self.target_count(),
+            'healthy_targets': self.healthy_target_count(),
+            'instances': len(self.live_instance_ids()),
+        }
+
+    def __str__(self):
+        primary = self.primary_deployment()
+        target_states = {}
+        for state in self._target_states().values():
+            target_states[state] = target_states.get(state, 0) + 1
+        instance_states = {}
+        for i in self.instances:
+            instance_states[i['LifecycleState']] = instance_states.get(i['LifecycleState'], 0) + 1
+        return 'tasks running:{0}/{1} pending:{2} | deployments:{3} primary:{4}/{5} | targets:{6} {7} | instances:{8} {9}'.format(
+            self.running_count, self.desired_count, self.pending_count,
+            len(self.deployments),
+            primary['runningCount'] if primary is not None else 0,
+            primary['desiredCount'] if primary is not None else 0,
+            self.target_count(), _format_counts(target_states),
+            len(self.live_instance_ids()), _format_counts(instance_states))
+
+
+def _format_counts(counts):
+    return ' '.join('{0}={1}'.format(k, counts[k]) for k in sorted(counts))
+
+
+class ConvergenceWatcher():
+    """
+    Polls an ECS service, the target group |tg_arn| and the auto scaling group
+    |as_group_name| concurrently. The target group and the group are optional.
+    The polls share one thread pool, close() shuts it down.
+    """
+
+    def __init__(self, ecs_client, cluster_name, service_name,
+                 elb_client=None, tg_arn=None, as_client=None, as_group_name=None):
+        self.ecs_client = ecs_client
+        self.cluster_name = cluster_name
+        self.service_name = service_name
+        self.elb_client = elb_client
+        self.tg_arn = tg_arn
+        self.as_client = as_client
+        self.as_group_name = as_group_name
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _describe_service(self):
+        response = self.ecs_client.describe_services(
+            cluster=self.cluster_name,
+            services=[self.service_name]
+        )
+        if len(response['services']) == 0:
+            return None
+        return response['services'][0]
+
+    def _describe_targets(self):
+        if self.elb_client is None or self.tg_arn is None:
+            return []
+        response = self.elb_client.describe_target_health(TargetGroupArn=self.tg_arn)
+        return response['TargetHealthDescriptions']
+
+    def _describe_instances(self):
+        if self.as_client is None or self.as_group_name is None:
+            return []
+        response = self.as_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.as_group_name])
+        instances = []
+        for group in response['AutoScalingGroups']:
+            instances.extend(group['Instances'])
+        return instances
+
+    def poll(self):
+        """
+        Return a Snapshot taken with one call to each API, made at the same time.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=3)
+            executor = self._executor
+        service = executor.submit(events.bind(self._describe_service))
+        targets = executor.submit(events.bind(self._describe_targets))
+        instances = executor.submit(events.bind(self._describe_instances))
+        return Snapshot(service.result(), targets.result(), instances.result())
+
+    def close(self):
+        """
+        Shut down the thread pool of the polls. A later poll starts a new one.
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def predicate(self, reached, description):
+        """
+        Return a waiter predicate which polls once and returns the snapshot if
+        reached(snapshot) is true. Every poll logs one line with the progress of the
+        service, its targets and its instances.
+        """
+        def predicate():
+            snapshot = self.poll()
+            done = reached(snapshot)
+            log.info('%s %s: %s', 'Reached' if done else 'Waiting for', description, snapshot)
+            if events.is_enabled():
+                events.emit('convergence', service=self.service_name, cluster=self.cluster_name,
+                            wait=description, reached=bool(done), **snapshot.counts())
+            return snapshot if done else None
+        return predicate
+
+    def wait(self, reached, description, timeout=waiter.DEFAULT_STEP_TIMEOUT, deadline=None):
+        """
+        Return a Wait until reached(snapshot) is true.
+        """
+        return Wait(self.predicate(reached, description), description, timeout, deadline)
+
+    def wait_until(self, reached, description, timeout=waiter.DEFAULT_STEP_TIMEOUT, deadline=None):
+        """
+        Poll until reached(snapshot) is true and return that snapshot.
+        """
+        return self.wait(reached, description, timeout, deadline).run()
+
+
+class Wait():
+    """
+    A wait yielded by a generator of steps like EcsCluster.rolling_upgrade_steps. Whoever
+    drives the steps runs it, either blocking or from an event loop.
+    """
+
+    def __init__(self, predicate, description, timeout, deadline):
+        self.predicate = predicate
+        self.description = description
+        self.timeout = timeout
+        self.deadline = deadline
+
+    def run(self):
+        return waiter.wait_until(self.predicate, self.description,
+                                 timeout=self.timeout, deadline=self.deadline)
+
+
+def throw(steps, error):
+    """
+    Raise |error| inside |steps| and return the next wait it yields, None if it finished.
+    Raises unless the generator handles the error.
+    """
+    try:
+        return steps.throw(error)
+    except StopIteration:
+        return None
+
+
+def run_steps(steps):
+    """
+    Drive |steps|, a generator yielding Waits, running every wait in this thread.
+    A failed wait is raised inside the generator so its spans and cleanup see it, the
+    generator may handle it and yield the next wait.
+    """
+    wait = next(steps, None)
+    while wait is not None:
+        try:
+            wait.run()
+        except Exception as e:
+            wait = throw(steps, e)
+            continue
+        wait = next(steps, None)
+
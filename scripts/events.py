@@ -0,0 +1,264 @@
+#!/bin/python
+
+"""
+Machine readable progress of a deploy as a stream of JSON lines. Once a stream is opened,
+the deploy phases, the mutating AWS calls, the snapshots of the convergence waits and the
+outcome of every action are written to it as they happen, one JSON object per line.
+emit() only puts the event on a bounded queue and a writer thread encodes and writes the
+events in batches, so a slow reader never holds up a deploy. Events which don't fit in
+the queue are dropped and their count is written when the stream is closed. Once a write
+fails, e.g. because the reader went away, the rest of the events are dropped.
+"""
+import contextlib
+import json
+import os
+import threading
+import clock
+import logger
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+MAX_QUEUED_EVENTS = 10000
+# Most events the writer thread writes at once, and the longest (real) time an event
+# waits in the queue before it is written.
+MAX_BATCH = 500
+FLUSH_INTERVAL = 0.2
+# Longest (real) time close() waits for the writer thread.
+CLOSE_TIMEOUT = 5
+
+# Prefixes of the AWS operations which don't change anything.
+READ_ONLY_PREFIXES = ('Describe', 'List', 'Get')
+
+_lock = threading.Lock()
+_queue = None
+_writer = None
+_dropped = 0
+# Fields added to every event emitted by a thread, see context(). Where there are context
+# variables every asyncio task has its own fields too, threads start without fields either way.
+if contextvars is not None:
+    _fields = contextvars.ContextVar('events_fields', default={})
+
+    def _get_fields():
+        return _fields.get()
+
+    def _set_fields(fields):
+        _fields.set(fields)
+else:
+    _local = threading.local()
+
+    def _get_fields():
+        return getattr(_local, 'fields', {})
+
+    def _set_fields(fields):
+        _local.fields = fields
+_STOP = object()
+
+log = logger.getLogger()
+
+
+class _Writer(threading.Thread):
+
+    def __init__(self, stream, events):
+        threading.Thread.__init__(self, name='events-writer')
+        self.daemon = True
+        self.stream = stream
+        self.events = events
+        self.failed = False
+
+    def write(self, batch):
+        if self.failed:
+            return
+        try:
+            self.stream.write(''.join(json.dumps(e, default=str) + '\n' for e in batch))
+            self.stream.flush()
+        except Exception as e:
+            # Keep draining the queue so emit() and close() never wait on a dead stream.
+            self.failed = True
+            log.warn('Could not write events, dropping the rest of them. Error: %s', e)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.events.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [e for e in batch if e is not _STOP]
+            self.write(batch)
+
+
+def _open_target(target):
+    if target.startswith('fd:'):
+        return os.fdopen(int(target[3:]), 'w')
+    return open(target, 'w')
+
+
+def open_stream(target):
+    """
+    Start writing events to the file |target|, or to the open file descriptor N if
+    |target| is fd:N.
+    """
+    global _queue, _writer, _dropped
+    stream = _open_target(target)
+    with _lock:
+        _queue = queue.Queue(maxsize=MAX_QUEUED_EVENTS)
+        _dropped = 0
+        _writer = _Writer(stream, _queue)
+        _writer.start()
+
+
+def is_enabled():
+    return _queue is not None
+
+
+def close():
+    """
+    Write the events still queued and close the stream.
+    """
+    global _queue, _writer
+    with _lock:
+        events, writer, dropped = _queue, _writer, _dropped
+        _queue = None
+        _writer = None
+    if events is None:
+        return
+    if dropped > 0:
+        _put(events, _make_event('events_dropped', {'count': dropped}))
+    try:
+        # The writer keeps draining the queue, so there is room soon.
+        events.put(_STOP, timeout=CLOSE_TIMEOUT)
+    except queue.Full:
+        log.warn('Timed out stopping the events writer')
+        return
+    writer.join(CLOSE_TIMEOUT)
+    if writer.is_alive():
+        log.warn('Timed out writing the remaining events')
+        return
+    try:
+        writer.stream.close()
+    except Exception as e:
+        log.warn('Could not close the events stream. Error: %s', e)
+
+
+def _make_event(event_type, fields):
+    event = {
+        'ts': clock.time(),
+        'event': event_type,
+    }
+    event.update(_get_fields())
+    event.update(fields)
+    return event
+
+
+def _put(events, event):
+    global _dropped
+    try:
+        events.put_nowait(event)
+    except queue.Full:
+        with _lock:
+            _dropped += 1
+
+
+def emit(event_type, **fields):
+    """
+    Queue an event of |event_type| with |fields|, it never blocks.
+    """
+    events = _queue
+    if events is None:
+        return
+    _put(events, _make_event(event_type, fields))
+
+
+def get_context():
+    return dict(_get_fields())
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """
+    Add |fields|, e.g. the service and the region of a deploy, to every event emitted by
+    this thread, or this asyncio task, in the with block.
+    """
+    previous = _get_fields()
+    merged = dict(previous)
+    merged.update(fields)
+    _set_fields(merged)
+    try:
+        yield
+    finally:
+        _set_fields(previous)
+
+
+def bind(fn):
+    """
+    Return a function which calls |fn| with the context of this thread, for work handed
+    to other threads like the phases of a deploy or the calls of bulk.run.
+    """
+    fields = get_context()
+    if not fields:
+        return fn
+
+    def call(*args, **kwargs):
+        with context(**fields):
+            return fn(*args, **kwargs)
+    return call
+
+
+@contextlib.contextmanager
+def action(name, config):
+    """
+    Emit the start and the outcome of the action |name|, like create, on |config|. Events
+    emitted by this thread in the with block carry the service and the region.
+    """
+    with context(service=config.get_ecs_service_name(), cluster=config.get_ecs_cluster_name(),
+                 region=config.get_region()):
+        emit('action_start', action=name)
+        start = clock.time()
+        try:
+            yield
+        except Exception as e:
+            emit('action_end', action=name, outcome='failed', error=str(e), seconds=clock.time() - start)
+            raise
+        emit('action_end', action=name, outcome='ok', seconds=clock.time() - start)
+
+
+def _before_call(model, context, **kwargs):
+    if _queue is not None and not model.name.startswith(READ_ONLY_PREFIXES):
+        context['events'] = model.service_model.service_name + '.' + model.name
+
+
+def _after_call(parsed, context, **kwargs):
+    api = context.get('events')
+    if api is not None:
+        emit('api_call', api=api, error=parsed.get('Error', {}).get('Code'))
+
+
+def _after_call_error(context, **kwargs):
+    api = context.get('events')
+    if api is not None:
+        emit('api_call', api=api, error=str(kwargs.get('exception')))
+
+
+def instrument(client):
+    """
+    Emit an event for every mutating call made through |client| while a stream is open.
+    """
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
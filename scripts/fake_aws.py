@@ -0,0 +1,1793 @@
+#!/bin/python
+
+"""
+In-process stand-in for the ECS, ELBv2, AutoScaling, Application Auto Scaling, EC2, SQS
+and CloudWatch calls made by the aws_client_* wrappers.
+
+The fake hands out real boto3 clients, so parameters are still validated against the
+service models and paginators, waiters and the api_metrics/tracing hooks keep working,
+but every call is answered from in-memory state instead of going over the network.
+Time is read from a VirtualClock which the waits in the scripts sleep on, so a whole
+create, upgrade and destroy run takes milliseconds.
+
+The simulated world converges the way AWS does, only on the virtual clock:
+  - auto scaling groups launch and terminate instances to match their desired capacity,
+    running instances register with the ECS cluster named in the user data of the launch
+    configuration or launch template version and with the target groups of the group,
+  - instance refreshes replace the instances of an old launch template version or launch
+    configuration in batches which keep MinHealthyPercentage of the group warmed up,
+  - ECS services start tasks of their latest deployment on free container instances
+    (at most one task of a service per instance), keep enough old tasks running to honor
+    minimumHealthyPercent and drain the target of a task before stopping it,
+  - targets turn healthy once a task of the service has been running on the instance
+    for HealthCheckIntervalSeconds * HealthyThresholdCount seconds.
+
+Per call latency, throttling and task start failures are injected from the settings of
+FakeAws. Throttled calls are retried inside the fake with botocore's backoff, their count
+is reported in ResponseMetadata.RetryAttempts like real retries.
+
+Usage:
+    fake = fake_aws.FakeAws(task_start_delay=30, throttle_rate=0.05)
+    fake_aws.install(fake)
+    try:
+        cluster.create_or_update_cluster(config)
+    finally:
+        fake_aws.uninstall()
+"""
+import base64
+import copy
+import math
+import random
+import re
+import threading
+import botocore
+from botocore.awsrequest import AWSResponse
+import aws_client
+import clock
+
+ACCOUNT_ID = '123456789012'
+# Seconds it takes things to happen in the simulated world
+DEFAULT_INSTANCE_START_DELAY = 60
+DEFAULT_INSTANCE_STOP_DELAY = 30
+DEFAULT_TASK_START_DELAY = 10
+# AWS defaults of new target groups
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_HEALTHY_THRESHOLD = 5
+DEFAULT_DEREGISTRATION_DELAY = 300
+# Stopped tasks and terminated instances stay visible for this long, like in AWS
+STOPPED_RETENTION = 3600
+DEFAULT_PAGE_SIZE = 100
+# Upper bound of the backoff between retries of a throttled call, same as botocore
+MAX_BACKOFF = 20
+
+THROTTLING_ERROR_CODES = {
+    'ecs': 'ThrottlingException',
+    'application-autoscaling': 'ThrottlingException',
+    'ec2': 'RequestLimitExceeded',
+}
+DEFAULT_THROTTLING_ERROR_CODE = 'Throttling'
+
+
+class FakeAwsError(Exception):
+    """
+    Raised by the fake operations, returned to the caller as an AWS error response.
+    """
+
+    def __init__(self, code, message, status=400):
+        Exception.__init__(self, '{0}: {1}'.format(code, message))
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def _paginate(items, params, result_key, token_key='nextToken', max_key='maxResults'):
+    start = int(params.get(token_key) or 0)
+    size = params.get(max_key) or DEFAULT_PAGE_SIZE
+    result = {result_key: items[start:start + size]}
+    if start + size < len(items):
+        result[token_key] = str(start + size)
+    return result
+
+
+def _attributes(values):
+    return [{'Key': k, 'Value': v} for k, v in sorted(values.items())]
+
+
+def _last_part(ref):
+    return ref.split('/')[-1]
+
+
+def _decode_user_data(user_data):
+    # botocore base64 encodes the user data before the call reaches the fake
+    try:
+        return base64.b64decode(user_data).decode('utf-8')
+    except (TypeError, ValueError):
+        return user_data
+
+
+class _Instance():
+    """
+    EC2 instance, optionally owned by an auto scaling group.
+    """
+
+    def __init__(self, instance_id, ready_at, image_id, instance_type, tags, user_data,
+                 group_name=None, launch_configuration_name=None, availability_zone=None,
+                 launch_template=None):
+        self.instance_id = instance_id
+        self.ready_at = ready_at
+        self.image_id = image_id
+        self.instance_type = instance_type
+        self.tags = tags
+        self.user_data = user_data or ''
+        self.group_name = group_name
+        self.launch_configuration_name = launch_configuration_name
+        self.launch_template = launch_template
+        self.availability_zone = availability_zone
+        self.state = 'pending'
+        self.terminate_at = None
+        self.terminated_at = None
+
+    def is_alive(self):
+        return self.state in ('pending', 'running')
+
+    def describe_ec2(self):
+        n = int(self.instance_id[2:], 16)
+        private_ip = '10.0.{0}.{1}'.format((n >> 8) & 255, n & 255)
+        return {
+            'InstanceId': self.instance_id,
+            'ImageId': self.image_id,
+            'InstanceType': self.instance_type,
+            'State': {'Name': self.state},
+            'Tags': copy.deepcopy(self.tags),
+            'Placement': {'AvailabilityZone': self.availability_zone or ''},
+            'PrivateIpAddress': private_ip,
+            'PrivateDnsName': 'ip-' + private_ip.replace('.', '-') + '.ec2.internal',
+            'PublicIpAddress': '',
+            'PublicDnsName': '',
+        }
+
+    def describe_asg(self):
+        lifecycle_state = 'Pending'
+        if self.state == 'running':
+            lifecycle_state = 'InService'
+        elif not self.is_alive():
+            lifecycle_state = 'Terminating'
+        result = {
+            'InstanceId': self.instance_id,
+            'LifecycleState': lifecycle_state,
+            'HealthStatus': 'Healthy',
+            'AvailabilityZone': self.availability_zone,
+            'ProtectedFromScaleIn': False,
+        }
+        if self.launch_template is not None:
+            result['LaunchTemplate'] = copy.deepcopy(self.launch_template)
+        else:
+            result['LaunchConfigurationName'] = self.launch_configuration_name
+        return result
+
+
+class _AutoScalingGroup():
+
+    def __init__(self, params):
+        self.name = params['AutoScalingGroupName']
+        self.min_size = params['MinSize']
+        self.max_size = params['MaxSize']
+        self.desired = params.get('DesiredCapacity', self.min_size)
+        self.cooldown = params.get('DefaultCooldown', 300)
+        self.availability_zones = list(params.get('AvailabilityZones', []))
+        self.vpc_zone_identifier = params.get('VPCZoneIdentifier', '')
+        self.launch_configuration_name = params.get('LaunchConfigurationName')
+        self.launch_template = copy.deepcopy(params.get('LaunchTemplate'))
+        self.termination_policies = list(params.get('TerminationPolicies', ['Default']))
+        self.target_group_arns = list(params.get('TargetGroupARNs', []))
+        self.tags = []
+        self.instance_ids = []
+        self.deleting = False
+        self.launched = 0
+        self.peak_instance_count = 0
+        self.instance_refreshes = []
+
+    def update(self, params):
+        self.min_size = params.get('MinSize', self.min_size)
+        self.max_size = params.get('MaxSize', self.max_size)
+        self.desired = params.get('DesiredCapacity', self.desired)
+        self.cooldown = params.get('DefaultCooldown', self.cooldown)
+        self.availability_zones = list(params.get('AvailabilityZones', self.availability_zones))
+        self.vpc_zone_identifier = params.get('VPCZoneIdentifier', self.vpc_zone_identifier)
+        # A group uses either a launch configuration or a launch template
+        if 'LaunchConfigurationName' in params:
+            self.launch_configuration_name = params['LaunchConfigurationName']
+            self.launch_template = None
+        if 'LaunchTemplate' in params:
+            self.launch_template = copy.deepcopy(params['LaunchTemplate'])
+            self.launch_configuration_name = None
+        self.termination_policies = list(params.get('TerminationPolicies', self.termination_policies))
+        # Keep the desired capacity within the new bounds, like AWS
+        self.desired = min(max(self.desired, self.min_size), self.max_size)
+
+    def validate(self):
+        if not self.min_size <= self.desired <= self.max_size:
+            raise FakeAwsError('ValidationError', 'Desired capacity:{0} must be between the specified min size:{1} and max size:{2}'.format(
+                self.desired, self.min_size, self.max_size))
+
+
+class _InstanceRefresh():
+    """
+    Instance refresh of an auto scaling group.
+    """
+
+    def __init__(self, refresh_id, group_name, preferences, instance_count, now):
+        self.refresh_id = refresh_id
+        self.group_name = group_name
+        self.min_healthy_percentage = preferences.get('MinHealthyPercentage', 90)
+        self.instance_warmup = preferences.get('InstanceWarmup', 0)
+        self.preferences = copy.deepcopy(preferences)
+        self.instance_count = instance_count
+        self.instances_to_update = instance_count
+        self.status = 'InProgress'
+        self.start_time = now
+        self.end_time = None
+
+    def describe(self):
+        result = {
+            'InstanceRefreshId': self.refresh_id,
+            'AutoScalingGroupName': self.group_name,
+            'Status': self.status,
+            'StartTime': self.start_time,
+            'PercentageComplete': 100 if self.instance_count == 0 else int(
+                100 * (self.instance_count - self.instances_to_update) / self.instance_count),
+            'InstancesToUpdate': self.instances_to_update,
+            'Preferences': copy.deepcopy(self.preferences),
+        }
+        if self.end_time is not None:
+            result['EndTime'] = self.end_time
+        return result
+
+
+class _Task():
+
+    def __init__(self, arn, cluster_name, service_name, task_definition_arn, deployment_id,
+                 container_instance_arn, instance_id, host_port, created_at, running_at):
+        self.arn = arn
+        self.cluster_name = cluster_name
+        self.service_name = service_name
+        self.task_definition_arn = task_definition_arn
+        self.deployment_id = deployment_id
+        self.container_instance_arn = container_instance_arn
+        self.instance_id = instance_id
+        self.host_port = host_port
+        self.created_at = created_at
+        self.running_at = running_at
+        self.last_status = 'PENDING'
+        self.desired_status = 'RUNNING'
+        self.stop_at = None
+        self.stopped_at = None
+        self.stopped_reason = None
+
+
+class _Service():
+
+    def __init__(self, arn, name, cluster_name, desired_count, role, load_balancers, deployment_configuration):
+        self.arn = arn
+        self.name = name
+        self.cluster_name = cluster_name
+        self.desired_count = desired_count
+        self.role = role
+        self.load_balancers = load_balancers
+        self.deployment_configuration = {
+            'maximumPercent': 200,
+            'minimumHealthyPercent': 100,
+        }
+        self.deployment_configuration.update(deployment_configuration or {})
+        self.status = 'ACTIVE'
+        self.task_definition = None
+        self.peak_task_count = 0
+        # (id, task definition ARN), the last one is the PRIMARY deployment
+        self.deployments = []
+
+    def target_group_arn(self):
+        for lb in self.load_balancers:
+            if 'targetGroupArn' in lb:
+                return lb['targetGroupArn']
+        return None
+
+
+class _Target():
+
+    def __init__(self, target_id, port, registered_at):
+        self.target_id = target_id
+        self.port = port
+        self.registered_at = registered_at
+        self.drain_until = None
+        # Seconds it takes to turn healthy, None follows the target group health check
+        self.health_delay = None
+
+
+class _Region():
+    """
+    State of all the services in one region.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.clusters = {}
+        self.services = {}
+        self.task_definitions = {}
+        self.tasks = {}
+        self.container_instances = {}
+        self.load_balancers = {}
+        self.lb_attributes = {}
+        self.listeners = {}
+        self.target_groups = {}
+        self.tg_attributes = {}
+        self.targets = {}
+        self.launch_configurations = {}
+        self.launch_templates = {}
+        self.as_groups = {}
+        self.as_policies = {}
+        self.instances = {}
+        self.scalable_targets = {}
+        self.app_policies = {}
+        self.queues = {}
+        self.alarms = {}
+
+    def arn(self, service, resource):
+        return 'arn:aws:{0}:{1}:{2}:{3}'.format(service, self.name, ACCOUNT_ID, resource)
+
+
+class FakeAws():
+    """
+    Stateful fake of the AWS APIs used by the scripts. See the module docstring.
+
+    |latency| seconds pass on the clock for every call and |throttle_rate| is the chance
+    of a call attempt being throttled; both can be overridden per 'service.operation'
+    through |operation_latency| and |operation_throttle_rate|. |task_failure_rate| is the
+    chance of a task failing to start. |health_check_delay| overrides the time a target
+    takes to turn healthy, by default it follows the health check of the target group.
+    The delays are either seconds or functions returning seconds from a random.Random,
+    which are sampled for every instance, task and target.
+    """
+
+    def __init__(self,
+                 virtual_clock=None,
+                 latency=0.0,
+                 throttle_rate=0.0,
+                 task_failure_rate=0.0,
+                 instance_start_delay=DEFAULT_INSTANCE_START_DELAY,
+                 instance_stop_delay=DEFAULT_INSTANCE_STOP_DELAY,
+                 task_start_delay=DEFAULT_TASK_START_DELAY,
+                 health_check_delay=None,
+                 operation_latency=None,
+                 operation_throttle_rate=None,
+                 seed=0):
+        if virtual_clock is None:
+            virtual_clock = clock.VirtualClock()
+        self.clock = virtual_clock
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.task_failure_rate = task_failure_rate
+        self.instance_start_delay = instance_start_delay
+        self.instance_stop_delay = instance_stop_delay
+        self.task_start_delay = task_start_delay
+        self.health_check_delay = health_check_delay
+        self.operation_latency = operation_latency or {}
+        self.operation_throttle_rate = operation_throttle_rate or {}
+        self.random = random.Random(seed)
+        # Number of calls and throttled attempts per 'service.operation'
+        self.calls = {}
+        self.throttles = {}
+        self._lock = threading.RLock()
+        self._regions = {}
+        self._next_id = 0
+
+    def reset_stats(self):
+        """
+        Forget the call counts and the peak task and instance counts seen so far.
+        """
+        with self._lock:
+            self.calls = {}
+            self.throttles = {}
+            for region in self._regions.values():
+                for service in region.services.values():
+                    service.peak_task_count = 0
+                for group in region.as_groups.values():
+                    group.peak_instance_count = 0
+
+    # Plumbing
+
+    def create_client(self, session, service, client_config):
+        """
+        Client factory for aws_client.set_client_factory.
+        """
+        client = session.client(service, config=client_config,
+                                aws_access_key_id='fake', aws_secret_access_key='fake')
+        client.meta.events.register('before-parameter-build', self._save_params)
+        # Answer after every other before-call handler had its look at the call.
+        client.meta.events.register_last('before-call', self._handle_call)
+        return client
+
+    def get_region(self, name):
+        with self._lock:
+            region = self._regions.get(name)
+            if region is None:
+                region = _Region(name)
+                self._regions[name] = region
+            return region
+
+    def run_for(self, seconds, region_name, step=10):
+        """
+        Advance the clock by |seconds| and let |region_name| converge on the way, every
+        |step| seconds, like it would if the scripts were polling it.
+        """
+        region = self.get_region(region_name)
+        end = self.clock.time() + seconds
+        while self.clock.time() < end:
+            self.clock.advance(min(step, end - self.clock.time()))
+            with self._lock:
+                self._tick(region, self.clock.time())
+
+    def _save_params(self, params, context, **kwargs):
+        context['fake_aws_params'] = copy.deepcopy(params)
+
+    def _new_id(self, width=17):
+        self._next_id += 1
+        return '{0:0{1}x}'.format(self._next_id, width)
+
+    def _delay(self, value):
+        if callable(value):
+            return max(value(self.random), 0)
+        return value
+
+    def _chance(self, p):
+        with self._lock:
+            return p > 0 and self.random.random() < p
+
+    def _response(self, status, parsed, retries):
+        parsed['ResponseMetadata'] = {
+            'RequestId': self._new_id(32),
+            'HTTPStatusCode': status,
+            'HTTPHeaders': {},
+            'RetryAttempts': retries,
+        }
+        return AWSResponse('https://fake-aws.local/', status, {}, None), parsed
+
+    def _error_response(self, error, retries):
+        return self._response(error.status, {'Error': {'Code': error.code, 'Message': error.message}}, retries)
+
+    def _handle_call(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        operation = botocore.xform_name(model.name)
+        key = service + '.' + operation
+        handler = getattr(self, '_{0}_{1}'.format(service.replace('-', '_'), operation), None)
+        if handler is None:
+            raise NotImplementedError('fake_aws does not implement ' + key)
+        retries = 0
+        while True:
+            self.clock.sleep(self.operation_latency.get(key, self.latency))
+            if not self._chance(self.operation_throttle_rate.get(key, self.throttle_rate)):
+                break
+            with self._lock:
+                self.throttles[key] = self.throttles.get(key, 0) + 1
+            if retries >= aws_client.MAX_RETRIES:
+                code = THROTTLING_ERROR_CODES.get(service, DEFAULT_THROTTLING_ERROR_CODE)
+                with self._lock:
+                    return self._error_response(FakeAwsError(code, 'Rate exceeded'), retries)
+            retries += 1
+            with self._lock:
+                backoff = self.random.random() * min(MAX_BACKOFF, 2 ** retries)
+            self.clock.sleep(backoff)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            region = self.get_region(context.get('client_region'))
+            now = self.clock.time()
+            self._tick(region, now)
+            try:
+                result = handler(region, context.get('fake_aws_params', {}), now)
+            except FakeAwsError as e:
+                return self._error_response(e, retries)
+            return self._response(200, copy.deepcopy(result or {}), retries)
+
+    # Simulation
+
+    def _tick(self, region, now):
+        """
+        Move |region| forward to |now|.
+        """
+        self._tick_instances(region, now)
+        self._tick_tasks(region, now)
+        self._tick_services(region, now)
+        self._tick_targets(region, now)
+        self._tick_instance_refreshes(region, now)
+
+    def _tick_instances(self, region, now):
+        for group in list(region.as_groups.values()):
+            alive = [region.instances[i] for i in group.instance_ids if region.instances[i].is_alive()]
+            desired = 0 if group.deleting else group.desired
+            for _ in range(desired - len(alive)):
+                self._launch_instance(region, group, now)
+            if len(alive) > desired:
+                for instance in self._pick_instances_to_terminate(region, group, alive, len(alive) - desired):
+                    self._terminate_instance(region, instance, now)
+        for instance in list(region.instances.values()):
+            if instance.state == 'pending' and instance.ready_at <= now:
+                instance.state = 'running'
+                self._instance_ready(region, instance, now)
+            elif instance.state == 'shutting-down' and instance.terminate_at <= now:
+                instance.state = 'terminated'
+                instance.terminated_at = now
+                group = region.as_groups.get(instance.group_name)
+                if group is not None:
+                    group.instance_ids.remove(instance.instance_id)
+            elif instance.state == 'terminated' and instance.terminated_at + STOPPED_RETENTION <= now:
+                del region.instances[instance.instance_id]
+        for group in list(region.as_groups.values()):
+            alive = len([i for i in group.instance_ids if region.instances[i].is_alive()])
+            group.peak_instance_count = max(group.peak_instance_count, alive)
+            if group.deleting and len(group.instance_ids) == 0:
+                del region.as_groups[group.name]
+                for key in [k for k in region.as_policies if k[0] == group.name]:
+                    del region.as_policies[key]
+
+    def _group_launch_template(self, region, group):
+        """
+        Return the launch template spec of the version new instances of |group| get, or None.
+        """
+        if group.launch_template is None:
+            return None
+        template, version = self._resolve_launch_template(region, group.launch_template, required=False)
+        if template is None:
+            return None
+        return {
+            'LaunchTemplateId': template['LaunchTemplateId'],
+            'LaunchTemplateName': template['LaunchTemplateName'],
+            'Version': str(version['VersionNumber']),
+        }
+
+    def _is_current(self, region, group, instance):
+        """
+        Return true if |instance| was launched from what |group| launches new instances from.
+        """
+        if group.launch_template is not None:
+            return instance.launch_template == self._group_launch_template(region, group)
+        return instance.launch_template is None and \
+            instance.launch_configuration_name == group.launch_configuration_name
+
+    def _launch_instance(self, region, group, now):
+        launch_template = self._group_launch_template(region, group)
+        if launch_template is not None:
+            _, version = self._resolve_launch_template(region, launch_template)
+            data = version['LaunchTemplateData']
+        else:
+            data = region.launch_configurations.get(group.launch_configuration_name, {})
+        zones = group.availability_zones or [region.name + 'a']
+        tags = [{'Key': t['Key'], 'Value': t['Value']} for t in group.tags if t.get('PropagateAtLaunch')]
+        tags.append({'Key': 'aws:autoscaling:groupName', 'Value': group.name})
+        instance = _Instance('i-' + self._new_id(), now + self._delay(self.instance_start_delay),
+                             data.get('ImageId'), data.get('InstanceType'), tags, data.get('UserData'),
+                             group_name=group.name,
+                             launch_configuration_name=group.launch_configuration_name,
+                             availability_zone=zones[group.launched % len(zones)],
+                             launch_template=launch_template)
+        group.launched += 1
+        region.instances[instance.instance_id] = instance
+        group.instance_ids.append(instance.instance_id)
+
+    def _pick_instances_to_terminate(self, region, group, alive, count):
+        newest_first = list(reversed(alive))
+        policy = group.termination_policies[0] if len(group.termination_policies) > 0 else 'Default'
+        if policy == 'NewestInstance':
+            return newest_first[:count]
+        if policy == 'OldestInstance':
+            return alive[:count]
+        # Default: instances of an old launch configuration or template first, then the ones still pending
+        def order(instance):
+            return (self._is_current(region, group, instance), instance.state == 'running')
+        return sorted(newest_first, key=order)[:count]
+
+    def _tick_instance_refreshes(self, region, now):
+        for group in region.as_groups.values():
+            for refresh in group.instance_refreshes:
+                if refresh.status != 'InProgress':
+                    continue
+                alive = [region.instances[i] for i in group.instance_ids if region.instances[i].is_alive()]
+                old = [i for i in alive if not self._is_current(region, group, i)]
+                refresh.instances_to_update = len(old)
+                warm = [i for i in alive if i.state == 'running' and i.ready_at + refresh.instance_warmup <= now]
+                if len(old) == 0:
+                    # Done once the replacements are warmed up
+                    if len(warm) == len(alive):
+                        refresh.status = 'Successful'
+                        refresh.end_time = now
+                    continue
+                # Replace as many instances as the warmed up ones above MinHealthyPercentage allow,
+                # one at a time once all are warmed up if the percentage allows none.
+                min_healthy = int(math.ceil(group.desired * refresh.min_healthy_percentage / 100.0))
+                batch = len(warm) - min_healthy
+                if batch <= 0 and len(warm) == len(alive) == group.desired:
+                    batch = 1
+                for instance in [i for i in old if i in warm][:max(batch, 0)]:
+                    self._terminate_instance(region, instance, now)
+
+    def _instance_ready(self, region, instance, now):
+        user_data = instance.user_data
+        if 'ECS_CLUSTER=' not in user_data:
+            user_data = _decode_user_data(user_data)
+        match = re.search(r'ECS_CLUSTER=(\S+)', user_data)
+        if match is not None:
+            cluster = region.clusters.get(match.group(1))
+            if cluster is not None and cluster['status'] == 'ACTIVE':
+                arn = region.arn('ecs', 'container-instance/{0}/{1}'.format(
+                    cluster['clusterName'], self._new_id(32)))
+                region.container_instances[arn] = {
+                    'containerInstanceArn': arn,
+                    'ec2InstanceId': instance.instance_id,
+                    'clusterName': cluster['clusterName'],
+                    'status': 'ACTIVE',
+                    'agentConnected': True,
+                }
+        group = region.as_groups.get(instance.group_name)
+        if group is not None:
+            for tg_arn in group.target_group_arns:
+                tg = self._find_target_group_by_arn(region, tg_arn, required=False)
+                if tg is not None:
+                    self._register_target(region, tg_arn, instance.instance_id, tg['Port'], now)
+
+    def _terminate_instance(self, region, instance, now):
+        instance.state = 'shutting-down'
+        instance.terminate_at = now + self._delay(self.instance_stop_delay)
+        for arn, ci in list(region.container_instances.items()):
+            if ci['ec2InstanceId'] == instance.instance_id:
+                del region.container_instances[arn]
+        for task in region.tasks.values():
+            if task.instance_id == instance.instance_id and task.last_status != 'STOPPED':
+                self._stop_task_now(region, task, now,
+                                    'Host EC2 (instance {0}) terminated.'.format(instance.instance_id))
+        for tg_arn, targets in region.targets.items():
+            for target in targets.values():
+                if target.target_id == instance.instance_id:
+                    self._deregister_target(region, tg_arn, target, now)
+
+    def _tick_tasks(self, region, now):
+        for task in list(region.tasks.values()):
+            if task.last_status == 'PENDING' and task.desired_status == 'RUNNING' and task.running_at <= now:
+                if self._chance(self.task_failure_rate):
+                    self._stop_task_now(region, task, now, 'Essential container in task exited')
+                    continue
+                task.last_status = 'RUNNING'
+                service = region.services.get((task.cluster_name, task.service_name))
+                if service is not None and service.target_group_arn() is not None:
+                    self._register_target(region, service.target_group_arn(),
+                                          task.instance_id, task.host_port, now)
+            elif task.last_status != 'STOPPED' and task.desired_status == 'STOPPED' and task.stop_at <= now:
+                task.last_status = 'STOPPED'
+                task.stopped_at = now
+            elif task.last_status == 'STOPPED' and task.stopped_at + STOPPED_RETENTION <= now:
+                del region.tasks[task.arn]
+
+    def _stop_task_now(self, region, task, now, reason):
+        self._drain_task(region, task, now, reason)
+        task.last_status = 'STOPPED'
+        task.stopped_at = now
+
+    def _drain_task(self, region, task, now, reason):
+        """
+        Deregister the target of |task| and stop the task once the target has drained.
+        """
+        task.desired_status = 'STOPPED'
+        task.stopped_reason = reason
+        task.stop_at = now
+        service = region.services.get((task.cluster_name, task.service_name))
+        if service is None or service.target_group_arn() is None or task.last_status != 'RUNNING':
+            return
+        target = region.targets.get(service.target_group_arn(), {}).get((task.instance_id, task.host_port))
+        if target is not None:
+            task.stop_at = self._deregister_target(region, service.target_group_arn(), target, now)
+
+    def _service_tasks(self, region, service):
+        return [t for t in region.tasks.values()
+                if t.cluster_name == service.cluster_name and t.service_name == service.name]
+
+    def _tick_services(self, region, now):
+        for service in region.services.values():
+            if service.status == 'ACTIVE':
+                self._reconcile_service(region, service, now)
+                service.peak_task_count = max(service.peak_task_count, len(
+                    [t for t in self._service_tasks(region, service) if t.last_status != 'STOPPED']))
+            elif service.status == 'DRAINING':
+                tasks = self._service_tasks(region, service)
+                for task in tasks:
+                    if task.desired_status == 'RUNNING':
+                        self._drain_task(region, task, now, 'Service deleted')
+                if all(t.last_status == 'STOPPED' for t in tasks):
+                    service.status = 'INACTIVE'
+
+    def _reconcile_service(self, region, service, now):
+        primary_id = service.deployments[-1][0]
+        tasks = self._service_tasks(region, service)
+        # Old deployments disappear once all their tasks are gone
+        service.deployments = [d for d in service.deployments
+                               if d[0] == primary_id or any(t.deployment_id == d[0] and t.last_status != 'STOPPED' for t in tasks)]
+        desired = service.desired_count
+        active = [t for t in tasks if t.desired_status == 'RUNNING']
+        new = [t for t in active if t.deployment_id == primary_id]
+        old = [t for t in active if t.deployment_id != primary_id]
+        # Too many tasks of the latest deployment, stop the ones not running yet first
+        new.sort(key=lambda t: (t.last_status != 'RUNNING', t.created_at), reverse=True)
+        while len(new) > desired:
+            self._drain_task(region, new.pop(0), now, 'Scaling activity initiated by deployment')
+        # Keep enough old tasks running to stay above minimumHealthyPercent
+        running_new = len([t for t in new if t.last_status == 'RUNNING'])
+        min_healthy = int(math.ceil(desired * service.deployment_configuration['minimumHealthyPercent'] / 100.0))
+        old.sort(key=lambda t: (t.last_status != 'RUNNING', t.created_at), reverse=True)
+        while len(old) > max(min_healthy - running_new, 0):
+            self._drain_task(region, old.pop(0), now, 'Deployment replaced the task')
+        # Start the missing tasks of the latest deployment without going over maximumPercent
+        max_tasks = int(desired * service.deployment_configuration['maximumPercent'] / 100)
+        to_start = min(desired - len(new), max_tasks - len(new) - len(old))
+        if to_start <= 0:
+            return
+        busy = set(t.instance_id for t in self._service_tasks(region, service) if t.last_status != 'STOPPED')
+        for ci in sorted(region.container_instances.values(), key=lambda c: c['containerInstanceArn']):
+            if to_start == 0:
+                break
+            if ci['clusterName'] != service.cluster_name or ci['status'] != 'ACTIVE' or ci['ec2InstanceId'] in busy:
+                continue
+            self._start_task(region, service, ci, now)
+            to_start -= 1
+
+    def _start_task(self, region, service, container_instance, now):
+        task_definition = self._find_task_definition(region, service.deployments[-1][1])
+        host_port = 0
+        port_mappings = task_definition['containerDefinitions'][0].get('portMappings', [])
+        if len(port_mappings) > 0:
+            host_port = port_mappings[0].get('hostPort') or port_mappings[0].get('containerPort', 0)
+            if port_mappings[0].get('hostPort') == 0:
+                # Dynamic host port
+                host_port = 32768 + self._next_id % 28000
+        arn = region.arn('ecs', 'task/{0}/{1}'.format(service.cluster_name, self._new_id(32)))
+        task = _Task(arn, service.cluster_name, service.name, task_definition['taskDefinitionArn'],
+                     service.deployments[-1][0], container_instance['containerInstanceArn'],
+                     container_instance['ec2InstanceId'], host_port, now, now + self._delay(self.task_start_delay))
+        region.tasks[arn] = task
+        return task
+
+    def _tick_targets(self, region, now):
+        for targets in region.targets.values():
+            for key, target in list(targets.items()):
+                if target.drain_until is not None and target.drain_until <= now:
+                    del targets[key]
+
+    def _register_target(self, region, tg_arn, target_id, port, now):
+        if tg_arn in region.targets:
+            target = _Target(target_id, port, now)
+            if self.health_check_delay is not None:
+                target.health_delay = self._delay(self.health_check_delay)
+            region.targets[tg_arn][(target_id, port)] = target
+
+    def _deregister_target(self, region, tg_arn, target, now):
+        if target.drain_until is None:
+            delay = region.tg_attributes.get(tg_arn, {}).get(
+                'deregistration_delay.timeout_seconds', str(DEFAULT_DEREGISTRATION_DELAY))
+            target.drain_until = now + int(delay)
+        return target.drain_until
+
+    def _serving_since(self, region, tg_arn):
+        """
+        Return the start of the oldest running task of the services of |tg_arn| per instance.
+        """
+        serving_since = {}
+        for service in region.services.values():
+            if service.target_group_arn() != tg_arn:
+                continue
+            for task in self._service_tasks(region, service):
+                if task.last_status == 'RUNNING' and task.desired_status == 'RUNNING':
+                    serving_since[task.instance_id] = min(
+                        task.running_at, serving_since.get(task.instance_id, task.running_at))
+        return serving_since
+
+    def _target_health(self, tg, target, serving_since, now):
+        if target.drain_until is not None:
+            return {'State': 'draining', 'Reason': 'Target.DeregistrationInProgress'}
+        delay = target.health_delay
+        if delay is None:
+            delay = tg['HealthCheckIntervalSeconds'] * tg['HealthyThresholdCount']
+        serving_since = serving_since.get(target.target_id)
+        if serving_since is not None and now >= max(target.registered_at, serving_since) + delay:
+            return {'State': 'healthy'}
+        if now < target.registered_at + delay:
+            return {'State': 'initial', 'Reason': 'Elb.RegistrationInProgress'}
+        return {'State': 'unhealthy', 'Reason': 'Target.FailedHealthChecks'}
+
+    # ECS
+
+    def _find_cluster(self, region, ref):
+        cluster = region.clusters.get(_last_part(ref or 'default'))
+        if cluster is None or cluster['status'] != 'ACTIVE':
+            raise FakeAwsError('ClusterNotFoundException', 'Cluster not found.')
+        return cluster
+
+    def _describe_cluster(self, region, cluster):
+        name = cluster['clusterName']
+        tasks = [t for t in region.tasks.values() if t.cluster_name == name]
+        result = dict(cluster)
+        result.update({
+            'registeredContainerInstancesCount': len(
+                [c for c in region.container_instances.values() if c['clusterName'] == name]),
+            'runningTasksCount': len([t for t in tasks if t.last_status == 'RUNNING']),
+            'pendingTasksCount': len([t for t in tasks if t.last_status == 'PENDING']),
+            'activeServicesCount': len([s for s in region.services.values()
+                                        if s.cluster_name == name and s.status == 'ACTIVE']),
+        })
+        return result
+
+    def _ecs_create_cluster(self, region, params, now):
+        name = params.get('clusterName', 'default')
+        cluster = region.clusters.get(name)
+        if cluster is None or cluster['status'] != 'ACTIVE':
+            cluster = {
+                'clusterArn': region.arn('ecs', 'cluster/' + name),
+                'clusterName': name,
+                'status': 'ACTIVE',
+            }
+            region.clusters[name] = cluster
+        return {'cluster': self._describe_cluster(region, cluster)}
+
+    def _ecs_describe_clusters(self, region, params, now):
+        clusters = []
+        failures = []
+        for ref in params.get('clusters', ['default']):
+            cluster = region.clusters.get(_last_part(ref))
+            if cluster is None:
+                failures.append({'arn': region.arn('ecs', 'cluster/' + _last_part(ref)), 'reason': 'MISSING'})
+            else:
+                clusters.append(self._describe_cluster(region, cluster))
+        return {'clusters': clusters, 'failures': failures}
+
+    def _ecs_delete_cluster(self, region, params, now):
+        cluster = self._find_cluster(region, params['cluster'])
+        name = cluster['clusterName']
+        if any(s.cluster_name == name and s.status != 'INACTIVE' for s in region.services.values()):
+            raise FakeAwsError('ClusterContainsServicesException',
+                               'The Cluster cannot be deleted while Services are active.')
+        if any(t.cluster_name == name and t.last_status != 'STOPPED' for t in region.tasks.values()):
+            raise FakeAwsError('ClusterContainsTasksException',
+                               'The Cluster cannot be deleted while Tasks are active.')
+        if any(c['clusterName'] == name for c in region.container_instances.values()):
+            raise FakeAwsError('ClusterContainsContainerInstancesException',
+                               'The Cluster cannot be deleted while Container Instances are active or draining.')
+        cluster['status'] = 'INACTIVE'
+        return {'cluster': self._describe_cluster(region, cluster)}
+
+    def _find_task_definition(self, region, ref):
+        if ref.startswith('arn:'):
+            ref = ref.split('/', 1)[1]
+        family, _, revision = ref.partition(':')
+        revisions = region.task_definitions.get(family, [])
+        if revision:
+            if 0 < int(revision) <= len(revisions):
+                return revisions[int(revision) - 1]
+        else:
+            active = [t for t in revisions if t['status'] == 'ACTIVE']
+            if len(active) > 0:
+                return active[-1]
+        raise FakeAwsError('ClientException', 'Unable to describe task definition.')
+
+    def _ecs_register_task_definition(self, region, params, now):
+        family = params['family']
+        revisions = region.task_definitions.setdefault(family, [])
+        task_definition = copy.deepcopy(params)
+        task_definition.setdefault('networkMode', 'bridge')
+        # AWS fills in the defaults of the container definitions
+        for c in task_definition['containerDefinitions']:
+            c.setdefault('cpu', 0)
+            c.setdefault('essential', True)
+            c.setdefault('environment', [])
+            c.setdefault('mountPoints', [])
+            c.setdefault('volumesFrom', [])
+            for mapping in c.get('portMappings', []):
+                mapping.setdefault('protocol', 'tcp')
+        task_definition.update({
+            'taskDefinitionArn': region.arn('ecs', 'task-definition/{0}:{1}'.format(family, len(revisions) + 1)),
+            'revision': len(revisions) + 1,
+            'status': 'ACTIVE',
+        })
+        revisions.append(task_definition)
+        return {'taskDefinition': task_definition}
+
+    def _ecs_describe_task_definition(self, region, params, now):
+        return {'taskDefinition': self._find_task_definition(region, params['taskDefinition'])}
+
+    def _ecs_deregister_task_definition(self, region, params, now):
+        task_definition = self._find_task_definition(region, params['taskDefinition'])
+        task_definition['status'] = 'INACTIVE'
+        return {'taskDefinition': task_definition}
+
+    def _ecs_list_task_definitions(self, region, params, now):
+        status = params.get('status', 'ACTIVE')
+        revisions = []
+        for family in sorted(region.task_definitions):
+            if 'familyPrefix' in params and family != params['familyPrefix']:
+                continue
+            revisions.extend(t for t in region.task_definitions[family] if t['status'] == status)
+        arns = [t['taskDefinitionArn'] for t in revisions]
+        if params.get('sort', 'ASC') == 'DESC':
+            arns.reverse()
+        return _paginate(arns, params, 'taskDefinitionArns')
+
+    def _find_service(self, region, cluster_ref, service_ref):
+        cluster = self._find_cluster(region, cluster_ref)
+        service = region.services.get((cluster['clusterName'], _last_part(service_ref)))
+        if service is None:
+            raise FakeAwsError('ServiceNotFoundException', 'Service not found.')
+        if service.status != 'ACTIVE':
+            raise FakeAwsError('ServiceNotActiveException', 'Service was not ACTIVE.')
+        return service
+
+    def _new_deployment(self, service, task_definition_arn):
+        service.task_definition = task_definition_arn
+        service.deployments.append(('ecs-svc/' + self._new_id(19), task_definition_arn))
+
+    def _describe_service(self, region, service):
+        tasks = self._service_tasks(region, service)
+        deployments = []
+        for i, (deployment_id, task_definition_arn) in enumerate(reversed(service.deployments)):
+            deployment_tasks = [t for t in tasks if t.deployment_id == deployment_id]
+            running = len([t for t in deployment_tasks if t.last_status == 'RUNNING'])
+            deployments.append({
+                'id': deployment_id,
+                'status': 'PRIMARY' if i == 0 else 'ACTIVE',
+                'taskDefinition': task_definition_arn,
+                'desiredCount': service.desired_count if i == 0 else 0,
+                'runningCount': running,
+                'pendingCount': len([t for t in deployment_tasks if t.last_status == 'PENDING']),
+            })
+        primary = deployments[0]
+        primary['rolloutState'] = 'IN_PROGRESS'
+        if len(deployments) == 1 and primary['runningCount'] == service.desired_count:
+            primary['rolloutState'] = 'COMPLETED'
+        return {
+            'serviceArn': service.arn,
+            'serviceName': service.name,
+            'clusterArn': region.arn('ecs', 'cluster/' + service.cluster_name),
+            'loadBalancers': service.load_balancers,
+            'status': service.status,
+            'desiredCount': service.desired_count,
+            'runningCount': len([t for t in tasks if t.last_status == 'RUNNING']),
+            'pendingCount': len([t for t in tasks if t.last_status == 'PENDING']),
+            'launchType': 'EC2',
+            'taskDefinition': service.task_definition,
+            'deploymentConfiguration': service.deployment_configuration,
+            'deployments': deployments,
+            'roleArn': service.role,
+            'events': [],
+        }
+
+    def _ecs_create_service(self, region, params, now):
+        cluster = self._find_cluster(region, params.get('cluster'))
+        name = params['serviceName']
+        existing = region.services.get((cluster['clusterName'], name))
+        if existing is not None and existing.status != 'INACTIVE':
+            raise FakeAwsError('InvalidParameterException', 'Creation of service was not idempotent.')
+        task_definition = self._find_task_definition(region, params['taskDefinition'])
+        for lb in params.get('loadBalancers', []):
+            if 'targetGroupArn' in lb and len(self._find_target_group_by_arn(region, lb['targetGroupArn'])['LoadBalancerArns']) == 0:
+                raise FakeAwsError('InvalidParameterException', 'The target group with targetGroupArn {0} does not have an associated load balancer.'.format(
+                    lb['targetGroupArn']))
+        service = _Service(region.arn('ecs', 'service/{0}/{1}'.format(cluster['clusterName'], name)),
+                           name, cluster['clusterName'], params.get('desiredCount', 0), params.get('role'),
+                           params.get('loadBalancers', []), params.get('deploymentConfiguration'))
+        self._new_deployment(service, task_definition['taskDefinitionArn'])
+        region.services[(cluster['clusterName'], name)] = service
+        return {'service': self._describe_service(region, service)}
+
+    def _ecs_update_service(self, region, params, now):
+        service = self._find_service(region, params.get('cluster'), params['service'])
+        if 'desiredCount' in params:
+            service.desired_count = params['desiredCount']
+        if 'deploymentConfiguration' in params:
+            service.deployment_configuration.update(params['deploymentConfiguration'])
+        task_definition_arn = service.task_definition
+        if 'taskDefinition' in params:
+            task_definition_arn = self._find_task_definition(
+                region, params['taskDefinition'])['taskDefinitionArn']
+        if task_definition_arn != service.task_definition or params.get('forceNewDeployment'):
+            self._new_deployment(service, task_definition_arn)
+        return {'service': self._describe_service(region, service)}
+
+    def _ecs_delete_service(self, region, params, now):
+        service = self._find_service(region, params.get('cluster'), params['service'])
+        if service.desired_count > 0 and not params.get('force'):
+            raise FakeAwsError('InvalidParameterException',
+                               'The service cannot be stopped while it is scaled above 0.')
+        service.desired_count = 0
+        service.status = 'DRAINING'
+        return {'service': self._describe_service(region, service)}
+
+    def _ecs_describe_services(self, region, params, now):
+        cluster = self._find_cluster(region, params.get('cluster'))
+        services = []
+        failures = []
+        for ref in params['services']:
+            service = region.services.get((cluster['clusterName'], _last_part(ref)))
+            if service is None:
+                failures.append({'arn': ref, 'reason': 'MISSING'})
+            else:
+                services.append(self._describe_service(region, service))
+        return {'services': services, 'failures': failures}
+
+    def _describe_task(self, region, task):
+        result = {
+            'taskArn': task.arn,
+            'clusterArn': region.arn('ecs', 'cluster/' + task.cluster_name),
+            'taskDefinitionArn': task.task_definition_arn,
+            'containerInstanceArn': task.container_instance_arn,
+            'lastStatus': task.last_status,
+            'desiredStatus': task.desired_status,
+            'group': 'service:' + task.service_name,
+            'startedBy': task.deployment_id,
+            'launchType': 'EC2',
+        }
+        if task.stopped_reason is not None:
+            result['stoppedReason'] = task.stopped_reason
+        return result
+
+    def _ecs_list_tasks(self, region, params, now):
+        cluster = self._find_cluster(region, params.get('cluster'))
+        desired_status = params.get('desiredStatus', 'RUNNING')
+        arns = [t.arn for t in region.tasks.values()
+                if t.cluster_name == cluster['clusterName'] and t.desired_status == desired_status
+                and params.get('serviceName', t.service_name) == t.service_name]
+        return _paginate(sorted(arns), params, 'taskArns')
+
+    def _ecs_describe_tasks(self, region, params, now):
+        self._find_cluster(region, params.get('cluster'))
+        tasks = []
+        failures = []
+        for ref in params['tasks']:
+            task = region.tasks.get(ref)
+            if task is None:
+                failures.append({'arn': ref, 'reason': 'MISSING'})
+            else:
+                tasks.append(self._describe_task(region, task))
+        return {'tasks': tasks, 'failures': failures}
+
+    def _ecs_stop_task(self, region, params, now):
+        self._find_cluster(region, params.get('cluster'))
+        task = region.tasks.get(params['task'])
+        if task is None:
+            raise FakeAwsError('InvalidParameterException', 'The referenced task was not found.')
+        if task.last_status != 'STOPPED':
+            self._stop_task_now(region, task, now, params.get('reason', 'Task stopped by user'))
+        return {'task': self._describe_task(region, task)}
+
+    def _ecs_list_container_instances(self, region, params, now):
+        cluster = self._find_cluster(region, params.get('cluster'))
+        arns = [c['containerInstanceArn'] for c in region.container_instances.values()
+                if c['clusterName'] == cluster['clusterName']]
+        return _paginate(sorted(arns), params, 'containerInstanceArns')
+
+    def _ecs_deregister_container_instance(self, region, params, now):
+        cluster = self._find_cluster(region, params.get('cluster'))
+        for arn, ci in list(region.container_instances.items()):
+            if ci['clusterName'] == cluster['clusterName'] and _last_part(arn) == _last_part(params['containerInstance']):
+                running = [t for t in region.tasks.values()
+                           if t.instance_id == ci['ec2InstanceId'] and t.last_status != 'STOPPED']
+                if running and not params.get('force', False):
+                    raise FakeAwsError('InvalidParameterException',
+                                       'The specified container instance has tasks running. '
+                                       'Use force=true to deregister it.')
+                # Tasks keep running on the instance
+                del region.container_instances[arn]
+                result = dict(ci)
+                result['status'] = 'INACTIVE'
+                return {'containerInstance': result}
+        raise FakeAwsError('InvalidParameterException', 'The referenced container instance was not found.')
+
+    # ELBv2
+
+    def _find_load_balancer_by_arn(self, region, arn):
+        for lb in region.load_balancers.values():
+            if lb['LoadBalancerArn'] == arn:
+                return lb
+        raise FakeAwsError('LoadBalancerNotFound', "Load balancer '{0}' not found".format(arn))
+
+    def _find_target_group_by_arn(self, region, arn, required=True):
+        for tg in region.target_groups.values():
+            if tg['TargetGroupArn'] == arn:
+                return tg
+        if required:
+            raise FakeAwsError('TargetGroupNotFound', "Target groups '{0}' not found".format(arn))
+        return None
+
+    def _elbv2_create_load_balancer(self, region, params, now):
+        name = params['Name']
+        lb = region.load_balancers.get(name)
+        if lb is None:
+            lb_type = params.get('Type', 'application')
+            lb_id = self._new_id(16)
+            lb = {
+                'LoadBalancerArn': region.arn('elasticloadbalancing', 'loadbalancer/{0}/{1}/{2}'.format(
+                    'net' if lb_type == 'network' else 'app', name, lb_id)),
+                'DNSName': '{0}-{1}.{2}.elb.amazonaws.com'.format(name, int(lb_id, 16), region.name),
+                'LoadBalancerName': name,
+                'Scheme': params.get('Scheme', 'internet-facing'),
+                'State': {'Code': 'active'},
+                'Type': lb_type,
+                'AvailabilityZones': [{'SubnetId': s} for s in params.get('Subnets', [])],
+                'SecurityGroups': params.get('SecurityGroups', []),
+            }
+            region.load_balancers[name] = lb
+            region.lb_attributes[lb['LoadBalancerArn']] = {
+                'idle_timeout.timeout_seconds': '60',
+                'deletion_protection.enabled': 'false',
+            }
+        return {'LoadBalancers': [lb]}
+
+    def _elbv2_describe_load_balancers(self, region, params, now):
+        if 'Names' in params:
+            missing = [n for n in params['Names'] if n not in region.load_balancers]
+            if len(missing) > 0:
+                raise FakeAwsError('LoadBalancerNotFound', "Load balancers '{0}' not found".format(missing))
+            return {'LoadBalancers': [region.load_balancers[n] for n in params['Names']]}
+        if 'LoadBalancerArns' in params:
+            return {'LoadBalancers': [self._find_load_balancer_by_arn(region, a) for a in params['LoadBalancerArns']]}
+        return {'LoadBalancers': list(region.load_balancers.values())}
+
+    def _elbv2_describe_load_balancer_attributes(self, region, params, now):
+        lb = self._find_load_balancer_by_arn(region, params['LoadBalancerArn'])
+        return {'Attributes': _attributes(region.lb_attributes[lb['LoadBalancerArn']])}
+
+    def _elbv2_modify_load_balancer_attributes(self, region, params, now):
+        lb = self._find_load_balancer_by_arn(region, params['LoadBalancerArn'])
+        attributes = region.lb_attributes[lb['LoadBalancerArn']]
+        for a in params['Attributes']:
+            attributes[a['Key']] = a['Value']
+        return {'Attributes': _attributes(attributes)}
+
+    def _elbv2_delete_load_balancer(self, region, params, now):
+        for name, lb in list(region.load_balancers.items()):
+            if lb['LoadBalancerArn'] == params['LoadBalancerArn']:
+                for listener in [l for l in region.listeners.values() if l['LoadBalancerArn'] == lb['LoadBalancerArn']]:
+                    self._elbv2_delete_listener(region, {'ListenerArn': listener['ListenerArn']}, now)
+                del region.load_balancers[name]
+                del region.lb_attributes[lb['LoadBalancerArn']]
+        return {}
+
+    def _listener_target_groups(self, listener):
+        return [a['TargetGroupArn'] for a in listener['DefaultActions'] if 'TargetGroupArn' in a]
+
+    def _elbv2_create_listener(self, region, params, now):
+        lb = self._find_load_balancer_by_arn(region, params['LoadBalancerArn'])
+        for tg_arn in self._listener_target_groups(params):
+            self._find_target_group_by_arn(region, tg_arn)
+        for listener in region.listeners.values():
+            if listener['LoadBalancerArn'] == lb['LoadBalancerArn'] and listener['Port'] == params['Port']:
+                if listener['Protocol'] == params['Protocol'] and listener['DefaultActions'] == params['DefaultActions']:
+                    return {'Listeners': [listener]}
+                raise FakeAwsError('DuplicateListener', 'A listener already exists on this port for this load balancer')
+        listener = copy.deepcopy(params)
+        listener['ListenerArn'] = region.arn('elasticloadbalancing', 'listener/{0}/{1}'.format(
+            lb['LoadBalancerArn'].split('loadbalancer/', 1)[1], self._new_id(16)))
+        region.listeners[listener['ListenerArn']] = listener
+        for tg_arn in self._listener_target_groups(listener):
+            tg = self._find_target_group_by_arn(region, tg_arn)
+            if lb['LoadBalancerArn'] not in tg['LoadBalancerArns']:
+                tg['LoadBalancerArns'].append(lb['LoadBalancerArn'])
+        return {'Listeners': [listener]}
+
+    def _elbv2_describe_listeners(self, region, params, now):
+        if 'ListenerArns' in params:
+            missing = [a for a in params['ListenerArns'] if a not in region.listeners]
+            if len(missing) > 0:
+                raise FakeAwsError('ListenerNotFound', 'One or more listeners not found')
+            return {'Listeners': [region.listeners[a] for a in params['ListenerArns']]}
+        lb = self._find_load_balancer_by_arn(region, params['LoadBalancerArn'])
+        return {'Listeners': [l for l in region.listeners.values() if l['LoadBalancerArn'] == lb['LoadBalancerArn']]}
+
+    def _elbv2_delete_listener(self, region, params, now):
+        listener = region.listeners.pop(params['ListenerArn'], None)
+        if listener is None:
+            raise FakeAwsError('ListenerNotFound', 'One or more listeners not found')
+        for tg_arn in self._listener_target_groups(listener):
+            tg = self._find_target_group_by_arn(region, tg_arn, required=False)
+            still_used = any(listener['LoadBalancerArn'] == l['LoadBalancerArn'] and tg_arn in self._listener_target_groups(l)
+                             for l in region.listeners.values())
+            if tg is not None and not still_used and listener['LoadBalancerArn'] in tg['LoadBalancerArns']:
+                tg['LoadBalancerArns'].remove(listener['LoadBalancerArn'])
+        return {}
+
+    def _elbv2_create_target_group(self, region, params, now):
+        name = params['Name']
+        tg = region.target_groups.get(name)
+        if tg is not None:
+            return {'TargetGroups': [tg]}
+        tg = {
+            'HealthCheckProtocol': params.get('Protocol', 'HTTP'),
+            'HealthCheckPort': 'traffic-port',
+            'HealthCheckEnabled': True,
+            'HealthCheckIntervalSeconds': DEFAULT_HEALTH_CHECK_INTERVAL,
+            'HealthCheckTimeoutSeconds': 5,
+            'HealthyThresholdCount': DEFAULT_HEALTHY_THRESHOLD,
+            'UnhealthyThresholdCount': 2,
+            'TargetType': 'instance',
+        }
+        if params.get('Protocol') != 'TCP':
+            tg['HealthCheckPath'] = '/'
+            tg['Matcher'] = {'HttpCode': '200'}
+        tg.update(params)
+        tg.pop('Name')
+        tg.update({
+            'TargetGroupArn': region.arn('elasticloadbalancing', 'targetgroup/{0}/{1}'.format(name, self._new_id(16))),
+            'TargetGroupName': name,
+            'LoadBalancerArns': [],
+        })
+        region.target_groups[name] = tg
+        region.tg_attributes[tg['TargetGroupArn']] = {
+            'deregistration_delay.timeout_seconds': str(DEFAULT_DEREGISTRATION_DELAY),
+            'stickiness.enabled': 'false',
+            'stickiness.type': 'lb_cookie',
+            'stickiness.lb_cookie.duration_seconds': '86400',
+        }
+        region.targets[tg['TargetGroupArn']] = {}
+        return {'TargetGroups': [tg]}
+
+    def _elbv2_describe_target_groups(self, region, params, now):
+        if 'Names' in params:
+            missing = [n for n in params['Names'] if n not in region.target_groups]
+            if len(missing) > 0:
+                raise FakeAwsError('TargetGroupNotFound', "Target groups '{0}' not found".format(missing))
+            return {'TargetGroups': [region.target_groups[n] for n in params['Names']]}
+        if 'TargetGroupArns' in params:
+            return {'TargetGroups': [self._find_target_group_by_arn(region, a) for a in params['TargetGroupArns']]}
+        if 'LoadBalancerArn' in params:
+            lb = self._find_load_balancer_by_arn(region, params['LoadBalancerArn'])
+            return {'TargetGroups': [tg for tg in region.target_groups.values()
+                                     if lb['LoadBalancerArn'] in tg['LoadBalancerArns']]}
+        return {'TargetGroups': list(region.target_groups.values())}
+
+    def _elbv2_modify_target_group(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        tg.update(params)
+        return {'TargetGroups': [tg]}
+
+    def _elbv2_describe_target_group_attributes(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        return {'Attributes': _attributes(region.tg_attributes[tg['TargetGroupArn']])}
+
+    def _elbv2_modify_target_group_attributes(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        attributes = region.tg_attributes[tg['TargetGroupArn']]
+        for a in params['Attributes']:
+            attributes[a['Key']] = a['Value']
+        return {'Attributes': _attributes(attributes)}
+
+    def _elbv2_delete_target_group(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'], required=False)
+        if tg is None:
+            return {}
+        if len(tg['LoadBalancerArns']) > 0:
+            raise FakeAwsError('ResourceInUse', "Target group '{0}' is currently in use by a listener or a rule".format(
+                tg['TargetGroupArn']))
+        del region.target_groups[tg['TargetGroupName']]
+        del region.tg_attributes[tg['TargetGroupArn']]
+        del region.targets[tg['TargetGroupArn']]
+        return {}
+
+    def _elbv2_describe_target_health(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        targets = region.targets[tg['TargetGroupArn']]
+        serving_since = self._serving_since(region, tg['TargetGroupArn'])
+        descriptions = []
+        for key in sorted(targets):
+            target = targets[key]
+            descriptions.append({
+                'Target': {'Id': target.target_id, 'Port': target.port},
+                'HealthCheckPort': str(target.port),
+                'TargetHealth': self._target_health(tg, target, serving_since, now),
+            })
+        return {'TargetHealthDescriptions': descriptions}
+
+    def _elbv2_register_targets(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        for t in params['Targets']:
+            self._register_target(region, tg['TargetGroupArn'], t['Id'], t.get('Port', tg['Port']), now)
+        return {}
+
+    def _elbv2_deregister_targets(self, region, params, now):
+        tg = self._find_target_group_by_arn(region, params['TargetGroupArn'])
+        targets = region.targets[tg['TargetGroupArn']]
+        for t in params['Targets']:
+            for target in targets.values():
+                if target.target_id == t['Id'] and t.get('Port', target.port) == target.port:
+                    self._deregister_target(region, tg['TargetGroupArn'], target, now)
+        return {}
+
+    # AutoScaling
+
+    def _find_as_group(self, region, name):
+        group = region.as_groups.get(name)
+        if group is None or group.deleting:
+            raise FakeAwsError('ValidationError', 'AutoScalingGroup name not found - ' + name)
+        return group
+
+    def _autoscaling_create_launch_configuration(self, region, params, now):
+        name = params['LaunchConfigurationName']
+        if name in region.launch_configurations:
+            raise FakeAwsError('AlreadyExists', 'Launch Configuration by this name already exists - ' + name)
+        lc = copy.deepcopy(params)
+        lc['LaunchConfigurationARN'] = region.arn('autoscaling', 'launchConfiguration:{0}:launchConfigurationName/{1}'.format(
+            self._new_id(32), name))
+        region.launch_configurations[name] = lc
+        return {}
+
+    def _autoscaling_describe_launch_configurations(self, region, params, now):
+        names = params.get('LaunchConfigurationNames', sorted(region.launch_configurations))
+        return {'LaunchConfigurations': [region.launch_configurations[n] for n in names
+                                         if n in region.launch_configurations]}
+
+    def _autoscaling_delete_launch_configuration(self, region, params, now):
+        name = params['LaunchConfigurationName']
+        if name not in region.launch_configurations:
+            raise FakeAwsError('ValidationError', 'Launch configuration name not found - ' + name)
+        if any(g.launch_configuration_name == name for g in region.as_groups.values()):
+            raise FakeAwsError('ResourceInUse', 'Cannot delete launch configuration {0} because it is attached to AutoScalingGroup'.format(name))
+        del region.launch_configurations[name]
+        return {}
+
+    def _describe_as_group(self, region, group):
+        result = {
+            'AutoScalingGroupName': group.name,
+            'AutoScalingGroupARN': region.arn('autoscaling', 'autoScalingGroup:{0}:autoScalingGroupName/{1}'.format(
+                '0' * 32, group.name)),
+            'MinSize': group.min_size,
+            'MaxSize': group.max_size,
+            'DesiredCapacity': group.desired,
+            'DefaultCooldown': group.cooldown,
+            'AvailabilityZones': group.availability_zones,
+            'VPCZoneIdentifier': group.vpc_zone_identifier,
+            'TargetGroupARNs': group.target_group_arns,
+            'TerminationPolicies': group.termination_policies,
+            'HealthCheckType': 'EC2',
+            'Instances': [region.instances[i].describe_asg() for i in group.instance_ids],
+            'Tags': group.tags,
+        }
+        if group.launch_template is not None:
+            template, _ = self._resolve_launch_template(region, group.launch_template, required=False)
+            result['LaunchTemplate'] = {
+                'LaunchTemplateId': template['LaunchTemplateId'] if template is not None else '',
+                'LaunchTemplateName': group.launch_template.get('LaunchTemplateName'),
+                'Version': group.launch_template.get('Version', '$Default'),
+            }
+        else:
+            result['LaunchConfigurationName'] = group.launch_configuration_name
+        if group.deleting:
+            result['Status'] = 'Delete in progress'
+        return result
+
+    def _check_launch_source(self, region, params, group=None):
+        if 'LaunchTemplate' in params:
+            self._resolve_launch_template(region, params['LaunchTemplate'])
+            return
+        name = params.get('LaunchConfigurationName')
+        if name is None and group is not None:
+            if group.launch_template is not None:
+                return
+            name = group.launch_configuration_name
+        if name not in region.launch_configurations:
+            raise FakeAwsError('ValidationError', 'Launch configuration name not found')
+
+    def _autoscaling_create_auto_scaling_group(self, region, params, now):
+        name = params['AutoScalingGroupName']
+        if name in region.as_groups:
+            raise FakeAwsError('AlreadyExists', 'AutoScalingGroup by this name already exists - ' + name)
+        self._check_launch_source(region, params)
+        group = _AutoScalingGroup(params)
+        group.validate()
+        for tag in params.get('Tags', []):
+            self._put_as_tag(group, tag)
+        region.as_groups[name] = group
+        return {}
+
+    def _autoscaling_update_auto_scaling_group(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        self._check_launch_source(region, params, group)
+        updated = copy.copy(group)
+        updated.update(params)
+        if 'DesiredCapacity' in params:
+            updated.desired = params['DesiredCapacity']
+        updated.validate()
+        group.update(params)
+        group.desired = updated.desired
+        return {}
+
+    def _autoscaling_terminate_instance_in_auto_scaling_group(self, region, params, now):
+        instance_id = params['InstanceId']
+        instance = region.instances.get(instance_id)
+        group = region.as_groups.get(instance.group_name) if instance is not None else None
+        if group is None or instance_id not in group.instance_ids:
+            raise FakeAwsError('ValidationError', 'Instance Id not found - No managed instance found for instance ID: ' + instance_id)
+        if params['ShouldDecrementDesiredCapacity']:
+            if group.desired - 1 < group.min_size:
+                raise FakeAwsError('ValidationError', 'Currently, desiredSize equals minSize ({0}). Terminating instance without replacement will violate group\'s min size constraint. Either set shouldDecrementDesiredCapacity flag to false or lower group\'s min size.'.format(group.min_size))
+            group.desired -= 1
+        if instance.is_alive():
+            self._terminate_instance(region, instance, now)
+        return {'Activity': {
+            'ActivityId': self._new_id(),
+            'AutoScalingGroupName': group.name,
+            'Description': 'Terminating EC2 instance: ' + instance_id,
+            'StatusCode': 'InProgress',
+        }}
+
+    def _autoscaling_describe_auto_scaling_groups(self, region, params, now):
+        names = params.get('AutoScalingGroupNames', sorted(region.as_groups))
+        return {'AutoScalingGroups': [self._describe_as_group(region, region.as_groups[n])
+                                      for n in names if n in region.as_groups]}
+
+    def _autoscaling_delete_auto_scaling_group(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        if len(group.instance_ids) > 0 and not params.get('ForceDelete'):
+            raise FakeAwsError('ResourceInUse', 'You cannot delete an AutoScalingGroup while there are instances or pending Spot instance request(s) still in the group.')
+        group.deleting = True
+        return {}
+
+    def _autoscaling_start_instance_refresh(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        if any(r.status in ('Pending', 'InProgress') for r in group.instance_refreshes):
+            raise FakeAwsError('InstanceRefreshInProgress',
+                               'An Instance Refresh is already in progress and blocks the execution of this Instance Refresh.')
+        alive = [i for i in group.instance_ids if region.instances[i].is_alive()]
+        refresh = _InstanceRefresh(self._new_id(32), group.name, params.get('Preferences', {}), len(alive), now)
+        group.instance_refreshes.insert(0, refresh)
+        return {'InstanceRefreshId': refresh.refresh_id}
+
+    def _autoscaling_describe_instance_refreshes(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        ids = params.get('InstanceRefreshIds')
+        return {'InstanceRefreshes': [r.describe() for r in group.instance_refreshes
+                                      if ids is None or r.refresh_id in ids]}
+
+    def _put_as_tag(self, group, tag):
+        group.tags = [t for t in group.tags if t['Key'] != tag['Key']]
+        group.tags.append({
+            'ResourceId': group.name,
+            'ResourceType': 'auto-scaling-group',
+            'Key': tag['Key'],
+            'Value': tag.get('Value', ''),
+            'PropagateAtLaunch': tag.get('PropagateAtLaunch', False),
+        })
+
+    def _autoscaling_create_or_update_tags(self, region, params, now):
+        for tag in params['Tags']:
+            self._put_as_tag(self._find_as_group(region, tag['ResourceId']), tag)
+        return {}
+
+    def _autoscaling_attach_load_balancer_target_groups(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        for tg_arn in params['TargetGroupARNs']:
+            tg = self._find_target_group_by_arn(region, tg_arn)
+            if tg_arn in group.target_group_arns:
+                continue
+            group.target_group_arns.append(tg_arn)
+            for instance_id in group.instance_ids:
+                if region.instances[instance_id].state == 'running':
+                    self._register_target(region, tg_arn, instance_id, tg['Port'], now)
+        return {}
+
+    def _autoscaling_put_scaling_policy(self, region, params, now):
+        group = self._find_as_group(region, params['AutoScalingGroupName'])
+        policy = copy.deepcopy(params)
+        policy['PolicyARN'] = region.arn('autoscaling', 'scalingPolicy:{0}:autoScalingGroupName/{1}:policyName/{2}'.format(
+            self._new_id(32), group.name, params['PolicyName']))
+        region.as_policies[(group.name, params['PolicyName'])] = policy
+        return {'PolicyARN': policy['PolicyARN'], 'Alarms': []}
+
+    def _autoscaling_describe_policies(self, region, params, now):
+        policies = [p for (g, n), p in sorted(region.as_policies.items())
+                    if params.get('AutoScalingGroupName', g) == g
+                    and ('PolicyNames' not in params or n in params['PolicyNames'])]
+        return {'ScalingPolicies': policies}
+
+    # Application Auto Scaling
+
+    def _application_autoscaling_register_scalable_target(self, region, params, now):
+        key = (params['ServiceNamespace'], params['ResourceId'], params['ScalableDimension'])
+        target = region.scalable_targets.get(key)
+        if target is None:
+            target = {
+                'ServiceNamespace': key[0],
+                'ResourceId': key[1],
+                'ScalableDimension': key[2],
+                'RoleARN': region.arn('iam', 'role/aws-service-role/ecs.application-autoscaling.amazonaws.com/AWSServiceRoleForApplicationAutoScaling_ECSService'),
+            }
+        target['MinCapacity'] = params.get('MinCapacity', target.get('MinCapacity'))
+        target['MaxCapacity'] = params.get('MaxCapacity', target.get('MaxCapacity'))
+        if key[0] == 'ecs':
+            # Scale the service into the new bounds right away, like AWS
+            _, cluster_name, service_name = key[1].split('/')
+            service = region.services.get((cluster_name, service_name))
+            if service is None or service.status != 'ACTIVE':
+                raise FakeAwsError('ValidationException', 'ECS service doesn\'t exist: ' + key[1])
+            service.desired_count = min(max(service.desired_count, target['MinCapacity']), target['MaxCapacity'])
+        region.scalable_targets[key] = target
+        return {}
+
+    def _application_autoscaling_describe_scalable_targets(self, region, params, now):
+        targets = [t for (ns, r, d), t in sorted(region.scalable_targets.items())
+                   if ns == params['ServiceNamespace']
+                   and ('ResourceIds' not in params or r in params['ResourceIds'])
+                   and params.get('ScalableDimension', d) == d]
+        return {'ScalableTargets': targets}
+
+    def _application_autoscaling_deregister_scalable_target(self, region, params, now):
+        key = (params['ServiceNamespace'], params['ResourceId'], params['ScalableDimension'])
+        if key not in region.scalable_targets:
+            raise FakeAwsError('ObjectNotFoundException', 'No scalable target registered for service namespace: {0}, resource ID: {1}, scalable dimension: {2}'.format(*key))
+        del region.scalable_targets[key]
+        for policy_key in [k for k in region.app_policies if k[:3] == key]:
+            del region.app_policies[policy_key]
+        return {}
+
+    def _application_autoscaling_put_scaling_policy(self, region, params, now):
+        key = (params['ServiceNamespace'], params['ResourceId'], params['ScalableDimension'])
+        if key not in region.scalable_targets:
+            raise FakeAwsError('ObjectNotFoundException', 'No scalable target registered for service namespace: {0}, resource ID: {1}, scalable dimension: {2}'.format(*key))
+        policy = copy.deepcopy(params)
+        policy['PolicyARN'] = region.arn('autoscaling', 'scalingPolicy:{0}:resource/{1}/{2}:policyName/{3}'.format(
+            self._new_id(32), key[0], key[1], params['PolicyName']))
+        region.app_policies[key + (params['PolicyName'],)] = policy
+        return {'PolicyARN': policy['PolicyARN'], 'Alarms': []}
+
+    def _application_autoscaling_describe_scaling_policies(self, region, params, now):
+        policies = [p for (ns, r, d, n), p in sorted(region.app_policies.items())
+                    if ns == params['ServiceNamespace']
+                    and params.get('ResourceId', r) == r
+                    and params.get('ScalableDimension', d) == d
+                    and ('PolicyNames' not in params or n in params['PolicyNames'])]
+        return {'ScalingPolicies': policies}
+
+    def _application_autoscaling_delete_scaling_policy(self, region, params, now):
+        key = (params['ServiceNamespace'], params['ResourceId'], params['ScalableDimension'], params['PolicyName'])
+        if key not in region.app_policies:
+            raise FakeAwsError('ObjectNotFoundException', 'No scaling policy found for service namespace: {0}, resource ID: {1}, scalable dimension: {2}, policy name: {3}'.format(*key))
+        del region.app_policies[key]
+        return {}
+
+    # SQS
+
+    def _queue_url(self, region, name):
+        return 'https://sqs.{0}.amazonaws.com/{1}/{2}'.format(region.name, ACCOUNT_ID, name)
+
+    def _find_queue(self, region, url):
+        name = _last_part(url)
+        if name not in region.queues:
+            raise FakeAwsError('AWS.SimpleQueueService.NonExistentQueue', 'The specified queue does not exist.')
+        return region.queues[name]
+
+    def _sqs_create_queue(self, region, params, now):
+        name = params['QueueName']
+        if name not in region.queues:
+            region.queues[name] = {'Attributes': dict(params.get('Attributes', {})), 'Permissions': {}}
+        return {'QueueUrl': self._queue_url(region, name)}
+
+    def _sqs_get_queue_url(self, region, params, now):
+        self._find_queue(region, params['QueueName'])
+        return {'QueueUrl': self._queue_url(region, params['QueueName'])}
+
+    def _sqs_delete_queue(self, region, params, now):
+        self._find_queue(region, params['QueueUrl'])
+        del region.queues[_last_part(params['QueueUrl'])]
+        return {}
+
+    def _sqs_add_permission(self, region, params, now):
+        queue = self._find_queue(region, params['QueueUrl'])
+        queue['Permissions'][params['Label']] = {
+            'AWSAccountIds': params['AWSAccountIds'],
+            'Actions': params['Actions'],
+        }
+        return {}
+
+    def _sqs_set_queue_attributes(self, region, params, now):
+        self._find_queue(region, params['QueueUrl'])['Attributes'].update(params['Attributes'])
+        return {}
+
+    # CloudWatch
+
+    def _cloudwatch_put_metric_alarm(self, region, params, now):
+        alarm = copy.deepcopy(params)
+        alarm['AlarmArn'] = region.arn('cloudwatch', 'alarm:' + params['AlarmName'])
+        alarm['StateValue'] = 'INSUFFICIENT_DATA'
+        region.alarms[params['AlarmName']] = alarm
+        return {}
+
+    def _cloudwatch_describe_alarms(self, region, params, now):
+        names = params.get('AlarmNames', sorted(region.alarms))
+        return {'MetricAlarms': [region.alarms[n] for n in names if n in region.alarms]}
+
+    def _cloudwatch_delete_alarms(self, region, params, now):
+        for name in params['AlarmNames']:
+            region.alarms.pop(name, None)
+        return {}
+
+    # EC2
+
+    def _matches_filters(self, instance, filters):
+        for f in filters:
+            if f['Name'] == 'instance-state-name':
+                value = instance.state
+            elif f['Name'] == 'instance-id':
+                value = instance.instance_id
+            elif f['Name'].startswith('tag:'):
+                value = dict((t['Key'], t['Value']) for t in instance.tags).get(f['Name'][4:])
+            else:
+                raise FakeAwsError('InvalidParameterValue', 'The filter \'{0}\' is invalid'.format(f['Name']))
+            if value not in f['Values']:
+                return False
+        return True
+
+    def _find_launch_template(self, region, params, required=True):
+        template = None
+        if 'LaunchTemplateId' in params:
+            template = next((t for t in region.launch_templates.values()
+                             if t['LaunchTemplateId'] == params['LaunchTemplateId']), None)
+        else:
+            template = region.launch_templates.get(params.get('LaunchTemplateName'))
+        if template is None and required:
+            raise FakeAwsError('InvalidLaunchTemplateName.NotFoundException',
+                               'The specified launch template, with template name {0}, does not exist.'.format(
+                                   params.get('LaunchTemplateName', params.get('LaunchTemplateId'))))
+        return template
+
+    def _resolve_launch_template(self, region, spec, required=True):
+        """
+        Return the template and the version of the launch template |spec|, like
+        {'LaunchTemplateName': ..., 'Version': '$Latest'}.
+        """
+        template = self._find_launch_template(region, spec, required)
+        if template is None:
+            return None, None
+        version = str(spec.get('Version', '$Default'))
+        if version == '$Latest':
+            number = template['LatestVersionNumber']
+        elif version == '$Default':
+            number = template['DefaultVersionNumber']
+        else:
+            number = int(version)
+        if not 1 <= number <= len(template['versions']):
+            raise FakeAwsError('InvalidLaunchTemplateId.VersionNotFound',
+                               'Could not find launch template version {0}'.format(version))
+        return template, template['versions'][number - 1]
+
+    def _describe_launch_template(self, template):
+        return dict((k, v) for k, v in template.items() if k != 'versions')
+
+    def _new_launch_template_version(self, region, template, params, now):
+        version = {
+            'LaunchTemplateId': template['LaunchTemplateId'],
+            'LaunchTemplateName': template['LaunchTemplateName'],
+            'VersionNumber': len(template['versions']) + 1,
+            'VersionDescription': params.get('VersionDescription', ''),
+            'CreateTime': now,
+            'DefaultVersion': False,
+            'LaunchTemplateData': copy.deepcopy(params['LaunchTemplateData']),
+        }
+        template['versions'].append(version)
+        template['LatestVersionNumber'] = version['VersionNumber']
+        return version
+
+    def _ec2_create_launch_template(self, region, params, now):
+        name = params['LaunchTemplateName']
+        if name in region.launch_templates:
+            raise FakeAwsError('InvalidLaunchTemplateName.AlreadyExistsException',
+                               'Launch template name already in use.')
+        template = {
+            'LaunchTemplateId': 'lt-' + self._new_id(),
+            'LaunchTemplateName': name,
+            'CreateTime': now,
+            'DefaultVersionNumber': 1,
+            'LatestVersionNumber': 0,
+            'versions': [],
+        }
+        version = self._new_launch_template_version(region, template, params, now)
+        version['DefaultVersion'] = True
+        region.launch_templates[name] = template
+        return {'LaunchTemplate': self._describe_launch_template(template)}
+
+    def _ec2_create_launch_template_version(self, region, params, now):
+        template = self._find_launch_template(region, params)
+        return {'LaunchTemplateVersion': self._new_launch_template_version(region, template, params, now)}
+
+    def _ec2_describe_launch_templates(self, region, params, now):
+        names = params.get('LaunchTemplateNames')
+        if names is None:
+            return {'LaunchTemplates': [self._describe_launch_template(t)
+                                        for _, t in sorted(region.launch_templates.items())]}
+        return {'LaunchTemplates': [self._describe_launch_template(self._find_launch_template(
+            region, {'LaunchTemplateName': n})) for n in names]}
+
+    def _ec2_describe_launch_template_versions(self, region, params, now):
+        versions = params.get('Versions', [str(v) for v in range(
+            1, len(self._find_launch_template(region, params)['versions']) + 1)])
+        result = []
+        for v in versions:
+            spec = dict(params)
+            spec['Version'] = v
+            _, version = self._resolve_launch_template(region, spec)
+            result.append(version)
+        return {'LaunchTemplateVersions': result}
+
+    def _ec2_delete_launch_template(self, region, params, now):
+        template = self._find_launch_template(region, params)
+        del region.launch_templates[template['LaunchTemplateName']]
+        return {'LaunchTemplate': self._describe_launch_template(template)}
+
+    def _ec2_describe_instances(self, region, params, now):
+        instances = list(region.instances.values())
+        if 'InstanceIds' in params:
+            missing = [i for i in params['InstanceIds'] if i not in region.instances]
+            if len(missing) > 0:
+                raise FakeAwsError('InvalidInstanceID.NotFound', "The instance IDs '{0}' do not exist".format(
+                    ', '.join(missing)))
+            instances = [region.instances[i] for i in params['InstanceIds']]
+        instances = [i for i in instances if self._matches_filters(i, params.get('Filters', []))]
+        return {'Reservations': [{'ReservationId': 'r-' + i.instance_id[2:], 'Instances': [i.describe_ec2()]}
+                                 for i in instances]}
+
+    def _ec2_run_instances(self, region, params, now):
+        tags = []
+        for spec in params.get('TagSpecifications', []):
+            if spec.get('ResourceType') == 'instance':
+                tags.extend(spec.get('Tags', []))
+        launched = []
+        for _ in range(params['MaxCount']):
+            instance = _Instance('i-' + self._new_id(), now + self._delay(self.instance_start_delay),
+                                 params['ImageId'], params.get('InstanceType'), copy.deepcopy(tags),
+                                 params.get('UserData'), availability_zone=region.name + 'a')
+            region.instances[instance.instance_id] = instance
+            launched.append(instance.describe_ec2())
+        return {'ReservationId': 'r-' + self._new_id(), 'Instances': launched}
+
+    def _ec2_terminate_instances(self, region, params, now):
+        result = []
+        for instance_id in params['InstanceIds']:
+            instance = region.instances.get(instance_id)
+            if instance is None:
+                raise FakeAwsError('InvalidInstanceID.NotFound', "The instance ID '{0}' does not exist".format(instance_id))
+            previous = instance.state
+            if instance.is_alive():
+                # The auto scaling group launches a replacement on the next tick
+                self._terminate_instance(region, instance, now)
+            result.append({
+                'InstanceId': instance_id,
+                'PreviousState': {'Name': previous},
+                'CurrentState': {'Name': instance.state},
+            })
+        return {'TerminatingInstances': result}
+
+
+_installed = None
+
+
+def install(fake):
+    """
+    Answer all AWS calls of the process from |fake| and run the clock of the process on
+    its virtual clock. Clients created before are dropped.
+    """
+    global _installed
+    _installed = fake
+    clock.set_clock(fake.clock)
+    aws_client.set_client_factory(fake.create_client)
+
+
+def uninstall():
+    """
+    Go back to AWS and the wall clock.
+    """
+    global _installed
+    _installed = None
+    aws_client.set_client_factory(None)
+    clock.set_clock(None)
+
+
+def get_installed():
+    return _installed
@@ -0,0 +1,36 @@
+#!/bin/python
+
+"""
+Caches the results of expensive lookups for the duration of a run.
+"""
+import functools
+import threading
+
+_lock = threading.Lock()
+_results = {}
+
+
+def memoize(fn):
+    """
+    Decorator caching the return value of |fn| keyed by its name and arguments.
+    Arguments must be hashable.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args):
+        key = (fn.__name__,) + args
+        with _lock:
+            if key in _results:
+                return _results[key]
+        value = fn(*args)
+        with _lock:
+            _results.setdefault(key, value)
+            return _results[key]
+    return wrapper
+
+
+def clear():
+    """
+    Forget all cached results.
+    """
+    with _lock:
+        _results.clear()
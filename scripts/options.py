@@ -18,6 +18,9 @@ class Options:
         self._destroy = getattr(args, 'destroy', False)
         self._normalize_tasks = getattr(args, 'normalize_tasks', False)
         self._wait_for_healthy_targets = getattr(args, 'wait_for_healthy_targets', True)
+        self._plan = not getattr(args, 'no_plan', False)
+        self._state_dir = getattr(args, 'state_dir', None)
+        self._force_upgrade = getattr(args, 'force_upgrade', False)
 
     def dry_run(self):
         return self._dry_run
@@ -29,4 +32,13 @@ class Options:
         return self._normalize_tasks
 
     def wait_for_healthy_targets(self):
-        return self._wait_for_healthy_targets
\ No newline at end of file
+        return self._wait_for_healthy_targets
+
+    def plan(self):
+        return self._plan
+
+    def state_dir(self):
+        return self._state_dir
+
+    def force_upgrade(self):
+        return self._force_upgrade
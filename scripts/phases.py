@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""
+Runs the phases of a single service deploy as a graph. Every phase names the phases it
+depends on and phases which don't depend on each other run concurrently.
+
+"""
+
+from concurrent import futures
+import events
+import logger
+import tracing
+
+DEFAULT_MAX_WORKERS = 4
+
+logger = logger.getLogger()
+
+
+class PhaseError(Exception):
+    """
+    Raised when the phases can't be ordered, e.g. they depend on each other in a cycle.
+    """
+    pass
+
+
+class Phase():
+    """
+    A step of a deploy, fn() is called once all the phases named in |dependencies| finished.
+    """
+
+    def __init__(self, name, fn, dependencies=()):
+        self.name = name
+        self.fn = fn
+        self.dependencies = set(dependencies)
+
+    def __repr__(self):
+        return 'Phase(name=%r, dependencies=%r)' % (self.name, sorted(self.dependencies))
+
+
+def check_phases(phases):
+    """
+    Raise PhaseError if a phase depends on an unknown phase or the phases form a cycle.
+    """
+    names = set(p.name for p in phases)
+    if len(names) != len(phases):
+        raise PhaseError('Duplicate phase names in {0}'.format(sorted(p.name for p in phases)))
+    done = set()
+    pending = dict((p.name, p) for p in phases)
+    for p in phases:
+        unknown = p.dependencies - names
+        if unknown:
+            raise PhaseError('Phase {0} depends on unknown phases {1}'.format(p.name, sorted(unknown)))
+    while pending:
+        ready = [name for name, p in pending.items() if p.dependencies <= done]
+        if len(ready) == 0:
+            raise PhaseError('Cycle in phase dependencies between {0}'.format(sorted(pending)))
+        for name in ready:
+            done.add(name)
+            del pending[name]
+
+
+def run_phase(phase):
+    """
+    Call the fn of |phase| in a tracing span.
+    """
+    with tracing.span(phase.name):
+        return phase.fn()
+
+
+def raise_error(error, skipped):
+    """
+    Log the phases |skipped| because of a failed phase and raise the |error| of that phase.
+    """
+    if skipped:
+        logger.error('Skipped phases %s', sorted(skipped))
+    raise error
+
+
+def run_phases(phases, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Call the fn of every phase once all its dependencies finished, running up to
+    |max_workers| of them at a time. Once a phase fails no other phase is started, and
+    the error of the first failed phase is raised when the running ones are done.
+    """
+    check_phases(phases)
+    finished = set()
+    running = {}
+    pending = dict((p.name, p) for p in phases)
+    error = None
+    # The phases run on other threads, they emit events with the context of this one.
+    run = events.bind(run_phase)
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while running or (pending and error is None):
+            if error is None:
+                for name in sorted(pending):
+                    phase = pending[name]
+                    if phase.dependencies <= finished:
+                        logger.debug('Starting phase %s', name)
+                        running[executor.submit(run, phase)] = name
+                        del pending[name]
+            done, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+            for f in done:
+                name = running.pop(f)
+                if f.exception() is None:
+                    finished.add(name)
+                    logger.debug('Finished phase %s', name)
+                else:
+                    logger.error('Phase %s failed. Error: %s', name, f.exception())
+                    if error is None:
+                        error = f.exception()
+    finally:
+        executor.shutdown(wait=True)
+    if error is not None:
+        raise_error(error, pending)
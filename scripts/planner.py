@@ -0,0 +1,398 @@
+#!/bin/python
+
+"""
+Plans the mutating AWS calls a create/update of a config needs.
+A snapshot of the current ECS, ELBv2, AutoScaling, EC2 launch template, Application Auto Scaling and SQS
+state is taken concurrently and diffed against the config. While the plan is set for the
+config (see aws_client.set_plan) the wrappers skip the calls that are not in the plan.
+"""
+import json
+from concurrent import futures
+from botocore.exceptions import ClientError
+import aws_client
+import aws_client_app_auto_scaling
+import aws_client_auto_scaling
+import aws_client_ec2
+import aws_client_ecs
+import aws_client_elb
+import aws_client_sqs
+import logger
+
+log = logger.getLogger()
+
+
+class PlannedCall():
+    """
+    A mutating call which has to be made along with the reason for it.
+    """
+
+    def __init__(self, service, operation, resource, params, reason):
+        self.service = service
+        self.operation = operation
+        self.resource = resource
+        self.params = params
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'service': self.service,
+            'operation': self.operation,
+            'resource': self.resource,
+            'params': self.params,
+            'reason': self.reason,
+        }
+
+
+class Plan():
+    """
+    List of the mutating calls needed to bring the AWS state in line with the config.
+    """
+
+    def __init__(self, config, snapshot):
+        self.config = config
+        self.snapshot = snapshot
+        self.calls = []
+
+    def add(self, service, operation, params, reason, resource=None):
+        self.calls.append(PlannedCall(service, operation, resource, params, reason))
+
+    def is_needed(self, service, operation, resource=None):
+        for c in self.calls:
+            if c.service == service and c.operation == operation and (resource is None or c.resource == resource):
+                return True
+        return False
+
+    def is_empty(self):
+        return len(self.calls) == 0
+
+    def to_json(self):
+        return json.dumps([c.to_dict() for c in self.calls], indent=4, sort_keys=True, default=str)
+
+
+class Snapshot():
+    """
+    Current state of the AWS resources of a config. Missing resources are None.
+    """
+
+    def __init__(self):
+        self.cluster = None
+        self.service = None
+        self.task_definition = None
+        self.lb = None
+        self.lb_attributes = None
+        self.listeners = []
+        self.tg = None
+        self.tg_attributes = None
+        self.launch_configuration = None
+        self.launch_template_version = None
+        self.as_group = None
+        self.as_policy = None
+        self.scalable_target = None
+        self.app_scaling_policy = None
+        self.queue_url = None
+
+
+def _ignore_missing(fn):
+    """
+    Return the result of fn() or None if the resource is not found.
+    """
+    try:
+        return fn()
+    except ClientError as e:
+        log.debug('Resource not found: %s', e)
+        return None
+
+
+def _snapshot_ecs(config, snapshot):
+    ecs = aws_client_ecs.EcsCluster(config).client
+    response = ecs.describe_clusters(clusters=[config.get_ecs_cluster_name()])
+    for c in response['clusters']:
+        if c['status'] == 'ACTIVE':
+            snapshot.cluster = c
+    if snapshot.cluster is not None:
+        response = ecs.describe_services(
+            cluster=config.get_ecs_cluster_name(),
+            services=[config.get_ecs_service_name()],
+        )
+        for s in response['services']:
+            if s['status'] == 'ACTIVE':
+                snapshot.service = s
+    response = _ignore_missing(lambda: ecs.describe_task_definition(
+        taskDefinition=config.get_task_definition_name()))
+    if response is not None and response['taskDefinition']['status'] == 'ACTIVE':
+        snapshot.task_definition = response['taskDefinition']
+
+
+def _snapshot_elb(config, snapshot):
+    elb = aws_client_elb.ElbClient(config).client
+    response = _ignore_missing(lambda: elb.describe_load_balancers(Names=[config.get_lb_name()]))
+    if response is not None and len(response['LoadBalancers']) > 0:
+        snapshot.lb = response['LoadBalancers'][0]
+        lb_arn = snapshot.lb['LoadBalancerArn']
+        response = elb.describe_load_balancer_attributes(LoadBalancerArn=lb_arn)
+        snapshot.lb_attributes = response['Attributes']
+        response = elb.describe_listeners(LoadBalancerArn=lb_arn)
+        snapshot.listeners = response['Listeners']
+    response = _ignore_missing(lambda: elb.describe_target_groups(Names=[config.get_tg_name()]))
+    if response is not None and len(response['TargetGroups']) > 0:
+        snapshot.tg = response['TargetGroups'][0]
+        response = elb.describe_target_group_attributes(
+            TargetGroupArn=snapshot.tg['TargetGroupArn'])
+        snapshot.tg_attributes = response['Attributes']
+
+
+def _snapshot_auto_scaling(config, snapshot):
+    autoscaling = aws_client_auto_scaling.AutoScalingClient(config).client
+    if config.use_launch_template():
+        snapshot.launch_template_version = aws_client_ec2.EC2Client(
+            config).get_latest_launch_template_version(config.get_launch_config_name())
+    else:
+        response = autoscaling.describe_launch_configurations(
+            LaunchConfigurationNames=[config.get_launch_config_name()])
+        if len(response['LaunchConfigurations']) > 0:
+            snapshot.launch_configuration = response['LaunchConfigurations'][0]
+    response = autoscaling.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[config.get_as_name()])
+    if len(response['AutoScalingGroups']) > 0:
+        snapshot.as_group = response['AutoScalingGroups'][0]
+        response = autoscaling.describe_policies(
+            AutoScalingGroupName=config.get_as_name(),
+            PolicyNames=[config.get_as_name()],
+        )
+        if len(response['ScalingPolicies']) > 0:
+            snapshot.as_policy = response['ScalingPolicies'][0]
+
+
+def _snapshot_app_auto_scaling(config, snapshot):
+    app_as_client = aws_client_app_auto_scaling.AppAutoScalingClient(config)
+    resource_id = app_as_client._build_resource_id()
+    response = app_as_client.client.describe_scalable_targets(
+        ServiceNamespace='ecs',
+        ResourceIds=[resource_id],
+        ScalableDimension='ecs:service:DesiredCount',
+    )
+    if len(response['ScalableTargets']) > 0:
+        snapshot.scalable_target = response['ScalableTargets'][0]
+    response = app_as_client.client.describe_scaling_policies(
+        ServiceNamespace='ecs',
+        ResourceId=resource_id,
+        ScalableDimension='ecs:service:DesiredCount',
+        PolicyNames=[config.get_as_name()],
+    )
+    if len(response['ScalingPolicies']) > 0:
+        snapshot.app_scaling_policy = response['ScalingPolicies'][0]
+
+
+def _snapshot_sqs(config, snapshot):
+    if config.get_sqs() is None:
+        return
+    sqs = aws_client_sqs.SqsClient(config).client
+    qname = config.create_name_with_separator(config.get_sqs())
+    response = _ignore_missing(lambda: sqs.get_queue_url(QueueName=qname))
+    if response is not None:
+        snapshot.queue_url = response.get('QueueUrl')
+
+
+def take_snapshot(config):
+    """
+    Describe all the resources of |config|, one thread per AWS service.
+    """
+    snapshot = Snapshot()
+    steps = [_snapshot_ecs, _snapshot_elb, _snapshot_auto_scaling,
+             _snapshot_app_auto_scaling, _snapshot_sqs]
+    executor = futures.ThreadPoolExecutor(max_workers=len(steps))
+    try:
+        fs = [executor.submit(step, config, snapshot) for step in steps]
+        for f in fs:
+            # Raise the first error, if any
+            f.result()
+    finally:
+        executor.shutdown(wait=True)
+    return snapshot
+
+
+def _attributes_differ(desired, current):
+    current_map = dict((a['Key'], a['Value']) for a in (current or []))
+    for a in desired:
+        if current_map.get(a['Key']) != a['Value']:
+            return True
+    return False
+
+
+def _plan_ecs(config, snapshot, plan):
+    if snapshot.cluster is None:
+        plan.add('ecs', 'create_cluster', {'clusterName': config.get_ecs_cluster_name()},
+                 'cluster does not exist')
+    desired_container = aws_client_ecs.get_desired_container_definition(config)
+    new_task_definition = False
+    if snapshot.task_definition is None:
+        new_task_definition = True
+        reason = 'no active task definition'
+    elif snapshot.task_definition.get('networkMode') != config.get_task_def_network_mode():
+        new_task_definition = True
+        reason = 'network mode changed'
+    elif aws_client_ecs.get_task_definition_hash(snapshot.task_definition) != \
+            aws_client_ecs.get_desired_task_definition_hash(config):
+        new_task_definition = True
+        reason = 'container definition changed'
+    if new_task_definition:
+        plan.add('ecs', 'register_task_definition',
+                 {'family': config.get_task_definition_name(), 'image': desired_container['image']}, reason)
+    if snapshot.service is None:
+        plan.add('ecs', 'create_service', {'serviceName': config.get_ecs_service_name()},
+                 'service does not exist')
+        return
+    if new_task_definition or snapshot.service['taskDefinition'] != snapshot.task_definition['taskDefinitionArn']:
+        plan.add('ecs', 'update_service', {'service': config.get_ecs_service_name()},
+                 'service does not use the latest task definition', resource='taskDefinition')
+    desired = config.get_auto_scale_desired_count()
+    if snapshot.service['desiredCount'] != desired:
+        plan.add('ecs', 'update_service', {'service': config.get_ecs_service_name(), 'desiredCount': desired},
+                 'desired count is {0}'.format(snapshot.service['desiredCount']), resource='desiredCount')
+
+
+def _plan_elb(config, snapshot, plan):
+    elb_client = aws_client_elb.ElbClient(config)
+    if snapshot.lb is None:
+        plan.add('elbv2', 'create_load_balancer', {'Name': config.get_lb_name()},
+                 'load balancer does not exist')
+    lb_attributes = elb_client.get_desired_lb_attributes()
+    if len(lb_attributes) > 0 and (snapshot.lb is None or _attributes_differ(lb_attributes, snapshot.lb_attributes)):
+        plan.add('elbv2', 'modify_load_balancer_attributes', {'Attributes': lb_attributes},
+                 'load balancer attributes differ')
+    health_check = elb_client.get_desired_health_check()
+    if snapshot.tg is None:
+        plan.add('elbv2', 'create_target_group', {'Name': config.get_tg_name()},
+                 'target group does not exist')
+    elif any(snapshot.tg.get(k) != v for k, v in health_check.items()):
+        plan.add('elbv2', 'modify_target_group', health_check, 'health check settings differ')
+    tg_attributes = elb_client.get_desired_target_group_attributes()
+    if len(tg_attributes) > 0 and (snapshot.tg is None or _attributes_differ(tg_attributes, snapshot.tg_attributes)):
+        plan.add('elbv2', 'modify_target_group_attributes', {'Attributes': tg_attributes},
+                 'target group attributes differ')
+    tg_arn = None
+    if snapshot.tg is not None:
+        tg_arn = snapshot.tg['TargetGroupArn']
+    for listener in elb_client.get_desired_listeners():
+        matching = [l for l in snapshot.listeners
+                    if l['Port'] == listener['Port'] and l['Protocol'] == listener['Protocol']
+                    and any(a.get('TargetGroupArn') == tg_arn for a in l['DefaultActions'])]
+        if tg_arn is None or len(matching) == 0:
+            plan.add('elbv2', 'create_listener', listener, 'listener does not exist',
+                     resource=listener['Port'])
+
+
+def _group_launch_source(as_group):
+    if 'LaunchTemplate' in as_group:
+        return as_group['LaunchTemplate'].get('LaunchTemplateName'), as_group['LaunchTemplate'].get('Version')
+    return as_group.get('LaunchConfigurationName')
+
+
+def _plan_launch_template(config, snapshot, plan):
+    """
+    Plan the launch template version and, if configured, the instance refresh which
+    replaces the instances of older versions.
+    """
+    name = config.get_launch_config_name()
+    version = snapshot.launch_template_version
+    new_version = True
+    if version is None:
+        plan.add('ec2', 'create_launch_template', {'LaunchTemplateName': name},
+                 'launch template does not exist')
+    elif not aws_client_ec2.launch_template_data_equal(
+            version['LaunchTemplateData'], aws_client_auto_scaling.get_launch_template_data(config)):
+        plan.add('ec2', 'create_launch_template_version', {'LaunchTemplateName': name},
+                 'launch template version {0} differs'.format(version['VersionNumber']))
+    else:
+        new_version = False
+    if config.get_instance_refresh() is None or snapshot.as_group is None:
+        return
+    if new_version:
+        reason = 'instances use an older launch template version'
+    else:
+        outdated = aws_client_auto_scaling.get_outdated_instance_ids(
+            snapshot.as_group, name, version['VersionNumber'])
+        if len(outdated) == 0:
+            return
+        reason = '{0} instances are not on launch template version {1}'.format(len(outdated), version['VersionNumber'])
+    plan.add('autoscaling', 'start_instance_refresh', {'AutoScalingGroupName': config.get_as_name()}, reason)
+
+
+def _plan_auto_scaling(config, snapshot, plan):
+    as_name = config.get_as_name()
+    if config.use_launch_template():
+        _plan_launch_template(config, snapshot, plan)
+        wanted_source = (config.get_launch_config_name(), '$Latest')
+    else:
+        if snapshot.launch_configuration is None:
+            plan.add('autoscaling', 'create_launch_configuration',
+                     {'LaunchConfigurationName': config.get_launch_config_name()},
+                     'launch configuration does not exist')
+        wanted_source = config.get_launch_config_name()
+    min_value, max_value, desired, availability_zones, vpc_zone_identifier, cooldown = config.get_auto_scale_params()
+    if snapshot.as_group is None:
+        plan.add('autoscaling', 'create_auto_scaling_group', {'AutoScalingGroupName': as_name},
+                 'auto scaling group does not exist')
+        plan.add('autoscaling', 'create_or_update_tags', {'AutoScalingGroupName': as_name},
+                 'auto scaling group does not exist')
+    else:
+        g = snapshot.as_group
+        current = (g['MinSize'], g['MaxSize'], g['DesiredCapacity'], g['DefaultCooldown'],
+                   sorted(g['AvailabilityZones']), sorted(g['VPCZoneIdentifier'].split(',')),
+                   _group_launch_source(g), g['TerminationPolicies'])
+        wanted = (min_value, max_value, desired, cooldown,
+                  sorted(availability_zones), sorted(vpc_zone_identifier.split(',')),
+                  wanted_source, ['Default'])
+        if current != wanted:
+            plan.add('autoscaling', 'update_auto_scaling_group',
+                     {'AutoScalingGroupName': as_name, 'MinSize': min_value,
+                      'MaxSize': max_value, 'DesiredCapacity': desired},
+                     'auto scaling group settings differ')
+        tags = [t for t in g.get('Tags', []) if t['Key'] == 'Name'
+                and t['Value'] == config.get_ecs_cluster_name() and t['PropagateAtLaunch']]
+        if len(tags) == 0:
+            plan.add('autoscaling', 'create_or_update_tags', {'AutoScalingGroupName': as_name},
+                     'Name tag differs')
+    threshold = config.get_auto_scale_cpu_threshold()
+    policy = snapshot.as_policy
+    if policy is None or policy.get('TargetTrackingConfiguration', {}).get('TargetValue') != threshold:
+        plan.add('autoscaling', 'put_scaling_policy', {'PolicyName': as_name, 'TargetValue': threshold},
+                 'scaling policy differs')
+
+
+def _plan_app_auto_scaling(config, snapshot, plan):
+    min_value, max_value, _, _, _, _ = config.get_auto_scale_params()
+    target = snapshot.scalable_target
+    if target is None or target['MinCapacity'] != min_value or target['MaxCapacity'] != max_value:
+        plan.add('application-autoscaling', 'register_scalable_target',
+                 {'MinCapacity': min_value, 'MaxCapacity': max_value}, 'scalable target differs')
+    threshold = config.get_auto_scale_cpu_threshold()
+    policy = snapshot.app_scaling_policy
+    policy_config = {}
+    if policy is not None:
+        policy_config = policy.get('TargetTrackingScalingPolicyConfiguration', {})
+    if policy_config.get('TargetValue') != threshold or policy_config.get('ScaleOutCooldown') != 200:
+        plan.add('application-autoscaling', 'put_scaling_policy',
+                 {'PolicyName': config.get_as_name(), 'TargetValue': threshold}, 'scaling policy differs')
+
+
+def _plan_sqs(config, snapshot, plan):
+    if config.get_sqs() is not None and snapshot.queue_url is None:
+        qname = config.create_name_with_separator(config.get_sqs())
+        plan.add('sqs', 'create_queue', {'QueueName': qname}, 'queue does not exist')
+        plan.add('sqs', 'add_permission', {'Label': qname}, 'queue does not exist')
+
+
+def create_plan(config):
+    """
+    Return the Plan of mutating calls needed to create or update |config|.
+    """
+    snapshot = take_snapshot(config)
+    plan = Plan(config, snapshot)
+    _plan_sqs(config, snapshot, plan)
+    _plan_ecs(config, snapshot, plan)
+    _plan_elb(config, snapshot, plan)
+    _plan_auto_scaling(config, snapshot, plan)
+    _plan_app_auto_scaling(config, snapshot, plan)
+    log.info('Planned %d mutating calls for %s', len(plan.calls), config.get_ecs_service_name())
+    return plan
@@ -0,0 +1,60 @@
+#!/bin/python
+
+"""
+Client side token bucket rate limiting shared by all the threads of the process.
+"""
+import threading
+import clock
+
+# Shortest sleep for a token. Waits below the resolution of the clock would not move it
+# forward, so a bucket short of a token by a rounding error would spin forever.
+MIN_WAIT = 0.001
+
+
+class TokenBucket():
+    """
+    Allows bursts of up to |capacity| calls and |rate| calls per second on average.
+    Sleeps at least MIN_WAIT for a token and takes no tokens when the clock moves back,
+    e.g. when a test swaps in another VirtualClock.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = clock.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = clock.time()
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated_at, 0) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max((1 - self.tokens) / self.rate, MIN_WAIT)
+            clock.sleep(wait)
+
+
+_buckets_lock = threading.Lock()
+_buckets = {}
+
+
+def get_bucket(name, rate, capacity):
+    """
+    Return the process wide bucket called |name|, creating it with |rate| and |capacity| on first use.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+            _buckets[name] = bucket
+        return bucket
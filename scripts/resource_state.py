@@ -0,0 +1,175 @@
+#!/bin/python
+
+"""
+Remembers the ARNs and DNS names of the resources of a config between runs so later runs
+skip the name to ARN lookups. The state of a config lives in a JSON file in the --state_dir
+directory and is only used when that option is set. Values read from the file are trusted
+until a call made with them fails with a not found error, then they are looked up again.
+
+Only the load balancer and its target group are kept. Clusters, services and auto scaling
+groups are addressed by name. Listeners are never looked up one by one: deleting a load
+balancer and planning list all of its listeners, including ones this script did not create,
+so stored listener ARNs would not save a call.
+"""
+import json
+import os
+import threading
+from botocore.exceptions import ClientError
+import logger
+import options
+
+# Error codes of calls made with the ARN of a resource which no longer exists.
+STALE_ERROR_CODES = (
+    'LoadBalancerNotFound',
+    'TargetGroupNotFound',
+    'ListenerNotFound',
+)
+
+log = logger.getLogger()
+
+_lock = threading.Lock()
+# States of the configs keyed by the name of their state file.
+_states = {}
+
+
+class _State():
+    """
+    Values of one config, and the keys of the values which were read from the file and
+    have not been used successfully or looked up again in this run.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.values = {}
+        self.from_file = set()
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                self.values = json.load(f)
+        except ValueError as e:
+            log.warn('Ignoring unreadable state file %s. Error: %s', self.filename, e)
+            self.values = {}
+        self.from_file = set(self.values)
+
+
+def get_filename(config):
+    """
+    Return the state file of |config|, or None when no --state_dir is set.
+    """
+    opts = options.get_options()
+    state_dir = opts.state_dir() if opts is not None else None
+    if state_dir is None:
+        return None
+    name = '{0}-{1}-{2}.json'.format(
+        config.get_region(), config.get_ecs_cluster_name(), config.get_ecs_service_name())
+    return os.path.join(state_dir, name)
+
+
+def _get_state(config):
+    # Callers hold _lock
+    filename = get_filename(config)
+    if filename is None:
+        return None
+    state = _states.get(filename)
+    if state is None:
+        state = _State(filename)
+        state.load()
+        _states[filename] = state
+    return state
+
+
+def lookup(config, key, live_lookup):
+    """
+    Return the value of |key| for |config| from the state, or live_lookup() when it is
+    not there. A value found by live_lookup() is remembered.
+    """
+    with _lock:
+        state = _get_state(config)
+        if state is not None and key in state.values:
+            return state.values[key]
+    value = live_lookup()
+    if value is not None:
+        put(config, key, value)
+    return value
+
+
+def put(config, key, value):
+    """
+    Remember |value| of |key| for |config|, e.g. the ARN of a resource just created.
+    """
+    with _lock:
+        state = _get_state(config)
+        if state is not None:
+            state.values[key] = value
+            state.from_file.discard(key)
+
+
+def forget(config, key):
+    """
+    Forget the value of |key| for |config|, e.g. once the resource is deleted.
+    """
+    with _lock:
+        state = _get_state(config)
+        if state is not None:
+            state.values.pop(key, None)
+            state.from_file.discard(key)
+
+
+def retry_if_stale(config, fn, *args):
+    """
+    Call fn(*args). If it fails with a not found error while values read from the state
+    file are in use, forget those values and call it once more with live lookups.
+    """
+    try:
+        return fn(*args)
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        with _lock:
+            state = _get_state(config)
+            stale = sorted(state.from_file) if state is not None else []
+            if code not in STALE_ERROR_CODES or len(stale) == 0:
+                raise
+            for key in stale:
+                state.values.pop(key, None)
+            state.from_file.clear()
+        log.warn('State file %s is stale (%s), looking up %s again', state.filename, code, stale)
+    return fn(*args)
+
+
+def save(config):
+    """
+    Write the state of |config| to its file, call it after a successful run.
+    """
+    with _lock:
+        state = _get_state(config)
+        if state is None:
+            return
+        values = dict(state.values)
+        state.from_file = set()
+    directory = os.path.dirname(state.filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write a temporary file first so a failed write never leaves a truncated state behind.
+    temp = state.filename + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(values, f, indent=4, sort_keys=True)
+    os.rename(temp, state.filename)
+    log.info('Saved resource ids to %s', state.filename)
+
+
+def delete(config):
+    """
+    Forget the whole state of |config| and remove its file, call it once the resources are gone.
+    """
+    with _lock:
+        state = _get_state(config)
+        if state is None:
+            return
+        state.values = {}
+        state.from_file = set()
+    if os.path.isfile(state.filename):
+        os.remove(state.filename)
+        log.info('Removed state file %s', state.filename)
@@ -171,6 +171,24 @@ class Config():
             return self.state['lb_listeners']
         return []
 
+    def get_upgrade_timeouts(self):
+        """
+        Return the per-step and the overall timeout (in seconds) of a rolling upgrade.
+        """
+        step_timeout = self.state.get('upgrade_step_timeout', 30 * 60)
+        timeout = self.state.get('upgrade_timeout', 2 * 60 * 60)
+        return step_timeout, timeout
+
+    def get_upgrade_strategy(self):
+        """
+        Return the rolling upgrade strategy, 'surge' or 'waves', and the max surge and max
+        unavailable of a wave. Both are a count or a percentage of the desired count like '25%'.
+        """
+        strategy = self.state.get('upgrade_strategy', 'surge')
+        max_surge = self.state.get('upgrade_max_surge', '25%')
+        max_unavailable = self.state.get('upgrade_max_unavailable', 0)
+        return strategy, max_surge, max_unavailable
+
     def get_lb_timeouts(self):
         lb_idle_timeout = self.state.get('lb_idle_timeout', None)
         return lb_idle_timeout
@@ -266,13 +284,33 @@ class Config():
         default_cooldown = self.state['auto_scale_group']['default_cooldown']
         return min, max, desired, availability_zones, vpc_zone_identifier, default_cooldown
 
+    def use_launch_template(self):
+        """
+        Return true if the auto scaling group launches its instances from a launch template,
+        named like the launch configuration, instead of from the launch configuration.
+        """
+        return bool(self.state['auto_scale_group'].get('launch_template', False))
+
+    def get_instance_refresh(self):
+        """
+        Return the min healthy percentage and the instance warmup (in seconds) of the instance
+        refresh which replaces the instances of an outdated launch template version, or None
+        if the running instances are left alone.
+        """
+        refresh = self.state['auto_scale_group'].get('instance_refresh')
+        if not refresh:
+            return None
+        if refresh is True:
+            refresh = {}
+        return refresh.get('min_healthy_percentage', 90), refresh.get('instance_warmup', 300)
+
     def log_component_names(self):
         s = pprint.PrettyPrinter(4).pformat(self.get_named_components())
         logger.logger.info('Component names are: %s', s)
         return
 
     def dump(self, stream=None):
-        return yaml.safe_dump(self.state, stream=stream)
+        return yaml_with_custom_extn.safe_dump(self.state, stream=stream)
 
     @staticmethod
     def pretty_print_json(js):
@@ -284,7 +322,7 @@ def load_config_from(filename):
     Load YAML file without any custom mapping
     """
     with open(filename, 'r') as stream:
-        config_data = yaml.safe_load(stream)
+        config_data = yaml_with_custom_extn.safe_load(stream)
         config = Config(config_data)
         return config
 
@@ -300,3 +338,49 @@ def load_config_with_extension(filename, custom_fn_map):
         filename, custom_fn_map)
     config = Config(config_data)
     return config
+
+
+def load_config_from_yaml(yaml_str, custom_fn_map):
+    """
+    Same as load_config_with_extension but loads the config from a YAML string.
+    """
+    config_data = yaml_with_custom_extn.load_yaml_with_custom_extension(
+        yaml_str, custom_fn_map)
+    config = Config(config_data)
+    return config
+
+
+def load_overlay(filename, custom_fn_map):
+    """
+    Load a YAML file with the values to override in a config, e.g. the region specific ones.
+    """
+    with open(filename, 'r') as stream:
+        return yaml_with_custom_extn.load_yaml_with_custom_extension(stream.read(), custom_fn_map) or {}
+
+
+def merge_overlay(base, overlay):
+    """
+    Return a copy of the |base| dict with |overlay| applied. Dicts are merged key by key,
+    any other value of |overlay| replaces the one of |base|.
+    """
+    merged = dict(base)
+    for k, v in overlay.items():
+        if isinstance(v, dict) and isinstance(merged.get(k), dict):
+            merged[k] = merge_overlay(merged[k], v)
+        else:
+            merged[k] = v
+    return merged
+
+
+def apply_overlay(config, overlay):
+    """
+    Return a new Config with the values of the |overlay| dict applied to |config|.
+    """
+    return Config(merge_overlay(config.state, overlay))
+
+
+def resolve_config(config):
+    """
+    Return a new Config with all the custom functions of |config| resolved to their values.
+    """
+    return Config(yaml_with_custom_extn.resolve_custom_functions(config.state))
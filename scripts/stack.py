@@ -0,0 +1,153 @@
+#!/usr/bin/python
+"""
+Deploys a stack of several service configs.
+Dependencies between configs are inferred from the file arguments of their
+!AwsCustomFunction tags (e.g. the RTC config depends on the audio and video server
+configs). Services which don't depend on each other are deployed concurrently.
+
+"""
+
+import os.path
+from concurrent import futures
+import arg_parser
+import logger
+import yaml_with_custom_extn
+
+DEFAULT_MAX_WORKERS = 4
+
+logger = logger.getLogger()
+
+
+class StackError(Exception):
+    """
+    Raised when the stack can't be ordered, e.g. the configs depend on each other in a cycle.
+    """
+    pass
+
+
+class StackNode():
+    """
+    A service config in the stack along with the stack configs it depends on.
+    """
+
+    def __init__(self, filename, config, dependencies):
+        self.filename = filename
+        # Config with the custom functions still unresolved.
+        self.config = config
+        self.dependencies = dependencies
+
+    def __repr__(self):
+        return 'StackNode(filename=%r, dependencies=%r)' % (self.filename, sorted(self.dependencies))
+
+
+def _find_custom_functions(data):
+    """
+    Yield all the custom function tags found in the loaded YAML data.
+    """
+    if isinstance(data, yaml_with_custom_extn.AwsCustomFunction):
+        yield data
+    elif isinstance(data, dict):
+        for v in data.values():
+            for fn in _find_custom_functions(v):
+                yield fn
+    elif isinstance(data, list):
+        for v in data:
+            for fn in _find_custom_functions(v):
+                yield fn
+
+
+def get_referenced_files(config):
+    """
+    Return the absolute paths of the files passed as arguments to custom functions in |config|.
+    """
+    files = set()
+    for fn in _find_custom_functions(config.state):
+        for param in fn.fn_params:
+            if os.path.isfile(param):
+                files.add(os.path.abspath(param))
+    return files
+
+
+def load_stack(filenames):
+    """
+    Load the configs without resolving their custom functions and return a map of
+    absolute filename to StackNode.
+    """
+    paths = [os.path.abspath(f) for f in filenames]
+    nodes = {}
+    for path in paths:
+        config = arg_parser.parse_config_from(path)
+        dependencies = get_referenced_files(config) & set(paths)
+        dependencies.discard(path)
+        nodes[path] = StackNode(path, config, dependencies)
+        logger.info('Stack config %s depends on %s', path, sorted(dependencies))
+    # Make sure there is no cycle before anything gets deployed.
+    get_deploy_order(nodes)
+    return nodes
+
+
+def reverse_dependencies(nodes):
+    """
+    Return a copy of |nodes| with all the edges reversed. Used to tear down dependents first.
+    """
+    reversed_nodes = {}
+    for path, node in nodes.items():
+        dependents = set(p for p, n in nodes.items() if path in n.dependencies)
+        reversed_nodes[path] = StackNode(path, node.config, dependents)
+    return reversed_nodes
+
+
+def get_deploy_order(nodes):
+    """
+    Return the filenames in an order in which every config comes after its dependencies.
+    """
+    order = []
+    done = set()
+    pending = set(nodes.keys())
+    while pending:
+        ready = sorted(p for p in pending if nodes[p].dependencies <= done)
+        if len(ready) == 0:
+            raise StackError('Cycle in stack dependencies between {0}'.format(sorted(pending)))
+        for p in ready:
+            order.append(p)
+            done.add(p)
+            pending.discard(p)
+    return order
+
+
+def deploy_stack(nodes, deploy_fn, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Call deploy_fn(node) for every node once all its dependencies were deployed, running
+    up to |max_workers| of them at a time. A node whose dependency failed is skipped.
+    Return a map of filename to the exception it failed with (None on success).
+    """
+    results = {}
+    running = {}
+    pending = set(nodes.keys())
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            for path in sorted(pending):
+                node = nodes[path]
+                failed = [d for d in node.dependencies if d in results and results[d] is not None]
+                if failed:
+                    logger.error('Skipping %s because its dependencies failed: %s', path, failed)
+                    results[path] = StackError('Dependencies failed: {0}'.format(failed))
+                    pending.discard(path)
+                elif all(d in results for d in node.dependencies):
+                    logger.info('Starting deployment of %s', path)
+                    running[executor.submit(deploy_fn, node)] = path
+                    pending.discard(path)
+            if not running:
+                continue
+            done, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+            for f in done:
+                path = running.pop(f)
+                results[path] = f.exception()
+                if results[path] is None:
+                    logger.info('Finished deployment of %s', path)
+                else:
+                    logger.error('Deployment of %s failed. Error: %s', path, results[path])
+    finally:
+        executor.shutdown(wait=True)
+    return results
@@ -0,0 +1,113 @@
+#!/bin/python
+
+"""
+Lightweight spans for the phases of a deploy and the AWS API calls made in them.
+Once enabled, spans are recorded and can be written out as Chrome trace-event JSON
+which can be opened in chrome://tracing or Perfetto. Phase spans are also emitted as
+phase_start/phase_end events while an events stream is open.
+"""
+import contextlib
+import json
+import os
+import threading
+import clock
+import events
+
+_lock = threading.Lock()
+_enabled = False
+_events = []
+_thread_names = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def _now_us():
+    return int(clock.time() * 1000000)
+
+
+def _record(name, category, start_us, end_us, args):
+    thread = threading.current_thread()
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': start_us,
+        'dur': end_us - start_us,
+        'pid': os.getpid(),
+        'tid': thread.ident,
+        'args': args,
+    }
+    with _lock:
+        _events.append(event)
+        _thread_names[thread.ident] = thread.name
+
+
+@contextlib.contextmanager
+def span(name, category='phase', **args):
+    """
+    Record the time spent in the with block as a span called |name|.
+    """
+    emit_events = category == 'phase' and events.is_enabled()
+    if not _enabled and not emit_events:
+        yield
+        return
+    start = _now_us()
+    if emit_events:
+        events.emit('phase_start', phase=name)
+    try:
+        yield
+    except Exception as e:
+        args['error'] = str(e)
+        raise
+    finally:
+        end = _now_us()
+        if _enabled:
+            _record(name, category, start, end, args)
+        if emit_events:
+            events.emit('phase_end', phase=name, seconds=(end - start) / 1000000.0, **args)
+
+
+def _before_call(model, context, **kwargs):
+    if _enabled:
+        context['tracing'] = (model.service_model.service_name + '.' + model.name, _now_us())
+
+
+def _after_call(context, **kwargs):
+    name, start = context.get('tracing', (None, None))
+    if name is not None:
+        _record(name, 'aws', start, _now_us(), {})
+
+
+def instrument(client):
+    """
+    Record a span for every call made through |client| while tracing is enabled.
+    """
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call)
+
+
+def write(filename):
+    """
+    Write the recorded spans to |filename| as Chrome trace-event JSON.
+    """
+    with _lock:
+        events = list(_events)
+        for tid, name in _thread_names.items():
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'name': name},
+            })
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,132 @@
+#!/bin/python
+
+"""
+Polls a predicate until it becomes true, backing off exponentially with jitter.
+Every wait is bounded by a per-step timeout and optionally by an overall Deadline
+shared between several steps.
+"""
+import random
+import clock
+import logger
+
+DEFAULT_INITIAL_DELAY = 2
+DEFAULT_MAX_DELAY = 30
+DEFAULT_BACKOFF = 1.5
+DEFAULT_JITTER = 0.25
+DEFAULT_STEP_TIMEOUT = 30 * 60
+
+log = logger.getLogger()
+
+
+class WaitTimeoutError(Exception):
+    """
+    Raised when a predicate did not become true before its deadline.
+    """
+    pass
+
+
+class Deadline():
+    """
+    Point in time after which waiting should stop. A timeout of None never expires.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = None
+        if timeout is not None:
+            self.expires_at = clock.time() + timeout
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - clock.time(), 0)
+
+    def expired(self):
+        return self.expires_at is not None and clock.time() >= self.expires_at
+
+
+def min_remaining(deadlines):
+    remaining = [d.remaining() for d in deadlines if d is not None]
+    remaining = [r for r in remaining if r is not None]
+    if len(remaining) == 0:
+        return None
+    return min(remaining)
+
+
+def backoff_delays(initial_delay=DEFAULT_INITIAL_DELAY,
+                   max_delay=DEFAULT_MAX_DELAY,
+                   backoff=DEFAULT_BACKOFF,
+                   jitter=DEFAULT_JITTER):
+    """
+    Yield the seconds to sleep between polls: starting at |initial_delay| and growing by
+    |backoff| up to |max_delay|, each randomized by +/- |jitter|.
+    """
+    delay = initial_delay
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * backoff, max_delay)
+
+
+class Poller():
+    """
+    Bookkeeping of a wait. Whoever polls the predicate and sleeps, a thread or an event
+    loop, asks it whether a result is done and how long to sleep before the next poll.
+    """
+
+    def __init__(self, description, timeout=DEFAULT_STEP_TIMEOUT, deadline=None,
+                 initial_delay=DEFAULT_INITIAL_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 backoff=DEFAULT_BACKOFF, jitter=DEFAULT_JITTER):
+        self.description = description
+        self.step_deadline = Deadline(timeout)
+        self.deadline = deadline
+        self.delays = backoff_delays(initial_delay, max_delay, backoff, jitter)
+        self.attempts = 0
+        self.start = clock.time()
+
+    def done(self, result):
+        """
+        Count a poll which returned |result| and return true if it is truthy.
+        """
+        self.attempts += 1
+        if result:
+            log.debug('Done waiting for %s after %d attempts and %.1fs',
+                      self.description, self.attempts, clock.time() - self.start)
+            return True
+        return False
+
+    def next_delay(self):
+        """
+        Return the seconds to sleep before the next poll.
+        Raises WaitTimeoutError when the timeout or the deadline expired.
+        """
+        remaining = min_remaining([self.step_deadline, self.deadline])
+        if remaining is not None and remaining <= 0:
+            raise WaitTimeoutError('Timed out after {0} attempts and {1:.1f}s waiting for {2}'.format(
+                self.attempts, clock.time() - self.start, self.description))
+        sleep_for = next(self.delays)
+        if remaining is not None:
+            sleep_for = min(sleep_for, remaining)
+        log.debug('Waiting %.1fs before polling %s again', sleep_for, self.description)
+        return sleep_for
+
+
+def wait_until(predicate,
+               description,
+               timeout=DEFAULT_STEP_TIMEOUT,
+               deadline=None,
+               initial_delay=DEFAULT_INITIAL_DELAY,
+               max_delay=DEFAULT_MAX_DELAY,
+               backoff=DEFAULT_BACKOFF,
+               jitter=DEFAULT_JITTER):
+    """
+    Call |predicate| until it returns a truthy value and return that value.
+    The first poll happens immediately, later polls are spaced starting at |initial_delay|
+    seconds and growing by |backoff| up to |max_delay|, each randomized by +/- |jitter|.
+    Raises WaitTimeoutError when |timeout| seconds pass or the shared |deadline| expires.
+    """
+    poller = Poller(description, timeout, deadline, initial_delay, max_delay, backoff, jitter)
+    while True:
+        result = predicate()
+        if poller.done(result):
+            return result
+        clock.sleep(poller.next_delay())
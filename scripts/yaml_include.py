@@ -0,0 +1,141 @@
+#!/bin/python
+
+"""
+Resolves 'import_file: <file>' lines in the YAML config files.
+Imports can be nested. Imports of an imported file are looked up relative to that file
+first and then relative to the current directory. Imports of the top level file are looked
+up relative to the current directory first, as they always were. Resolved output is cached by the content hash of
+the whole include tree, so shared fragments are read and spliced once per run.
+"""
+import hashlib
+import os.path
+import threading
+import logger
+
+IMPORT_PREFIX = 'import_file:'
+
+log = logger.getLogger()
+
+_lock = threading.Lock()
+# Absolute path -> SourceFile
+_files = {}
+# Hash of the include tree -> resolved YAML
+_resolved = {}
+# Imports of the top level file found both in the current directory and next to the file,
+# warned once
+_ambiguous = set()
+
+
+class IncludeError(Exception):
+    """
+    Raised when an imported file can't be found or files import each other in a cycle.
+    """
+    pass
+
+
+def _to_bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+
+class SourceFile():
+    """
+    Contents of a config file along with the files it imports.
+    """
+
+    def __init__(self, path, mtime, lines):
+        self.path = path
+        self.mtime = mtime
+        self.lines = lines
+        content = ''.join(lines)
+        self.digest = hashlib.sha1(_to_bytes(content)).hexdigest()
+        self.imports = []
+        for line in lines:
+            if line.startswith(IMPORT_PREFIX):
+                self.imports.append(line.split()[1])
+
+
+def _read(path):
+    mtime = os.path.getmtime(path)
+    with _lock:
+        source = _files.get(path)
+    if source is not None and source.mtime == mtime:
+        return source
+    with open(path, 'r') as f:
+        source = SourceFile(path, mtime, f.readlines())
+    with _lock:
+        _files[path] = source
+    return source
+
+
+def _find_import(including_file, name, top_level):
+    candidates = [os.path.join(os.path.dirname(including_file), name), name]
+    if top_level:
+        candidates.reverse()
+    found = [os.path.abspath(c) for c in candidates if os.path.isfile(c)]
+    if len(found) == 0:
+        raise IncludeError('File {0} imported from {1} not found'.format(name, including_file))
+    if top_level and len(found) > 1 and found[0] != found[1]:
+        with _lock:
+            warn = found[1] not in _ambiguous
+            _ambiguous.add(found[1])
+        if warn:
+            log.warn('File %s imported from %s exists in the current directory and next to it, '
+                     'using %s', name, including_file, found[0])
+    return found[0]
+
+
+def _tree_hash(path, stack, hasher):
+    if path in stack:
+        raise IncludeError('Import cycle: {0}'.format(' -> '.join(stack + [path])))
+    source = _read(path)
+    hasher.update(_to_bytes(path + ':' + source.digest + '\n'))
+    for name in source.imports:
+        _tree_hash(_find_import(path, name, len(stack) == 0), stack + [path], hasher)
+
+
+def _splice(path, out, top_level):
+    source = _read(path)
+    for line in source.lines:
+        if line.startswith(IMPORT_PREFIX):
+            # Bring in the imported file.
+            included_file = line.split()[1]
+            out.append('\n')
+            out.append('#################### Begin file {}'.format(included_file))
+            out.append('\n')
+            _splice(_find_import(path, included_file, top_level), out, False)
+            out.append('\n')
+            out.append('#################### End file {}'.format(included_file))
+            out.append('\n')
+        else:
+            out.append(line)
+
+
+def get_tree_hash(filename):
+    """
+    Return the hash of the contents of |filename| and of all the files it imports.
+    """
+    hasher = hashlib.sha1()
+    _tree_hash(os.path.abspath(filename), [], hasher)
+    return hasher.hexdigest()
+
+
+def resolve(filename):
+    """
+    Return the contents of |filename| with all imported files spliced in.
+    """
+    path = os.path.abspath(filename)
+    key = get_tree_hash(path)
+    with _lock:
+        resolved = _resolved.get(key)
+    if resolved is not None:
+        log.debug('Using cached preprocessed %s', filename)
+        return resolved
+    out = []
+    _splice(path, out, True)
+    resolved = ''.join(out)
+    with _lock:
+        _resolved[key] = resolved
+    log.debug('Preprocessed %s', filename)
+    return resolved
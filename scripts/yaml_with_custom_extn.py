@@ -3,6 +3,17 @@
 import yaml
 import logger
 
+# Use the libyaml based loader and dumper when PyYAML was built with libyaml, they are
+# several times faster than the pure python ones.
+try:
+    from yaml import CSafeLoader as FastSafeLoader
+    from yaml import CSafeDumper as FastSafeDumper
+    HAS_LIBYAML = True
+except ImportError:
+    FastSafeLoader = yaml.SafeLoader
+    FastSafeDumper = yaml.SafeDumper
+    HAS_LIBYAML = False
+
 # Extend yaml with custom extension tags. e.g.
 # <test.yaml>
 #   environment:
@@ -13,16 +24,20 @@ import logger
 
 
 class AwsCustomFunction():
-    yaml_loader = yaml.SafeLoader
-    yaml_dumper = yaml.SafeDumper
+    yaml_loader = FastSafeLoader
+    yaml_dumper = FastSafeDumper
     YAML_TAG = '!AwsCustomFunction'
     AWS_FN_MAP = {}
     YAML_CONFIG = None
+    # Results of the functions in AWS_FN_MAP keyed by function name and params.
+    AWS_FN_RESULTS = {}
 
     def __init__(self, line):
         self.line = line
         self.fn_name = None
         self.fn_params = []
+        self.value = None
+        self.resolved = False
         self.log = logger.getLogger()
         if type(line) == list and len(line) > 0:
             self.fn_name = line[0].value
@@ -32,19 +47,32 @@ class AwsCustomFunction():
                        self.fn_name, self.fn_params)
 
     def __repr__(self):
+        if self.resolved:
+            return '%s(line=%r)' % (self.__class__.__name__, self.line)
         if self.fn_name in AwsCustomFunction.AWS_FN_MAP:
-            fn = AwsCustomFunction.AWS_FN_MAP[self.fn_name]
-            self.value = fn(*self.fn_params)
+            key = (self.fn_name,) + tuple(self.fn_params)
+            if key not in AwsCustomFunction.AWS_FN_RESULTS:
+                fn = AwsCustomFunction.AWS_FN_MAP[self.fn_name]
+                AwsCustomFunction.AWS_FN_RESULTS[key] = fn(*self.fn_params)
+            self.value = AwsCustomFunction.AWS_FN_RESULTS[key]
+            self.resolved = True
             self.log.debug('Function:%s returned:%s', self.fn_name, self.value)
             return '%s(line=%r)' % (self.__class__.__name__, self.line)
         self.log.warning('No function mapping for Name:%s Map:%s ',
                          self.fn_name, AwsCustomFunction.AWS_FN_MAP)
         raise Exception('No function mapping found for ' + self.fn_name)
 
+    @classmethod
+    def clear_results(cls):
+        cls.AWS_FN_RESULTS = {}
+
     @classmethod
     def register_mapping(cls, yaml_config, aws_fn_map):
         cls.YAML_CONFIG = yaml_config
         if aws_fn_map is not None:
+            # Results of a previous mapping don't apply to the new one.
+            if aws_fn_map is not cls.AWS_FN_MAP:
+                cls.clear_results()
             cls.AWS_FN_MAP = aws_fn_map
 
 
@@ -59,16 +87,56 @@ def to_yaml(dumper, data):
     return v
 
 
+# Register custom tag loader and dumper on both the pure python and the libyaml classes
+for _loader in set([yaml.SafeLoader, FastSafeLoader]):
+    _loader.add_constructor(AwsCustomFunction.YAML_TAG, from_yaml)
+for _dumper in set([yaml.SafeDumper, FastSafeDumper]):
+    _dumper.add_representer(AwsCustomFunction, to_yaml)
+
+
+def safe_load(stream, loader=FastSafeLoader):
+    """
+    Same as yaml.safe_load but uses libyaml when available.
+    """
+    return yaml.load(stream, Loader=loader)
+
+
+def safe_dump(data, stream=None, dumper=FastSafeDumper):
+    """
+    Same as yaml.safe_dump but uses libyaml when available.
+    """
+    return yaml.dump(data, stream=stream, Dumper=dumper, default_flow_style=False)
+
+
+def load_yaml_with_custom_extension(stream, aws_fn_map):
+    """
+    Load YAML from a string or stream with custom tag
+    """
+    # load the config and return it
+    config = safe_load(stream)
+    # Register custom function map with the YAML config
+    AwsCustomFunction.register_mapping(config, aws_fn_map)
+    return config
+
+
 def load_config_with_custom_extension(filename, aws_fn_map):
     """
     Load YAML file with custom tag
     """
     with open(filename, 'r') as stream:
-        # Register custom tag loader and dumper
-        yaml.SafeLoader.add_constructor(AwsCustomFunction.YAML_TAG, from_yaml)
-        yaml.SafeDumper.add_representer(AwsCustomFunction, to_yaml)
-        # load the config and return it
-        config = yaml.safe_load(stream)
-        # Register custom function map with the YAML config
-        AwsCustomFunction.register_mapping(config, aws_fn_map)
-        return config
+        return load_yaml_with_custom_extension(stream, aws_fn_map)
+
+
+def resolve_custom_functions(data):
+    """
+    Return a copy of the loaded YAML |data| with every custom tag replaced by the string
+    its function returns, the same value dumping the YAML would produce.
+    """
+    if isinstance(data, AwsCustomFunction):
+        _ = repr(data)    # Force running the function.
+        return '%s' % data.value
+    if isinstance(data, dict):
+        return dict((k, resolve_custom_functions(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [resolve_custom_functions(v) for v in data]
+    return data
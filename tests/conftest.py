@@ -0,0 +1,3 @@
+import support
+
+support.setup_paths()
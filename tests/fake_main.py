@@ -0,0 +1,19 @@
+"""
+Run main.py with the command line arguments of this script against a fresh fake_aws.
+"""
+import runpy
+import sys
+import support
+
+support.setup_paths()
+import fake_aws
+import service_config
+import stack
+import cluster
+import options
+import arg_parser
+support.import_scripts()
+
+fake_aws.install(fake_aws.FakeAws())
+sys.argv = [support.ROOT_DIR + '/main.py'] + sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
@@ -0,0 +1,39 @@
+"""
+Helpers to run the scripts against fake_aws in tests.
+
+The scripts import each other as top level modules (Python 2 implicit relative imports),
+so scripts/ is put on sys.path and the modules are also set on the scripts package,
+where main.py looks them up.
+"""
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(ROOT_DIR, 'scripts')
+CONFIGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configs')
+
+
+def setup_paths():
+    for path in (ROOT_DIR, SCRIPTS_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    # boto3 wants credentials to sign requests, fake_aws answers them before they are sent.
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+def import_scripts():
+    """
+    Import the scripts package and set the modules loaded from scripts/ on it.
+    """
+    setup_paths()
+    import scripts
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None) or ''
+        if os.path.dirname(os.path.abspath(filename)) == SCRIPTS_DIR and '.' not in name:
+            setattr(scripts, name, module)
+    return scripts
+
+
+def config_path(name):
+    return os.path.join(CONFIGS_DIR, name)
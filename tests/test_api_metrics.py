@@ -0,0 +1,60 @@
+"""
+API call statistics of a deploy against fake_aws.
+"""
+import json
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import api_metrics
+import arg_parser
+import cluster
+import fake_aws
+import options
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    api_metrics.clear()
+    fake = fake_aws.FakeAws(latency=0.1, throttle_rate=0.2)
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+    api_metrics.clear()
+
+
+def test_api_metrics_match_the_calls(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    report = dict((r['service'] + '.' + r['operation'], r) for r in api_metrics.get_report())
+
+    create_cluster = report['ecs.CreateCluster']
+    assert create_cluster['calls'] == fake.calls['ecs.create_cluster'] == 1
+    assert create_cluster['p50_seconds'] == pytest.approx(0.1)
+    assert sum(r['calls'] for r in report.values()) == sum(fake.calls.values())
+    # Every throttled attempt is retried inside the fake and reported back as a retry
+    assert sum(fake.throttles.values()) > 0
+    for key, throttles in fake.throttles.items():
+        service, operation = key.split('.')
+        assert report[service + '.' + ''.join(w.capitalize() for w in operation.split('_'))]['retries'] == throttles
+    assert sum(r['retries'] for r in report.values()) == sum(fake.throttles.values())
+    assert 'ecs.CreateCluster' in api_metrics.format_report()
+
+
+def test_write_json(fake, tmp_path):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    filename = str(tmp_path / 'metrics.json')
+    api_metrics.write_json(filename)
+
+    with open(filename) as f:
+        assert json.load(f) == api_metrics.get_report()
@@ -0,0 +1,61 @@
+"""
+The asyncio API against fake_aws, and the events context of concurrent tasks.
+"""
+import asyncio
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import async_cluster
+import events
+import fake_aws
+import options
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def test_create_upgrade_destroy(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    region = fake.get_region(config.get_region())
+
+    async def deploy():
+        await async_cluster.create_or_update_cluster(config)
+        fake.run_for(600, config.get_region())
+        await async_cluster.upgrade_cluster(config)
+        assert len([t for t in region.tasks.values() if t.last_status == 'RUNNING']) == 2
+        await async_cluster.destroy_cluster(config, True)
+    asyncio.run(deploy())
+    assert region.as_groups == {}
+    assert [s.status for s in region.services.values()] == ['INACTIVE']
+
+
+def test_tasks_have_their_own_events_context():
+    seen = {}
+
+    async def deploy(service):
+        with events.context(service=service):
+            await asyncio.sleep(0)
+            seen[service] = await async_cluster.run_blocking(events.get_context)
+            seen[service + ' loop'] = events.get_context()
+
+    async def main():
+        await asyncio.gather(deploy('a'), deploy('b'))
+    asyncio.run(main())
+    assert seen == {'a': {'service': 'a'}, 'a loop': {'service': 'a'},
+                    'b': {'service': 'b'}, 'b loop': {'service': 'b'}}
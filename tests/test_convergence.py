@@ -0,0 +1,77 @@
+"""
+Driving generators of steps and the snapshots of a ConvergenceWatcher.
+"""
+import asyncio
+import pytest
+import support
+
+support.setup_paths()
+import async_cluster
+import clock
+import convergence
+import waiter
+
+
+@pytest.fixture(autouse=True)
+def virtual_clock():
+    clock.set_clock(clock.VirtualClock())
+    yield
+    clock.set_clock(None)
+
+
+def never():
+    return None
+
+
+def at_once():
+    return True
+
+
+def handling_steps(log):
+    try:
+        yield convergence.Wait(never, 'never', 10, None)
+    except waiter.WaitTimeoutError:
+        log.append('handled')
+        yield convergence.Wait(at_once, 'at once', 10, None)
+    log.append('done')
+
+
+def failing_steps(log):
+    try:
+        yield convergence.Wait(never, 'never', 10, None)
+        log.append('not reached')
+    finally:
+        log.append('cleaned up')
+
+
+def test_run_steps_continues_after_a_handled_error():
+    log = []
+    convergence.run_steps(handling_steps(log))
+    assert log == ['handled', 'done']
+
+
+def test_run_steps_raises_an_unhandled_error():
+    log = []
+    with pytest.raises(waiter.WaitTimeoutError):
+        convergence.run_steps(failing_steps(log))
+    assert log == ['cleaned up']
+
+
+def test_async_run_steps_continues_after_a_handled_error():
+    log = []
+    asyncio.run(async_cluster.run_steps(handling_steps(log)))
+    assert log == ['handled', 'done']
+
+    log = []
+    with pytest.raises(waiter.WaitTimeoutError):
+        asyncio.run(async_cluster.run_steps(failing_steps(log)))
+    assert log == ['cleaned up']
+
+
+def test_snapshot_counts_live_instances():
+    instances = [{'InstanceId': 'i-1', 'LifecycleState': 'InService'},
+                 {'InstanceId': 'i-2', 'LifecycleState': 'Pending'},
+                 {'InstanceId': 'i-3', 'LifecycleState': 'Terminating'}]
+    snapshot = convergence.Snapshot({'desiredCount': 2, 'runningCount': 2}, [], instances)
+    assert snapshot.counts()['instances'] == 2
+    assert '| instances:2 ' in str(snapshot)
@@ -0,0 +1,54 @@
+"""
+Paginated ECS listings and batched describes against fake_aws.
+"""
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import aws_client
+import aws_client_ecs
+import cluster
+import fake_aws
+import options
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def test_iterate_chunks():
+    assert list(aws_client_ecs.iterate_chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(aws_client_ecs.iterate_chunks([], 2)) == []
+
+
+def test_listings_follow_pages_and_describes_are_batched(fake, monkeypatch):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    client = aws_client.get_client('ecs', config.get_region())
+    cluster_name = config.get_ecs_cluster_name()
+
+    fake.reset_stats()
+    task_arns = list(aws_client_ecs.iterate_tasks(
+        client, cluster=cluster_name, desiredStatus='RUNNING', PaginationConfig={'PageSize': 1}))
+    assert len(task_arns) == 2
+    assert fake.calls['ecs.list_tasks'] == 2
+
+    monkeypatch.setattr(aws_client_ecs, 'DESCRIBE_TASKS_BATCH_SIZE', 1)
+    tasks = list(aws_client_ecs.describe_tasks(client, cluster_name, iter(task_arns)))
+    assert sorted(t['taskArn'] for t in tasks) == sorted(task_arns)
+    assert fake.calls['ecs.describe_tasks'] == 2
@@ -0,0 +1,167 @@
+"""
+Runs create, upgrade and destroy of a service against fake_aws on its virtual clock.
+"""
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import cluster
+import fake_aws
+import options
+import service_config
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws(task_failure_rate=0.1)
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def load_yaml(image_tag):
+    with open(support.config_path('service.yaml')) as f:
+        return f.read().replace("'1.0']", "'{0}']".format(image_tag))
+
+
+def load_config(image_tag):
+    return service_config.load_config_from_yaml(load_yaml(image_tag), None)
+
+
+def running_tasks(region):
+    return [t for t in region.tasks.values() if t.last_status == 'RUNNING']
+
+
+def test_create_upgrade_destroy(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    region = fake.get_region(config.get_region())
+
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    assert cluster.plan_cluster(config).is_empty()
+    group = region.as_groups[config.get_as_name()]
+    assert group.desired == 2
+    assert len(running_tasks(region)) == 2
+    assert region.services[(config.get_ecs_cluster_name(), config.get_ecs_service_name())].status == 'ACTIVE'
+
+    new_config = load_config('2.0')
+    cluster.upgrade_cluster(new_config)
+    family = new_config.get_task_definition_name()
+    assert len(region.task_definitions[family]) == 2
+    assert group.desired == 2
+    tasks = running_tasks(region)
+    assert len(tasks) == 2
+    assert all(t.task_definition_arn.endswith(family + ':2') for t in tasks)
+
+    cluster.destroy_cluster(new_config, True)
+    assert region.as_groups == {}
+    assert region.launch_configurations == {}
+    assert region.load_balancers == {}
+    assert region.target_groups == {}
+    assert region.queues == {}
+    assert [s.status for s in region.services.values()] == ['INACTIVE']
+    assert running_tasks(region) == []
+
+
+def test_upgrade_with_the_same_image_keeps_the_task_definition(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    calls = dict(fake.calls)
+
+    cluster.upgrade_cluster(config)
+    assert len(region.task_definitions[config.get_task_definition_name()]) == 1
+    assert fake.calls.get('ecs.register_task_definition') == calls.get('ecs.register_task_definition')
+    assert fake.calls.get('ecs.update_service') == calls.get('ecs.update_service')
+
+
+def test_task_definition_hash_ignores_the_defaults_aws_fills_in():
+    import aws_client_ecs
+    desired = [{'name': 'app', 'image': 'app:1.0',
+                'environment': [{'name': 'B', 'value': '2'}, {'name': 'A', 'value': '1'}],
+                'portMappings': [{'containerPort': 80}], 'mountPoints': []}]
+    echoed = [{'name': 'app', 'image': 'app:1.0', 'cpu': 0, 'essential': True,
+               'environment': [{'name': 'A', 'value': '1'}, {'name': 'B', 'value': '2'}],
+               'portMappings': [{'containerPort': 80, 'hostPort': 80, 'protocol': 'tcp'}],
+               'volumesFrom': [], 'dockerLabels': {}}]
+    assert (aws_client_ecs.task_definition_hash('app', 'awsvpc', desired) ==
+            aws_client_ecs.task_definition_hash('app', 'awsvpc', echoed))
+    assert (aws_client_ecs.task_definition_hash('app', 'bridge', desired) !=
+            aws_client_ecs.task_definition_hash('app', 'bridge', echoed))
+
+
+def test_destroy_with_running_tasks(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    assert len(running_tasks(region)) == 2
+    assert len(region.container_instances) == 2
+
+    cluster.destroy_cluster(config, True)
+    assert region.container_instances == {}
+    assert region.as_groups == {}
+    assert [c['status'] for c in region.clusters.values()] == ['INACTIVE']
+    assert [s.status for s in region.services.values()] == ['INACTIVE']
+
+
+def load_waves_config(image_tag, surge, unavailable):
+    yaml_str = load_yaml(image_tag).replace('max: 4\n  desired: 2', 'max: 10\n  desired: 5')
+    yaml_str += 'upgrade_strategy: waves\nupgrade_max_surge: {0}\nupgrade_max_unavailable: {1}\n'.format(
+        surge, unavailable)
+    return service_config.load_config_from_yaml(yaml_str, None)
+
+
+@pytest.mark.parametrize('surge, unavailable', [(2, 1), (2, 0), (0, 2)])
+def test_upgrade_in_waves(fake, surge, unavailable):
+    config = load_waves_config('1.0', surge, unavailable)
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    group = region.as_groups[config.get_as_name()]
+    old_instance_ids = set(group.instance_ids)
+    assert len(old_instance_ids) == 5
+
+    new_config = load_waves_config('2.0', surge, unavailable)
+    cluster.upgrade_cluster(new_config)
+    family = new_config.get_task_definition_name()
+    assert group.desired == 5
+    assert old_instance_ids.isdisjoint(group.instance_ids)
+    tasks = running_tasks(region)
+    assert len(tasks) == 5
+    assert all(t.task_definition_arn.endswith(family + ':2') for t in tasks)
+
+
+def test_upgrade_in_waves_retries_failed_terminations(fake):
+    config = load_waves_config('1.0', 0, 2)
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    group = region.as_groups[config.get_as_name()]
+    old_instance_ids = set(group.instance_ids)
+
+    terminate = fake._autoscaling_terminate_instance_in_auto_scaling_group
+    failed = []
+
+    def fail_once(region, params, now):
+        if not failed:
+            failed.append(params['InstanceId'])
+            raise fake_aws.FakeAwsError('ValidationError', 'Injected failure')
+        return terminate(region, params, now)
+    fake._autoscaling_terminate_instance_in_auto_scaling_group = fail_once
+
+    cluster.upgrade_cluster(load_waves_config('2.0', 0, 2))
+    assert len(failed) == 1
+    assert old_instance_ids.isdisjoint(group.instance_ids)
+    assert len(running_tasks(region)) == 5
@@ -0,0 +1,101 @@
+"""
+Launch template versions and instance refreshes against fake_aws.
+"""
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import aws_client
+import aws_client_auto_scaling
+import aws_client_ec2
+import cluster
+import fake_aws
+import options
+import service_config
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def load_config(ami):
+    with open(support.config_path('launch_template.yaml')) as f:
+        yaml_str = f.read().replace('ami: ami-1', 'ami: ' + ami)
+    return service_config.load_config_from_yaml(yaml_str, None)
+
+
+def test_data_compares_equal_to_the_echoed_version():
+    config = load_config('ami-1')
+    data = aws_client_auto_scaling.get_launch_template_data(config)
+    echoed = dict(data)
+    echoed['NetworkInterfaces'] = [{
+        'DeviceIndex': 0,
+        'AssociatePublicIpAddress': data['NetworkInterfaces'][0]['AssociatePublicIpAddress'],
+        'Groups': list(reversed(data['NetworkInterfaces'][0]['Groups'] + ['sg-2'])),
+    }]
+    data['NetworkInterfaces'][0]['Groups'] = data['NetworkInterfaces'][0]['Groups'] + ['sg-2']
+    echoed['BlockDeviceMappings'] = [{'DeviceName': config.get_volume_name(),
+                                      'Ebs': {'VolumeSize': str(config.get_volume_size())}}]
+    echoed['TagSpecifications'] = []
+    assert aws_client_ec2.launch_template_data_equal(echoed, data)
+    echoed['ImageId'] = 'ami-2'
+    assert not aws_client_ec2.launch_template_data_equal(echoed, data)
+
+
+def test_unchanged_template_creates_no_version(fake):
+    config = load_config('ami-1')
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    calls = dict(fake.calls)
+
+    assert cluster.plan_cluster(config).is_empty()
+    cluster.create_or_update_cluster(config)
+    assert region.launch_templates[config.get_launch_config_name()]['LatestVersionNumber'] == 1
+    for api in ('ec2.create_launch_template_version', 'autoscaling.start_instance_refresh'):
+        assert fake.calls.get(api) == calls.get(api)
+
+
+def test_changed_ami_creates_a_version_and_refreshes(fake):
+    config = load_config('ami-1')
+    region = fake.get_region(config.get_region())
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+
+    new_config = load_config('ami-2')
+    cluster.create_or_update_cluster(new_config)
+    assert region.launch_templates[config.get_launch_config_name()]['LatestVersionNumber'] == 2
+    group = region.as_groups[config.get_as_name()]
+    assert [region.instances[i].image_id for i in group.instance_ids] == ['ami-2'] * group.desired
+
+
+class NothingPlanned():
+
+    def is_needed(self, service, operation, resource=None):
+        return False
+
+
+def test_missing_template_is_created_when_the_plan_skips_it(fake):
+    config = arg_parser.parse_config_from(support.config_path('launch_template.yaml'))
+    region = fake.get_region(config.get_region())
+    aws_client.set_plan(config, NothingPlanned())
+    try:
+        version = aws_client_auto_scaling.AutoScalingClient(config).get_or_create_launch_template()
+    finally:
+        aws_client.set_plan(config, None)
+    assert version['VersionNumber'] == 1
+    assert list(region.launch_templates) == [config.get_launch_config_name()]
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+import support
+
+
+def run_main(*args):
+    return subprocess.run(
+        [sys.executable, support.ROOT_DIR + '/tests/fake_main.py'] + list(args),
+        input=b'yes\n', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=support.ROOT_DIR)
+
+
+def test_regions_exit_status_is_1_when_a_region_fails():
+    result = run_main('--file', support.config_path('service.yaml'), '--create', '--regions',
+                      support.config_path('regions/east.yaml'), support.config_path('regions/bad.yaml'))
+    output = result.stdout.decode('utf-8', 'replace')
+    assert result.returncode == 1, output
+    assert 'east.yaml (us-east-1): OK' in output
+    assert 'bad.yaml (eu-west-1): FAILED' in output
+
+
+def test_regions_exit_status_is_0_when_all_regions_succeed():
+    result = run_main('--file', support.config_path('service.yaml'), '--create', '--regions',
+                      support.config_path('regions/east.yaml'))
+    assert result.returncode == 0, result.stdout.decode('utf-8', 'replace')
+
+
+def test_regions_with_a_config_which_does_not_load():
+    result = run_main('--file', support.config_path('service.yaml'), '--create', '--regions',
+                      support.config_path('regions/broken.yaml'), support.config_path('regions/east.yaml'))
+    output = result.stdout.decode('utf-8', 'replace')
+    assert result.returncode == 1, output
+    assert 'east.yaml (us-east-1): OK' in output
+    assert 'broken.yaml (not loaded): FAILED' in output
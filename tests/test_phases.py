@@ -0,0 +1,110 @@
+"""
+The phase graph, and a deploy with a failed phase against fake_aws.
+"""
+import asyncio
+import logging
+import pytest
+import support
+from botocore.exceptions import ClientError
+
+support.setup_paths()
+import arg_parser
+import async_cluster
+import cluster
+import fake_aws
+import options
+import phases
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def test_dependencies_run_first():
+    finished = []
+    phase_list = [
+        phases.Phase('c', lambda: finished.append('c'), ['a', 'b']),
+        phases.Phase('b', lambda: finished.append('b'), ['a']),
+        phases.Phase('a', lambda: finished.append('a')),
+    ]
+    phases.run_phases(phase_list)
+    assert finished == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('phase_list', [
+    [phases.Phase('a', None, ['b']), phases.Phase('b', None, ['a'])],
+    [phases.Phase('a', None, ['missing'])],
+    [phases.Phase('a', None), phases.Phase('a', None)],
+])
+def test_invalid_graphs(phase_list):
+    with pytest.raises(phases.PhaseError):
+        phases.run_phases(phase_list)
+
+
+def test_failed_phase_skips_its_dependents():
+    finished = []
+
+    def fail():
+        raise ValueError('failed')
+    phase_list = [
+        phases.Phase('fails', fail),
+        phases.Phase('independent', lambda: finished.append('independent')),
+        phases.Phase('dependent', lambda: finished.append('dependent'), ['fails']),
+        phases.Phase('transitive', lambda: finished.append('transitive'), ['dependent']),
+    ]
+    with pytest.raises(ValueError):
+        phases.run_phases(phase_list)
+    assert finished == ['independent']
+
+
+def fail_task_definitions(fake):
+    def register_task_definition(region, params, now):
+        raise fake_aws.FakeAwsError('ClientException', 'Injected failure')
+    fake._ecs_register_task_definition = register_task_definition
+
+
+def run_sync(config):
+    cluster.create_or_update_cluster(config)
+
+
+def run_async(config):
+    asyncio.run(async_cluster.create_or_update_cluster(config))
+
+
+@pytest.mark.parametrize('create', [run_sync, run_async])
+def test_create_with_a_failed_phase(fake, create):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    region = fake.get_region(config.get_region())
+    fail_task_definitions(fake)
+
+    with pytest.raises(ClientError) as e:
+        create(config)
+    assert e.value.response['Error']['Code'] == 'ClientException'
+    # The phases which don't depend on the task definition ran
+    assert list(region.clusters) == [config.get_ecs_cluster_name()]
+    assert len(region.launch_configurations) == 1
+    # Its dependents and theirs were skipped
+    assert 'ecs.create_service' not in fake.calls
+    assert 'elbv2.create_load_balancer' not in fake.calls
+    assert 'autoscaling.create_auto_scaling_group' not in fake.calls
+    assert 'application-autoscaling.register_scalable_target' not in fake.calls
+
+    # The next run picks up where the failed one stopped
+    del fake._ecs_register_task_definition
+    fake.reset_stats()
+    create(config)
+    assert 'ecs.create_cluster' not in fake.calls
+    assert fake.calls['ecs.create_service'] == 1
+    assert len(region.as_groups) == 1
@@ -0,0 +1,66 @@
+"""
+Plans of create_or_update_cluster against fake_aws.
+"""
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import cluster
+import fake_aws
+import options
+import service_config
+
+READ_ONLY_PREFIXES = ('describe_', 'list_', 'get_')
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def writes(calls):
+    return dict((k, v) for k, v in calls.items() if not k.split('.', 1)[1].startswith(READ_ONLY_PREFIXES))
+
+
+def test_plan_of_a_new_service_creates_everything(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    operations = set(c.operation for c in cluster.plan_cluster(config).calls)
+    assert {'create_cluster', 'register_task_definition', 'create_load_balancer', 'create_target_group',
+            'create_launch_configuration', 'create_auto_scaling_group', 'create_service'} <= operations
+
+
+def test_redeploy_without_changes_makes_no_writes(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+    assert cluster.plan_cluster(config).is_empty()
+
+    before = writes(fake.calls)
+    cluster.create_or_update_cluster(config)
+    assert writes(fake.calls) == before
+
+
+def test_plan_lists_only_the_changed_settings(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    fake.run_for(600, config.get_region())
+
+    with open(support.config_path('service.yaml')) as f:
+        yaml_str = f.read().replace('max: 4', 'max: 6')
+    changed = service_config.load_config_from_yaml(yaml_str, None)
+    plan = cluster.plan_cluster(changed)
+    # The max of the group and of the application auto scaling of the service
+    assert sorted(c.operation for c in plan.calls) == ['register_scalable_target', 'update_auto_scaling_group']
@@ -0,0 +1,47 @@
+"""
+Token bucket pacing on a virtual clock.
+"""
+import pytest
+import support
+
+support.setup_paths()
+import clock
+import rate_limiter
+
+
+@pytest.fixture
+def virtual_clock():
+    # Epoch scale, like the clock of fake_aws
+    virtual_clock = clock.VirtualClock(start=1.7e9)
+    clock.set_clock(virtual_clock)
+    yield virtual_clock
+    clock.set_clock(None)
+
+
+def test_bursts_then_paces_at_the_rate(virtual_clock):
+    bucket = rate_limiter.TokenBucket(rate=2, capacity=5)
+    start = clock.time()
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.time() == start
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.time() - start == pytest.approx(2, abs=0.01)
+
+
+def test_wait_below_the_clock_resolution_moves_the_clock(virtual_clock):
+    # A wait of a nanosecond does not change a time of 1.7e9, so without a shortest
+    # wait the bucket would never get its token.
+    bucket = rate_limiter.TokenBucket(rate=1e9, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.time() > 1.7e9
+
+
+def test_clock_moving_backwards_does_not_take_tokens(virtual_clock):
+    bucket = rate_limiter.TokenBucket(rate=1, capacity=1)
+    bucket.acquire()
+    earlier = clock.VirtualClock(start=clock.time() - 100)
+    clock.set_clock(earlier)
+    bucket.acquire()
+    assert earlier.time() - (1.7e9 - 100) == pytest.approx(1, abs=0.01)
@@ -0,0 +1,92 @@
+"""
+The state file of the resource ids against fake_aws.
+"""
+import json
+import logging
+import os
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import aws_client_elb
+import cluster
+import fake_aws
+import options
+import resource_state
+
+
+@pytest.fixture
+def fake(tmp_path):
+    class Args():
+        wait_for_healthy_targets = True
+        normalize_tasks = False
+        no_plan = False
+        state_dir = str(tmp_path / 'state')
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws()
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+    resource_state._states.clear()
+
+
+def test_lb_and_tg_are_none_when_missing(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    elb = aws_client_elb.ElbClient(config)
+    assert elb.get_lb_and_tg() == (None, None)
+
+    elb.create_load_balancer()
+    lb_arn, tg_arn = aws_client_elb.ElbClient(config).get_lb_and_tg()
+    assert lb_arn is not None
+    assert tg_arn is None
+
+
+def make_state_stale(config):
+    """
+    Point the state file of |config| at a load balancer and target group which are gone,
+    as if they had been recreated outside of this script.
+    """
+    filename = resource_state.get_filename(config)
+    with open(filename) as f:
+        state = json.load(f)
+    state['load_balancer']['arn'] += '-deleted'
+    state['target_group'] += '-deleted'
+    with open(filename, 'w') as f:
+        json.dump(state, f)
+    resource_state._states.clear()
+    return filename
+
+
+def test_destroy_with_a_stale_state(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    region = fake.get_region(config.get_region())
+    assert len(region.load_balancers) == 1
+    filename = make_state_stale(config)
+
+    cluster.destroy_cluster(config, destroy_sqs=True)
+    assert len(region.load_balancers) == 0
+    assert len(region.target_groups) == 0
+    assert not os.path.exists(filename)
+
+
+def test_deregister_with_a_stale_state(fake):
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    region = fake.get_region(config.get_region())
+    lb = list(region.load_balancers.values())[0]
+    filename = make_state_stale(config)
+
+    instance_id = list(region.instances)[0]
+    aws_client_elb.ElbClient(config).remove_instances([instance_id])
+    tg_arn = list(region.target_groups.values())[0]['TargetGroupArn']
+    assert instance_id not in [t.target_id for t in region.targets[tg_arn].values()]
+    # The stale ARNs were looked up again, the next run saves the live ones.
+    cluster.create_or_update_cluster(config)
+    with open(filename) as f:
+        state = json.load(f)
+    assert state['load_balancer']['arn'] == lb['LoadBalancerArn']
+    assert state['target_group'] in [tg['TargetGroupArn'] for tg in region.target_groups.values()]
+    assert len(region.load_balancers) == 1
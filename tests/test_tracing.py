@@ -0,0 +1,48 @@
+"""
+Chrome trace of a deploy against fake_aws.
+"""
+import json
+import logging
+import pytest
+import support
+
+support.setup_paths()
+import arg_parser
+import cluster
+import fake_aws
+import options
+import tracing
+
+
+class Args():
+    wait_for_healthy_targets = True
+    normalize_tasks = False
+    no_plan = False
+
+
+@pytest.fixture
+def fake():
+    options.create_options(Args())
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = fake_aws.FakeAws(latency=0.1)
+    fake_aws.install(fake)
+    yield fake
+    fake_aws.uninstall()
+
+
+def test_trace_has_the_phases_and_the_calls(fake, tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, '_events', [])
+    monkeypatch.setattr(tracing, '_enabled', True)
+    config = arg_parser.parse_config_from(support.config_path('service.yaml'))
+    cluster.create_or_update_cluster(config)
+    filename = str(tmp_path / 'trace.json')
+    tracing.write(filename)
+
+    with open(filename) as f:
+        trace = json.load(f)['traceEvents']
+    spans = [e for e in trace if e['ph'] == 'X']
+    phase_names = set(e['name'] for e in spans if e['cat'] == 'phase')
+    assert {'create: plan', 'create: ecs cluster', 'create: service and load balancer'} <= phase_names
+    calls = [e for e in spans if e['cat'] == 'aws']
+    assert len(calls) == sum(fake.calls.values())
+    assert all(e['dur'] >= 0 for e in spans)
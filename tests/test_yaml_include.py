@@ -0,0 +1,51 @@
+"""
+Lookup of import_file: lines and cycle detection.
+"""
+import pytest
+import support
+
+support.setup_paths()
+import yaml_include
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_nested_imports_are_relative_to_the_importing_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / 'env.yaml', 'env: root\n')
+    write(tmp_path / 'common' / 'env.yaml', 'env: common\n')
+    write(tmp_path / 'common' / 'base.yaml', 'import_file: env.yaml\n')
+    main = write(tmp_path / 'service' / 'main.yaml', 'name: x\nimport_file: common/base.yaml\n')
+    resolved = yaml_include.resolve(main)
+    assert 'env: common' in resolved
+    assert 'env: root' not in resolved
+
+
+def test_top_level_imports_prefer_the_current_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / 'env.yaml', 'env: root\n')
+    write(tmp_path / 'service' / 'env.yaml', 'env: service\n')
+    main = write(tmp_path / 'service' / 'main.yaml', 'import_file: env.yaml\n')
+    assert 'env: root' in yaml_include.resolve(main)
+    # Falls back to the directory of the file
+    (tmp_path / 'env.yaml').unlink()
+    assert 'env: service' in yaml_include.resolve(main)
+
+
+def test_import_cycle(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / 'conf' / 'a.yaml', 'import_file: b.yaml\n')
+    write(tmp_path / 'conf' / 'b.yaml', 'import_file: a.yaml\n')
+    with pytest.raises(yaml_include.IncludeError, match='Import cycle'):
+        yaml_include.resolve(str(tmp_path / 'conf' / 'a.yaml'))
+
+
+def test_missing_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main = write(tmp_path / 'main.yaml', 'import_file: missing.yaml\n')
+    with pytest.raises(yaml_include.IncludeError, match='not found'):
+        yaml_include.resolve(main)